@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Failover drill for the lease-based job leader election.
+
+Starts several worker processes that compete for one probe lease through the
+same LeaseCoordinator the API replicas use, then repeatedly kills whichever
+worker leads and measures how long it takes another one to take over. Each
+takeover must come with a higher fencing token than the one before it.
+
+With SIGKILL the old leader never releases its lease, so takeover waits for
+the lease to expire: expect roughly TTL + renew interval. --graceful sends
+SIGTERM instead, and the leader releases its lease on the way out, so the
+next renewal tick takes over.
+
+Runs against the database configured in .env (MONGO_URL / DB_NAME); only the
+"failover_probe" document in db.leases is touched.
+
+Usage:
+    python lease_failover.py [--workers 3] [--rounds 5] [--ttl 3] [--renew 1] [--graceful]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+
+PROBE_LEASE = "failover_probe"
+
+
+async def worker() -> None:
+    """Compete for the probe lease, printing one line per acquisition, until signalled"""
+    from server import lease_coordinator, client, LEASE_RENEW_SECONDS, WORKER_ID
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    leading_token = None
+    try:
+        while not stop.is_set():
+            try:
+                lease = await lease_coordinator.acquire(PROBE_LEASE)
+            except Exception as e:
+                print(json.dumps({"event": "error", "error": str(e)}), flush=True)
+                lease = None
+            token = lease.token if lease else None
+            if token is not None and token != leading_token:
+                print(json.dumps({"event": "leader", "pid": os.getpid(), "worker": WORKER_ID,
+                                  "token": token, "at": time.time()}), flush=True)
+            leading_token = token
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=LEASE_RENEW_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        await lease_coordinator.release(PROBE_LEASE)
+    finally:
+        client.close()
+
+
+async def spawn(env: dict, events: asyncio.Queue) -> asyncio.subprocess.Process:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), "--worker",
+        env=env, stdout=asyncio.subprocess.PIPE
+    )
+
+    async def pump() -> None:
+        async for line in process.stdout:
+            event = json.loads(line)
+            event["pid"] = process.pid
+            await events.put(event)
+
+    asyncio.create_task(pump())
+    return process
+
+
+async def next_leader(events: asyncio.Queue, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        event = await asyncio.wait_for(events.get(), timeout=max(0.0, deadline - time.monotonic()))
+        if event["event"] == "leader":
+            return event
+        print(f"  worker {event['pid']}: {event.get('error')}")
+
+
+async def drill(args) -> None:
+    env = {**os.environ, "LEASE_TTL_SECONDS": str(args.ttl), "LEASE_RENEW_SECONDS": str(args.renew),
+           "LEASE_CLOCK_SKEW_SECONDS": str(min(args.ttl / 3, 2.0))}
+    events: asyncio.Queue = asyncio.Queue()
+    processes = {}
+    for _ in range(args.workers):
+        process = await spawn(env, events)
+        processes[process.pid] = process
+    bound = args.ttl + args.renew
+    takeovers = []
+    try:
+        leader = await next_leader(events, bound * 3)
+        print(f"Initial leader: pid {leader['pid']} (token {leader['token']})")
+        for round_no in range(1, args.rounds + 1):
+            # Let the leader renew at least once so the drill exercises a live lease
+            await asyncio.sleep(args.renew * 1.5)
+            victim = processes.pop(leader["pid"])
+            killed_at = time.time()
+            if args.graceful:
+                victim.terminate()
+            else:
+                victim.kill()
+            await victim.wait()
+            successor = await next_leader(events, bound * 3)
+            takeover = successor["at"] - killed_at
+            takeovers.append(takeover)
+            fenced = "ok" if successor["token"] > leader["token"] else "NOT INCREASING"
+            print(f"Round {round_no}: pid {leader['pid']} -> pid {successor['pid']} in {takeover:.2f}s "
+                  f"(token {leader['token']} -> {successor['token']}, {fenced})")
+            leader = successor
+            replacement = await spawn(env, events)
+            processes[replacement.pid] = replacement
+    finally:
+        for process in processes.values():
+            process.terminate()
+        await asyncio.gather(*(p.wait() for p in processes.values()))
+
+    if takeovers:
+        takeovers.sort()
+        print(f"\nTakeover over {len(takeovers)} rounds: min {takeovers[0]:.2f}s, "
+              f"median {takeovers[len(takeovers) // 2]:.2f}s, max {takeovers[-1]:.2f}s "
+              f"(expected at most ~{bound:.1f}s after a {'SIGTERM' if args.graceful else 'SIGKILL'})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Kill the lease leader repeatedly and time the takeover")
+    parser.add_argument("--workers", type=int, default=3, help="competing worker processes")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--ttl", type=float, default=3.0, help="LEASE_TTL_SECONDS for the drill")
+    parser.add_argument("--renew", type=float, default=1.0, help="LEASE_RENEW_SECONDS for the drill")
+    parser.add_argument("--graceful", action="store_true", help="SIGTERM the leader so it releases its lease")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        asyncio.run(worker())
+    else:
+        asyncio.run(drill(args))
+
+
+if __name__ == "__main__":
+    main()
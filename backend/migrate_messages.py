@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Online, resumable migration of db.messages to the compact storage schema.
+
+Legacy documents (ObjectId _id + string id, ISO-string timestamp, full dicts) are
+rewritten through encode_message in _id order. The API keeps serving while this
+runs because decode_message reads both forms. Progress is checkpointed in
+db.migrations, so an interrupted run picks up where it stopped.
+
+--backfill-users assigns DEFAULT_USER_ID to sessions, messages, memory,
+transactions and archived sessions written before data was partitioned by
+user. Run it before serving per-user traffic, since every user-facing query
+is now scoped by user_id.
+
+Usage:
+    python migrate_messages.py [--batch-size 500] [--throttle 0.05] [--dry-run] [--backfill-users]
+"""
+
+import argparse
+import asyncio
+
+import bson
+from pymongo.errors import BulkWriteError
+
+from server import db, client, Message, encode_message, DEFAULT_USER_ID
+
+CHECKPOINT_ID = "messages_compact_v1"
+LEGACY_QUERY = {"id": {"$exists": True}}  # compact documents carry the id in _id only
+UNOWNED_QUERY = {"user_id": {"$exists": False}}
+PARTITIONED_COLLECTIONS = ("sessions", "messages", "memory", "transactions", "archived_sessions")
+
+
+async def collection_sizes() -> dict:
+    stats = await db.command("collStats", "messages")
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "index_size": stats.get("totalIndexSize", 0)
+    }
+
+
+def format_savings(before: dict, after: dict) -> str:
+    lines = []
+    for key in ("size", "storage_size", "index_size"):
+        saved = before[key] - after[key]
+        pct = (saved / before[key] * 100) if before[key] else 0.0
+        lines.append(f"  {key:<13} {before[key]:>14,} -> {after[key]:>14,} bytes  ({pct:.1f}% saved)")
+    return "\n".join(lines)
+
+
+async def dry_run(batch_size: int) -> None:
+    """Estimate savings by encoding a sample without writing anything"""
+    remaining = await db.messages.count_documents(LEGACY_QUERY)
+    sample = await db.messages.find(LEGACY_QUERY).limit(batch_size).to_list(batch_size)
+    legacy_bytes = sum(len(bson.encode(doc)) for doc in sample)
+    compact_bytes = sum(len(bson.encode(encode_message(Message(**doc)))) for doc in sample)
+    print(f"Legacy messages remaining: {remaining:,}")
+    if sample:
+        ratio = compact_bytes / legacy_bytes
+        print(f"Sampled {len(sample)} documents: {legacy_bytes:,} -> {compact_bytes:,} bytes "
+              f"({(1 - ratio) * 100:.1f}% smaller)")
+        print(f"Estimated document savings: {int(remaining * (legacy_bytes - compact_bytes) / len(sample)):,} bytes")
+
+
+async def migrate(batch_size: int, throttle: float) -> None:
+    checkpoint = await db.migrations.find_one({"_id": CHECKPOINT_ID}) or {}
+    last_id = checkpoint.get("last_id")
+    migrated = checkpoint.get("migrated", 0)
+    before = checkpoint.get("before") or await collection_sizes()
+    if last_id is not None:
+        print(f"Resuming after {last_id} ({migrated:,} already migrated)")
+
+    while True:
+        query = dict(LEGACY_QUERY)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.messages.find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        legacy_ids = [doc["_id"] for doc in batch]
+        compact = [encode_message(Message(**doc)) for doc in batch]
+        try:
+            await db.messages.insert_many(compact, ordered=False)
+        except BulkWriteError as e:
+            # A crash between insert and delete leaves compact copies behind; those are fine to skip
+            fatal = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if fatal:
+                raise
+        # Only drop the legacy copies once their compact replacements are durable
+        await db.messages.delete_many({"_id": {"$in": legacy_ids}})
+
+        last_id = legacy_ids[-1]
+        migrated += len(batch)
+        await db.migrations.update_one(
+            {"_id": CHECKPOINT_ID},
+            {"$set": {"last_id": last_id, "migrated": migrated, "before": before}},
+            upsert=True
+        )
+        print(f"Migrated {migrated:,} messages")
+        if throttle:
+            await asyncio.sleep(throttle)
+
+    after = await collection_sizes()
+    await db.migrations.update_one({"_id": CHECKPOINT_ID}, {"$set": {"completed": True, "after": after}}, upsert=True)
+    print(f"Done - {migrated:,} messages migrated")
+    print(format_savings(before, after))
+    print("Run the 'compact' command on db.messages to return freed storage to the OS.")
+
+
+async def backfill_users(batch_size: int, throttle: float, dry_run: bool) -> None:
+    """Give every pre-partitioning document the default owner, one _id batch at a time"""
+    for name in PARTITIONED_COLLECTIONS:
+        collection = db[name]
+        remaining = await collection.count_documents(UNOWNED_QUERY)
+        print(f"{name}: {remaining:,} documents without user_id")
+        if dry_run or not remaining:
+            continue
+        updated = 0
+        while True:
+            batch = await collection.find(UNOWNED_QUERY, {"_id": 1}).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            result = await collection.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}, **UNOWNED_QUERY},
+                {"$set": {"user_id": DEFAULT_USER_ID}}
+            )
+            updated += result.modified_count
+            print(f"  {name}: assigned {updated:,} to {DEFAULT_USER_ID}")
+            if throttle:
+                await asyncio.sleep(throttle)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate db.messages to the compact storage schema")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--throttle", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="estimate savings without writing")
+    parser.add_argument("--backfill-users", action="store_true",
+                        help="assign DEFAULT_USER_ID to documents written before per-user partitioning")
+    args = parser.parse_args()
+
+    try:
+        if args.backfill_users:
+            await backfill_users(args.batch_size, args.throttle, args.dry_run)
+        elif args.dry_run:
+            await dry_run(args.batch_size)
+        else:
+            await migrate(args.batch_size, args.throttle)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Offline, resumable rescoring of stored emotional markers after a lexicon change.
+
+Phase 1 streams user messages from db.messages in _id ranges, scores their
+content with EmotionalResonanceEngine.analyze_input across a process pool and
+writes changed markers back with unordered bulk_write batches. Phase 2 rebuilds
+every session's emotional_imprint from the rescored markers with one
+aggregation, using the same per-turn rule as the chat pipeline.
+
+Progress is checkpointed in db.jobs together with a fingerprint of the scoring
+code, so an interrupted run resumes where it stopped while a run after another
+lexicon edit starts over. Sessions archived to cold storage have no hot
+messages and are left untouched until they are rehydrated.
+
+Usage:
+    python reprocess_emotions.py [--batch-size 2000] [--workers N] [--throttle 0.05] [--dry-run] [--restart]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import inspect
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pymongo import UpdateOne
+
+from server import (
+    db, client, emotional_engine, invalidation_bus, EmotionalResonanceEngine, EMOTION_KEYS, DEFAULT_USER_ID,
+    IMPRINT_MARKER, IMPRINT_THRESHOLD, IMPRINT_STRONG, IMPRINT_BASE
+)
+
+JOB_ID = "reprocess_emotions"
+MESSAGE_QUERY = {"role": "user"}
+# Range scans only compare _ids of one BSON type, so each id type is walked separately
+ID_TYPES = ("binData", "objectId", "string")
+
+
+def lexicon_fingerprint() -> str:
+    source = inspect.getsource(EmotionalResonanceEngine.analyze_input)
+    rule = f"{IMPRINT_MARKER}:{IMPRINT_THRESHOLD}:{IMPRINT_STRONG}:{IMPRINT_BASE}"
+    return hashlib.sha256((source + rule).encode()).hexdigest()[:16]
+
+
+def score_batch(contents: list) -> list:
+    """Runs in a worker process: packed markers for each content string"""
+    return [[round(v, 6) for v in map(emotional_engine.analyze_input(text).get, EMOTION_KEYS)] for text in contents]
+
+
+def stored_markers(doc: dict) -> list:
+    markers = doc.get("emotional_markers")
+    if isinstance(markers, dict):
+        return [round(markers.get(k, 0.0), 6) for k in EMOTION_KEYS]
+    return [round(v, 6) for v in markers] if markers else None
+
+
+def marker_update(doc: dict, packed: list) -> UpdateOne:
+    # Legacy documents (pre-codec, still carrying "id") keep the dict form decode_message expects for them
+    value = dict(zip(EMOTION_KEYS, packed)) if "id" in doc else packed
+    return UpdateOne({"_id": doc["_id"]}, {"$set": {"emotional_markers": value}})
+
+
+async def save_checkpoint(checkpoint: dict) -> None:
+    await db.jobs.replace_one({"_id": JOB_ID}, checkpoint, upsert=True)
+
+
+async def rescore_messages(checkpoint: dict, batch_size: int, workers: int, throttle: float, dry_run: bool) -> None:
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    in_flight: deque = deque()
+
+    async def drain_one() -> None:
+        docs, future, type_index = in_flight.popleft()
+        changed = [
+            marker_update(doc, packed)
+            for doc, packed in zip(docs, await future)
+            if packed != stored_markers(doc)
+        ]
+        if changed and not dry_run:
+            await db.messages.bulk_write(changed, ordered=False)
+        checkpoint["scanned"] += len(docs)
+        checkpoint["changed"] += len(changed)
+        checkpoint["type_index"] = type_index
+        checkpoint["last_id"] = docs[-1]["_id"]
+        if not dry_run:
+            await save_checkpoint(checkpoint)
+        rate = checkpoint["scanned"] / max(time.monotonic() - started, 1e-6)
+        print(f"Scanned {checkpoint['scanned']:,} messages, {checkpoint['changed']:,} changed ({rate:,.0f}/s)")
+        if throttle:
+            await asyncio.sleep(throttle)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for type_index in range(checkpoint["type_index"], len(ID_TYPES)):
+            last_id = checkpoint["last_id"] if type_index == checkpoint["type_index"] else None
+            while True:
+                id_range = {"$type": ID_TYPES[type_index]}
+                if last_id is not None:
+                    id_range["$gt"] = last_id
+                docs = await db.messages.find(
+                    {**MESSAGE_QUERY, "_id": id_range}, {"content": 1, "emotional_markers": 1, "id": 1}
+                ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+                if not docs:
+                    break
+                last_id = docs[-1]["_id"]
+                future = loop.run_in_executor(pool, score_batch, [doc.get("content", "") for doc in docs])
+                in_flight.append((docs, future, type_index))
+                # Keep every core busy while writes land strictly in _id order, so the checkpoint never skips a batch
+                if len(in_flight) >= workers * 2:
+                    await drain_one()
+            while in_flight:
+                await drain_one()
+        checkpoint["type_index"] = len(ID_TYPES)
+        checkpoint["last_id"] = None
+
+
+async def rebuild_imprints(checkpoint: dict, batch_size: int, throttle: float, dry_run: bool) -> None:
+    marker_index = EMOTION_KEYS.index(IMPRINT_MARKER)
+    marker_value = {"$cond": [
+        {"$isArray": "$emotional_markers"},
+        {"$arrayElemAt": ["$emotional_markers", marker_index]},
+        f"$emotional_markers.{IMPRINT_MARKER}"
+    ]}
+    pipeline = [
+        {"$match": MESSAGE_QUERY},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "session_id": "$session_id"},
+            "imprint": {"$sum": {"$cond": [{"$gt": [marker_value, IMPRINT_THRESHOLD]}, IMPRINT_STRONG, IMPRINT_BASE]}}
+        }}
+    ]
+    updates = []
+    sessions = 0
+
+    async def flush() -> None:
+        if updates and not dry_run:
+            await db.sessions.bulk_write(updates, ordered=False)
+        updates.clear()
+        if throttle:
+            await asyncio.sleep(throttle)
+
+    async for group in db.messages.aggregate(pipeline, allowDiskUse=True):
+        user_id = group["_id"].get("user_id") or DEFAULT_USER_ID
+        updates.append(UpdateOne(
+            {"user_id": user_id, "id": group["_id"]["session_id"]},
+            {"$set": {"emotional_imprint": round(group["imprint"], 6)}}
+        ))
+        sessions += 1
+        if len(updates) >= batch_size:
+            await flush()
+    await flush()
+    checkpoint["sessions"] = sessions
+    print(f"Rebuilt emotional_imprint for {sessions:,} sessions")
+
+
+async def reprocess(batch_size: int, workers: int, throttle: float, dry_run: bool, restart: bool) -> None:
+    fingerprint = lexicon_fingerprint()
+    checkpoint = await db.jobs.find_one({"_id": JOB_ID})
+    if restart or not checkpoint or checkpoint.get("lexicon") != fingerprint or dry_run:
+        checkpoint = {"_id": JOB_ID, "lexicon": fingerprint, "phase": "messages",
+                      "type_index": 0, "last_id": None, "scanned": 0, "changed": 0}
+    elif checkpoint.get("phase") == "done":
+        print(f"Lexicon {fingerprint} was already fully applied; pass --restart to run again")
+        return
+    else:
+        print(f"Resuming {checkpoint['phase']} phase ({checkpoint['scanned']:,} messages already scanned)")
+
+    if checkpoint["phase"] == "messages":
+        await rescore_messages(checkpoint, batch_size, workers, throttle, dry_run)
+        checkpoint["phase"] = "sessions"
+        if not dry_run:
+            await save_checkpoint(checkpoint)
+
+    if dry_run:
+        print(f"Dry run - {checkpoint['changed']:,} of {checkpoint['scanned']:,} messages would change; nothing written")
+        return
+
+    await rebuild_imprints(checkpoint, batch_size, throttle, dry_run)
+    checkpoint["phase"] = "done"
+    await save_checkpoint(checkpoint)
+    # Running API workers drop their cached trajectories
+    await invalidation_bus.publish("emotions")
+    print(f"Done - {checkpoint['changed']:,} of {checkpoint['scanned']:,} messages rescored")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Rescore stored emotional markers with the current lexicon")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="scoring processes")
+    parser.add_argument("--throttle", type=float, default=0.0, help="seconds to sleep between write batches")
+    parser.add_argument("--dry-run", action="store_true", help="score and count changes without writing")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    args = parser.parse_args()
+
+    try:
+        await reprocess(args.batch_size, max(1, args.workers), args.throttle, args.dry_run, args.restart)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,18 +1,39 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Header
+from fastapi import FastAPI, APIRouter, Cookie, Depends, HTTPException, Header, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.websockets import WebSocketState
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+import bson
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+from pymongo import CursorType, ReturnDocument, UpdateOne
+from pymongo.read_preferences import SecondaryPreferred
+from gridfs.errors import NoFile
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Callable, Awaitable, Tuple
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import httpx
 import asyncio
+import contextvars
+import pymongo
+import numpy as np
 import hashlib
+import json
+import math
+import re
+import zlib
+import gzip
 import random
+import time
+import urllib.parse
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -31,6 +52,9 @@ COHERE_API_KEY = os.environ.get('COHERE_API_KEY')
 # Owner Signature for precedence
 OWNER_SIG = os.environ.get('OWNER_SIG', 'godbot_founder_2025')
 
+# Tenant used when a request does not identify its user
+DEFAULT_USER_ID = os.environ.get('DEFAULT_USER_ID', 'demo_user')
+
 # Create the main app
 app = FastAPI(title="GodBot API - EchelonCore", version="1.0.0")
 api_router = APIRouter(prefix="/api")
@@ -151,6 +175,7 @@ class MemoryLore(BaseModel):
 
 class Message(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     session_id: str
     role: str
     content: str
@@ -183,6 +208,7 @@ class ChatResponse(BaseModel):
 
 class Session(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     name: str = "New Session"
     persona_id: Optional[str] = None
     tier: str = "dev"
@@ -193,6 +219,7 @@ class Session(BaseModel):
 
 class MemoryItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     session_id: str
     content: str
     importance: float = 0.5
@@ -202,7 +229,7 @@ class MemoryItem(BaseModel):
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class UsageStats(BaseModel):
-    user_id: str = "demo_user"
+    user_id: str = DEFAULT_USER_ID
     tier: str = "dev"
     credits_total: int = 50000
     credits_used: int = 0
@@ -216,7 +243,7 @@ class UsageStats(BaseModel):
 
 class CreditTransaction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str = "demo_user"
+    user_id: str = DEFAULT_USER_ID
     amount: int
     type: str
     description: str
@@ -232,7 +259,9 @@ class DreamChainEntry(BaseModel):
     priority: str = "medium"
     confidence: float = 0.7
     source_memories: List[str] = []
+    source_window: Optional[Dict[str, Optional[str]]] = None
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     reviewed: bool = False
 
 class EmotionalState(BaseModel):
@@ -327,10 +356,34 @@ If the user seems stressed, offer to take a breath together or talk it through."
     }
 ]
 
+# Built-in personas ship with the release; a fixed timestamp keeps their responses byte-identical across workers
+DEFAULT_PERSONAS_CREATED_AT = "2026-01-09T00:00:00+00:00"
+
 # =============================================================================
 # EMOTIONAL RESONANCE ENGINE
 # =============================================================================
 
+# (marker, threshold, note) in output order; the last rule only applies to MAGGIE
+STYLE_RULES = (
+    ("stress", 0.5, "User seems stressed. Be calm, reassuring, and solution-focused."),
+    ("curiosity", 0.5, "User is curious. Explore ideas, be expansive and engaging."),
+    ("excitement", 0.5, "User is excited! Match their energy, be enthusiastic."),
+    ("focus", 0.5, "User wants precision. Be direct, specific, and technical."),
+    ("stress", 0.3, "Activate comfort mode. Offer emotional support first.")
+)
+
+# Style guidance for every combination of rules that can fire, joined once up front
+STYLE_TABLE = tuple(
+    " ".join(note for bit, (_, _, note) in enumerate(STYLE_RULES) if (mask >> bit) & 1) or "Respond naturally with warmth."
+    for mask in range(1 << len(STYLE_RULES))
+)
+
+# Per-turn growth of a session's emotional imprint; offline rescoring rebuilds imprints from the same rule
+IMPRINT_MARKER = "excitement"
+IMPRINT_THRESHOLD = 0.3
+IMPRINT_STRONG = 0.01
+IMPRINT_BASE = 0.005
+
 class EmotionalResonanceEngine:
     """Tracks and adapts to creator's emotional state"""
     
@@ -368,26 +421,545 @@ class EmotionalResonanceEngine:
         
         return markers
     
+    def style_mask(self, markers: Dict[str, float], persona_name: str) -> int:
+        mask = 0
+        for bit, (marker, threshold, _) in enumerate(STYLE_RULES[:-1]):
+            if markers.get(marker, 0) > threshold:
+                mask |= 1 << bit
+        marker, threshold, _ = STYLE_RULES[-1]
+        if persona_name == "MAGGIE" and markers.get(marker, 0) > threshold:
+            mask |= 1 << (len(STYLE_RULES) - 1)
+        return mask
+    
+    def imprint_delta(self, markers: Dict[str, float]) -> float:
+        return IMPRINT_STRONG if markers.get(IMPRINT_MARKER, 0) > IMPRINT_THRESHOLD else IMPRINT_BASE
+    
     def adapt_response_style(self, markers: Dict[str, float], persona_name: str) -> str:
         """Generate response style guidance based on emotional state"""
-        style_notes = []
-        
-        if markers.get("stress", 0) > 0.5:
-            style_notes.append("User seems stressed. Be calm, reassuring, and solution-focused.")
-        if markers.get("curiosity", 0) > 0.5:
-            style_notes.append("User is curious. Explore ideas, be expansive and engaging.")
-        if markers.get("excitement", 0) > 0.5:
-            style_notes.append("User is excited! Match their energy, be enthusiastic.")
-        if markers.get("focus", 0) > 0.5:
-            style_notes.append("User wants precision. Be direct, specific, and technical.")
-        
-        if persona_name == "MAGGIE" and markers.get("stress", 0) > 0.3:
-            style_notes.append("Activate comfort mode. Offer emotional support first.")
-        
-        return " ".join(style_notes) if style_notes else "Respond naturally with warmth."
+        return STYLE_TABLE[self.style_mask(markers, persona_name)]
 
 emotional_engine = EmotionalResonanceEngine()
 
+# =============================================================================
+# MESSAGE STORAGE CODEC
+# =============================================================================
+
+# Stored markers are a positional array in this order
+EMOTION_KEYS = ("stress", "curiosity", "frustration", "excitement", "focus", "warmth")
+
+# (field, stored name, default) - defaults are left out of the stored lore
+LORE_FIELDS = (
+    ("memory_class", "c", "project"),
+    ("lore_tag", "t", ""),
+    ("echo_flag", "e", False),
+    ("importance", "i", 0.5)
+)
+
+def _pack_id(message_id: str) -> Any:
+    try:
+        return Binary.from_uuid(uuid.UUID(message_id))
+    except ValueError:
+        return message_id
+
+def _unpack_id(stored_id: Any) -> str:
+    if isinstance(stored_id, Binary):
+        return str(stored_id.as_uuid())
+    return str(stored_id)
+
+def encode_message(message: Message) -> dict:
+    """Compact storage form: UUID _id, BSON date, packed markers, short lore keys, no defaults"""
+    timestamp = datetime.fromisoformat(message.timestamp)
+    doc = {
+        "_id": _pack_id(message.id),
+        "user_id": message.user_id,
+        "session_id": message.session_id,
+        "role": message.role,
+        "content": message.content,
+        "timestamp": timestamp
+    }
+    # BSON dates hold milliseconds; the rest of the microseconds ride along so timestamps round-trip exactly
+    if timestamp.microsecond % 1000:
+        doc["us"] = timestamp.microsecond % 1000
+    if message.persona_id is not None:
+        doc["persona_id"] = message.persona_id
+    if message.metadata:
+        doc["metadata"] = message.metadata
+    if message.fusion_data is not None:
+        doc["fusion_data"] = message.fusion_data
+    if message.lore is not None:
+        doc["lore"] = {
+            short: getattr(message.lore, field)
+            for field, short, default in LORE_FIELDS
+            if getattr(message.lore, field) != default
+        }
+    if message.emotional_markers is not None:
+        doc["emotional_markers"] = [message.emotional_markers.get(k, 0.0) for k in EMOTION_KEYS]
+    return doc
+
+def _unpack_timestamp(doc: dict) -> str:
+    timestamp = doc["timestamp"]
+    microsecond = timestamp.microsecond - timestamp.microsecond % 1000 + doc.get("us", 0)
+    return timestamp.replace(microsecond=microsecond, tzinfo=timezone.utc).isoformat()
+
+def decode_message(doc: dict) -> dict:
+    """Rebuild the API shape of a message from either the compact or the legacy stored form"""
+    if "id" in doc:
+        # Legacy document not yet migrated
+        return {k: v for k, v in doc.items() if k != "_id"}
+    lore = doc.get("lore")
+    markers = doc.get("emotional_markers")
+    return {
+        "id": _unpack_id(doc["_id"]),
+        "user_id": doc.get("user_id", DEFAULT_USER_ID),
+        "session_id": doc["session_id"],
+        "role": doc["role"],
+        "content": doc["content"],
+        "persona_id": doc.get("persona_id"),
+        "timestamp": _unpack_timestamp(doc),
+        "metadata": doc.get("metadata", {}),
+        "fusion_data": doc.get("fusion_data"),
+        "lore": None if lore is None else {field: lore.get(short, default) for field, short, default in LORE_FIELDS},
+        "emotional_markers": None if markers is None else dict(zip(EMOTION_KEYS, markers))
+    }
+
+# =============================================================================
+# DATA ACCESS LAYER
+# =============================================================================
+
+def usage_increment(credits: int, model: str, tokens: int, requests: int = 1) -> Dict[str, int]:
+    return {
+        "credits_used": credits,
+        "credits_remaining": -credits,
+        f"model_usage.{model}": credits,
+        "requests_today": requests,
+        "requests_this_month": requests,
+        "tokens_used": tokens
+    }
+
+INDEX_NOT_FOUND = 27
+
+async def _drop_index(collection, name: str) -> None:
+    try:
+        await collection.drop_index(name)
+    except OperationFailure as e:
+        # Several workers run ensure_indexes on the same deploy; another one may have dropped it first
+        if e.code != INDEX_NOT_FOUND:
+            raise
+
+async def ensure_unique_index(collection, *fields: str) -> None:
+    """Upgrade a plain index to a unique one, keeping a plain index if duplicates block it"""
+    keys = [(field, 1) for field in fields]
+    name = "_".join(f"{field}_1" for field in fields)
+    existing = (await collection.index_information()).get(name)
+    if existing and existing.get("unique"):
+        return
+    # Set when duplicates blocked an earlier attempt; delete it once they are cleaned up to retry
+    blocked_id = f"unique_index:{collection.name}.{name}"
+    if existing and await db.migrations.find_one({"_id": blocked_id}, {"_id": 1}):
+        return
+    if existing:
+        await _drop_index(collection, name)
+    try:
+        await collection.create_index(keys, unique=True, name=name)
+    except (DuplicateKeyError, OperationFailure) as e:
+        logger.error(f"Duplicate {collection.name}.{name} values block the unique index, keeping a plain one "
+                     f"(delete {blocked_id} from db.migrations to retry): {e}")
+        await collection.create_index(keys, name=name)
+        await db.migrations.update_one(
+            {"_id": blocked_id}, {"$set": {"blocked_at": datetime.now(timezone.utc), "error": str(e)}}, upsert=True
+        )
+
+async def drop_superseded_indexes(collection, *names: str) -> None:
+    """Drop indexes replaced by user_id-prefixed ones; they only cost write amplification now"""
+    existing = await collection.index_information()
+    for name in names:
+        if name in existing:
+            await _drop_index(collection, name)
+
+# MongoDB refuses maxStalenessSeconds below 90
+READ_MAX_STALENESS_SECONDS = max(90, int(os.environ.get('READ_MAX_STALENESS_SECONDS', '90')))
+# A secondary may trail by up to the staleness bound, so a writer reads from the primary for that long
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', str(READ_MAX_STALENESS_SECONDS)))
+STALE_READ_PREFERENCE = SecondaryPreferred(max_staleness=READ_MAX_STALENESS_SECONDS)
+
+# Clients echo the time of their last write back (cookie or header) so any worker can honour it
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+# Set by endpoints that can serve slightly stale data; everything else reads from the primary
+stale_reads_ok: contextvars.ContextVar = contextvars.ContextVar("stale_reads_ok", default=False)
+# Per-request holder filled in by note_write; ReadYourWritesMiddleware turns it into the cookie
+request_writes: contextvars.ContextVar = contextvars.ContextVar("request_writes", default=None)
+
+class ReadRouter:
+    """Routes staleness-tolerant reads to secondaries unless the user wrote recently"""
+    
+    def __init__(self):
+        self._recent_writes: Dict[str, float] = {}
+        self.secondary_reads = 0
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.client_pinned = 0
+    
+    def note_write(self, user_id: Optional[str]) -> None:
+        if user_id is None:
+            return
+        writes = request_writes.get()
+        if writes is not None:
+            writes["at"] = time.time()
+        now = time.monotonic()
+        if len(self._recent_writes) >= 10000:
+            self._recent_writes = {u: t for u, t in self._recent_writes.items() if t > now}
+        self._recent_writes[user_id] = now + READ_YOUR_WRITES_SECONDS
+    
+    def client_wrote_recently(self, last_write: Optional[str]) -> bool:
+        """Whether a client-reported write time (epoch seconds) is within the secondaries' staleness bound.
+        
+        The write may have gone through another worker, so the local _recent_writes cannot see it.
+        """
+        try:
+            wrote_at = float(last_write)
+        except (TypeError, ValueError):
+            return False
+        if not math.isfinite(wrote_at) or time.time() - wrote_at >= READ_YOUR_WRITES_SECONDS:
+            return False
+        self.client_pinned += 1
+        return True
+    
+    def collection(self, collection, user_id: Optional[str]):
+        if not stale_reads_ok.get():
+            self.primary_reads += 1
+            return collection
+        if user_id is not None and self._recent_writes.get(user_id, 0) > time.monotonic():
+            # Read-your-writes: this user's last chat turn may not have replicated yet
+            self.pinned_reads += 1
+            return collection
+        self.secondary_reads += 1
+        return collection.with_options(read_preference=STALE_READ_PREFERENCE)
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "max_staleness_seconds": READ_MAX_STALENESS_SECONDS,
+            "secondary_reads": self.secondary_reads,
+            "primary_reads": self.primary_reads,
+            "read_your_writes_pinned": self.pinned_reads,
+            "read_your_writes_client_pinned": self.client_pinned,
+            "recent_writers": sum(1 for t in self._recent_writes.values() if t > now)
+        }
+
+read_router = ReadRouter()
+
+class Repository:
+    """Base for the per-collection repositories"""
+    
+    collection_name = ""
+    
+    @property
+    def collection(self):
+        return db[self.collection_name]
+    
+    def reader(self, user_id: Optional[str] = None):
+        """Collection handle for a read, routed by the calling endpoint's staleness tolerance"""
+        return read_router.collection(self.collection, user_id)
+    
+    async def count(self, user_id: Optional[str] = None) -> int:
+        return await self.reader(user_id).count_documents({} if user_id is None else {"user_id": user_id})
+
+class PersonaRepository(Repository):
+    collection_name = "personas"
+    
+    async def get(self, persona_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": persona_id}, {"_id": 0})
+    
+    async def list(self, limit: int = 100) -> List[dict]:
+        return await self.collection.find({}, {"_id": 0}).to_list(limit)
+    
+    async def create(self, persona: Persona) -> None:
+        await self.collection.insert_one(persona.model_dump())
+    
+    async def ensure_indexes(self) -> None:
+        await ensure_unique_index(self.collection, "id")
+
+class SessionRepository(Repository):
+    """Sessions are partitioned by user_id; every lookup is a (user_id, id) pair"""
+    
+    collection_name = "sessions"
+    
+    async def get(self, user_id: str, session_id: str, projection: Optional[Dict[str, int]] = None) -> Optional[dict]:
+        return await self.reader(user_id).find_one({"user_id": user_id, "id": session_id}, {"_id": 0, **(projection or {})})
+    
+    async def list_recent(self, user_id: str, limit: int = 100) -> List[dict]:
+        return await self.reader(user_id).find({"user_id": user_id}, {"_id": 0}).sort("updated_at", -1).to_list(limit)
+    
+    async def imprints(self, user_id: str, limit: int = 100) -> List[float]:
+        sessions = await self.reader(user_id).find({"user_id": user_id}, {"_id": 0, "emotional_imprint": 1}).to_list(limit)
+        return [s.get("emotional_imprint", 0) for s in sessions]
+    
+    async def ensure(self, user_id: str, specs: Dict[str, Session]) -> None:
+        """Create any missing sessions in one round trip; the unique index makes racing creators safe"""
+        read_router.note_write(user_id)
+        await self.collection.bulk_write(
+            [
+                UpdateOne({"user_id": user_id, "id": sid}, {"$setOnInsert": session.model_dump()}, upsert=True)
+                for sid, session in specs.items()
+            ],
+            ordered=False
+        )
+    
+    async def record_turn(self, user_id: str, session_id: str, update: dict) -> None:
+        read_router.note_write(user_id)
+        await self.collection.update_one({"user_id": user_id, "id": session_id}, update)
+    
+    async def record_turns(self, user_id: str, updates: Dict[str, dict]) -> None:
+        read_router.note_write(user_id)
+        await self.collection.bulk_write(
+            [UpdateOne({"user_id": user_id, "id": sid}, update) for sid, update in updates.items()], ordered=False
+        )
+    
+    async def set_fields(self, user_id: str, session_id: str, fields: Dict[str, Any],
+                         unset: Optional[List[str]] = None) -> None:
+        update: Dict[str, Any] = {"$set": fields}
+        if unset:
+            update["$unset"] = {field: "" for field in unset}
+        await self.collection.update_one({"user_id": user_id, "id": session_id}, update)
+    
+    async def find_keys(self, query: dict, limit: int) -> List[tuple]:
+        """(user_id, session_id) pairs across all users, for background jobs"""
+        sessions = await self.collection.find(query, {"_id": 0, "user_id": 1, "id": 1}).limit(limit).to_list(limit)
+        return [(s.get("user_id", DEFAULT_USER_ID), s["id"]) for s in sessions]
+    
+    async def delete(self, user_id: str, session_id: str) -> bool:
+        read_router.note_write(user_id)
+        result = await self.collection.delete_one({"user_id": user_id, "id": session_id})
+        return result.deleted_count > 0
+    
+    async def ensure_indexes(self) -> None:
+        await ensure_unique_index(self.collection, "user_id", "id")
+        await self.collection.create_index([("user_id", 1), ("updated_at", -1)])
+        await drop_superseded_indexes(self.collection, "id_1", "updated_at_-1")
+
+class MessageRepository(Repository):
+    collection_name = "messages"
+    
+    async def insert(self, *messages: Message) -> None:
+        for user_id in {m.user_id for m in messages}:
+            read_router.note_write(user_id)
+        if len(messages) == 1:
+            await self.collection.insert_one(encode_message(messages[0]))
+        else:
+            await self.collection.insert_many([encode_message(m) for m in messages], ordered=False)
+    
+    async def recent(self, user_id: str, session_id: str, limit: int) -> List[dict]:
+        """Latest messages of a session, oldest first"""
+        docs = await self.reader(user_id).find(
+            {"user_id": user_id, "session_id": session_id}
+        ).sort("timestamp", -1).limit(limit).to_list(limit)
+        return [decode_message(m) for m in reversed(docs)]
+    
+    async def list(self, user_id: str, session_id: str, limit: int) -> List[dict]:
+        docs = await self.reader(user_id).find(
+            {"user_id": user_id, "session_id": session_id}
+        ).sort("timestamp", 1).to_list(limit)
+        return [decode_message(m) for m in docs]
+    
+    async def delete_session(self, user_id: str, session_id: str) -> None:
+        read_router.note_write(user_id)
+        await self.collection.delete_many({"user_id": user_id, "session_id": session_id})
+    
+    async def ensure_indexes(self) -> None:
+        # (user_id, session_id) is also the shard key if the collection is ever sharded
+        await self.collection.create_index([("user_id", 1), ("session_id", 1), ("timestamp", -1)])
+        await drop_superseded_indexes(self.collection, "session_id_1_timestamp_-1")
+
+class MemoryRepository(Repository):
+    collection_name = "memory"
+    
+    async def list_for_session(self, user_id: str, session_id: str, limit: int = 100) -> List[dict]:
+        return await self.reader(user_id).find(
+            {"user_id": user_id, "session_id": session_id}, {"_id": 0}
+        ).sort("importance", -1).to_list(limit)
+    
+    async def insert(self, memory: MemoryItem) -> None:
+        read_router.note_write(memory.user_id)
+        await self.collection.insert_one(memory.model_dump())
+    
+    async def insert_docs(self, docs: List[dict]) -> None:
+        await self.collection.insert_many(docs, ordered=False)
+    
+    async def created_since(self, since: Optional[str]) -> bool:
+        """Whether any memory, for any user, was stored after since (an ISO timestamp; None means ever)"""
+        query = {} if since is None else {"created_at": {"$gt": since}}
+        return await self.collection.find_one(query, {"_id": 1}) is not None
+    
+    async def fingerprints(self, user_id: str, session_id: str, limit: int) -> List[int]:
+        docs = await self.collection.find(
+            {"user_id": user_id, "session_id": session_id, "simhash": {"$exists": True}}, {"_id": 0, "simhash": 1}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+        return [int(doc["simhash"], 16) for doc in reversed(docs)]
+    
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("user_id", 1), ("session_id", 1), ("importance", -1)])
+        await drop_superseded_indexes(self.collection, "session_id_1_importance_-1")
+
+class UsageRepository(Repository):
+    collection_name = "usage"
+    
+    @staticmethod
+    def defaults(user_id: str, tier: str) -> dict:
+        tier_config = TIER_CONFIG.get(tier, TIER_CONFIG["dev"])
+        return {
+            "user_id": user_id,
+            "tier": tier,
+            "credits_total": tier_config["credits_monthly"],
+            "credits_used": 0,
+            "credits_remaining": tier_config["credits_monthly"],
+            "model_usage": {"command_r": 0, "deepseek": 0, "mythomax": 0},
+            "requests_today": 0,
+            "requests_this_month": 0,
+            "tokens_used": 0,
+            "cost_saved": 0.0,
+            "last_request": None,
+            "rollup_day": datetime.now(timezone.utc).date().isoformat()
+        }
+    
+    async def get_or_create(self, user_id: str, tier: str = "dev") -> dict:
+        for attempt in range(2):
+            try:
+                return await self.collection.find_one_and_update(
+                    {"user_id": user_id},
+                    {"$setOnInsert": self.defaults(user_id, tier)},
+                    projection={"_id": 0},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # Lost an upsert race to another request; the document exists now
+                if attempt:
+                    raise
+    
+    async def _update(self, user_id: str, tier: str, update: dict) -> dict:
+        """Apply an update and return the new document; creates the usage record on first use"""
+        usage = await self.collection.find_one_and_update(
+            {"user_id": user_id}, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if usage is None:
+            await self.get_or_create(user_id, tier)
+            usage = await self.collection.find_one_and_update(
+                {"user_id": user_id}, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+            )
+        return usage
+    
+    async def charge(self, user_id: str, tier: str, increments: Dict[str, int]) -> dict:
+        return await self._update(user_id, tier, {
+            "$inc": increments,
+            "$set": {"last_request": datetime.now(timezone.utc).isoformat()}
+        })
+    
+    async def add_credits(self, user_id: str, amount: int) -> dict:
+        return await self._update(user_id, "dev", {"$inc": {"credits_total": amount, "credits_remaining": amount}})
+    
+    async def due_for_rollup(self, today: str, limit: int) -> List[dict]:
+        return await self.collection.find(
+            {"rollup_day": {"$ne": today}},
+            {"_id": 0, "user_id": 1, "rollup_day": 1, "requests_today": 1, "requests_this_month": 1,
+             "tokens_used": 1, "credits_used": 1}
+        ).limit(limit).to_list(limit)
+    
+    async def roll_up(self, usages: List[dict], today: str, lease: Optional["Lease"] = None) -> None:
+        """Snapshot each record's day into usage_daily and start its counters over for today"""
+        yesterday = (date.fromisoformat(today) - timedelta(days=1)).isoformat()
+        snapshots, resets = [], []
+        for usage in usages:
+            day = usage.get("rollup_day") or yesterday
+            snapshots.append(UpdateOne(
+                {"_id": f"{usage['user_id']}:{day}"},
+                {"$set": {
+                    "user_id": usage["user_id"],
+                    "day": day,
+                    "requests": usage.get("requests_today", 0),
+                    "tokens_used_total": usage.get("tokens_used", 0),
+                    "credits_used_total": usage.get("credits_used", 0)
+                }},
+                upsert=True
+            ))
+            # Subtract what was snapshotted rather than zeroing, so requests charged meanwhile are kept;
+            # matching on the old rollup_day makes a repeated pass a no-op
+            inc = {"requests_today": -usage.get("requests_today", 0)}
+            if day[:7] != today[:7]:
+                inc["requests_this_month"] = -usage.get("requests_this_month", 0)
+            resets.append(UpdateOne(
+                {"user_id": usage["user_id"], "rollup_day": usage.get("rollup_day")},
+                {"$inc": inc, "$set": {"rollup_day": today}}
+            ))
+        if snapshots:
+            if lease is not None:
+                await lease.fence()
+            await db.usage_daily.bulk_write(snapshots, ordered=False)
+            await self.collection.bulk_write(resets, ordered=False)
+    
+    async def ensure_indexes(self) -> None:
+        await ensure_unique_index(self.collection, "user_id")
+
+class TransactionRepository(Repository):
+    collection_name = "transactions"
+    
+    async def insert(self, *transactions: CreditTransaction) -> None:
+        for user_id in {tx.user_id for tx in transactions}:
+            read_router.note_write(user_id)
+        if len(transactions) == 1:
+            await self.collection.insert_one(transactions[0].model_dump())
+        else:
+            await self.collection.insert_many([tx.model_dump() for tx in transactions], ordered=False)
+    
+    async def recent(self, user_id: str, limit: int = 10) -> List[dict]:
+        return await self.reader(user_id).find({"user_id": user_id}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("user_id", 1), ("timestamp", -1)])
+
+class DreamRepository(Repository):
+    collection_name = "dreams"
+    
+    async def recent(self, limit: int = 10) -> List[dict]:
+        return await self.collection.find({}, {"_id": 0}).sort("updated_at", -1).limit(limit).to_list(limit)
+    
+    async def upsert(self, dreams: List[DreamChainEntry]) -> None:
+        """One document per insight title: a re-derived insight is refreshed, keeping its id and reviewed flag"""
+        insert_only = ("id", "created_at", "reviewed")
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"title": d.title},
+                    {
+                        "$set": d.model_dump(exclude=set(insert_only)),
+                        "$setOnInsert": d.model_dump(include=set(insert_only))
+                    },
+                    upsert=True
+                )
+                for d in dreams
+            ],
+            ordered=False
+        )
+    
+    async def acknowledge(self, dream_id: str) -> None:
+        await self.collection.update_one({"id": dream_id}, {"$set": {"reviewed": True}})
+    
+    async def ensure_indexes(self) -> None:
+        await ensure_unique_index(self.collection, "id")
+        await ensure_unique_index(self.collection, "title")
+        await self.collection.create_index([("updated_at", -1)])
+
+personas_repo = PersonaRepository()
+sessions_repo = SessionRepository()
+messages_repo = MessageRepository()
+memory_repo = MemoryRepository()
+usage_repo = UsageRepository()
+transactions_repo = TransactionRepository()
+dreams_repo = DreamRepository()
+
+ALL_REPOSITORIES = (personas_repo, sessions_repo, messages_repo, memory_repo, usage_repo, transactions_repo, dreams_repo)
+
 # =============================================================================
 # DREAMCHAIN ENGINE
 # =============================================================================
@@ -428,152 +1000,2530 @@ async def generate_dream_insights() -> List[DreamChainEntry]:
     
     return insights
 
+DREAM_CYCLE_HOURS = float(os.environ.get('DREAM_CYCLE_HOURS', '8'))
+
+async def run_dream_cycle(since: Optional[str] = None) -> List[dict]:
+    """Derive insights from memories stored after since and tell every worker and connected client"""
+    window = {"from": since, "to": datetime.now(timezone.utc).isoformat()}
+    new_dreams = await generate_dream_insights()
+    for dream in new_dreams:
+        dream.source_window = window
+    await dreams_repo.upsert(new_dreams)
+    dreams = await dreams_repo.recent(10)
+    await invalidation_bus.publish("dreams")
+    # DreamChain insights are shared, so every connected user hears about them
+    await event_feed.publish(None, ("dream-generated", {"insights": dreams}))
+    return dreams
+
 # =============================================================================
-# HELPER FUNCTIONS
+# CACHE INVALIDATION BUS
 # =============================================================================
 
-async def get_persona_by_id(persona_id: str) -> Optional[dict]:
-    for p in DEFAULT_PERSONAS:
-        if p["id"] == persona_id:
-            return p
-    persona = await db.personas.find_one({"id": persona_id}, {"_id": 0})
-    return persona
-
-async def get_session_messages(session_id: str, limit: int = 20) -> List[dict]:
-    messages = await db.messages.find(
-        {"session_id": session_id}, {"_id": 0}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
-    return list(reversed(messages))
+WORKER_ID = uuid.uuid4().hex
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+CACHE_FALLBACK_TTL_SECONDS = float(os.environ.get('CACHE_FALLBACK_TTL_SECONDS', '5'))
+BUS_HEARTBEAT_SECONDS = float(os.environ.get('BUS_HEARTBEAT_SECONDS', '2'))
+BUS_MAX_LAG_SECONDS = float(os.environ.get('BUS_MAX_LAG_SECONDS', '10'))
+BUS_COLLECTION_BYTES = int(os.environ.get('BUS_COLLECTION_BYTES', str(8 * 1024 * 1024)))
 
-async def save_message(message: Message) -> None:
-    await db.messages.insert_one(message.model_dump())
+class LocalCache:
+    """Per-worker cache whose entries are dropped by bus events or expire by TTL"""
+    
+    def __init__(self, namespace: str, ttl: float = CACHE_TTL_SECONDS, max_entries: int = 1024):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, tuple] = {}
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            # While the bus lags we cannot trust invalidations to arrive, so fall back to a short TTL
+            ttl = self.ttl if invalidation_bus.healthy else min(self.ttl, CACHE_FALLBACK_TTL_SECONDS)
+            if time.monotonic() - stored_at <= ttl:
+                self.hits += 1
+                return value
+            self._entries.pop(key, None)
+        self.misses += 1
+        return default
+    
+    def set(self, key: str, value: Any) -> None:
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic(), value)
+    
+    def invalidate(self, key: Optional[str] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
 
-async def get_or_create_usage(user_id: str = "demo_user", tier: str = "dev") -> dict:
-    usage = await db.usage.find_one({"user_id": user_id}, {"_id": 0})
-    if not usage:
-        tier_config = TIER_CONFIG.get(tier, TIER_CONFIG["dev"])
-        usage = {
-            "user_id": user_id,
-            "tier": tier,
-            "credits_total": tier_config["credits_monthly"],
-            "credits_used": 0,
-            "credits_remaining": tier_config["credits_monthly"],
-            "model_usage": {"command_r": 0, "deepseek": 0, "mythomax": 0},
-            "requests_today": 0,
-            "requests_this_month": 0,
-            "tokens_used": 0,
-            "cost_saved": 0.0,
-            "last_request": None
+class InvalidationBus:
+    """Fans keyed invalidation events out to every worker through a capped collection"""
+    
+    collection_name = "cache_invalidations"
+    
+    def __init__(self):
+        self.caches: Dict[str, LocalCache] = {}
+        self.last_event_at = 0.0
+        self.published = 0
+        self.received = 0
+        self._tasks: List[asyncio.Task] = []
+    
+    @property
+    def collection(self):
+        return db[self.collection_name]
+    
+    @property
+    def healthy(self) -> bool:
+        """True while our own heartbeats keep coming back through the tailable cursor"""
+        return time.monotonic() - self.last_event_at <= BUS_MAX_LAG_SECONDS
+    
+    def register(self, cache: LocalCache) -> LocalCache:
+        self.caches[cache.namespace] = cache
+        return cache
+    
+    def apply(self, namespace: str, key: Optional[str] = None) -> None:
+        cache = self.caches.get(namespace)
+        if cache:
+            cache.invalidate(key)
+    
+    async def publish(self, namespace: str, key: Optional[str] = None) -> None:
+        """Invalidate locally right away, then tell the other workers"""
+        self.apply(namespace, key)
+        self.published += 1
+        try:
+            await self.collection.insert_one({
+                "ns": namespace,
+                "key": key,
+                "origin": WORKER_ID,
+                "at": datetime.now(timezone.utc)
+            })
+        except Exception as e:
+            # Peers will still converge through the fallback TTL once they notice the lag
+            logger.warning(f"Invalidation publish failed for {namespace}:{key}: {e}")
+    
+    async def start(self) -> None:
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=BUS_COLLECTION_BYTES)
+        except CollectionInvalid:
+            pass
+        self._tasks = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._tail())]
+    
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                await self.collection.insert_one({"ns": "__heartbeat__", "origin": WORKER_ID, "at": datetime.now(timezone.utc)})
+            except Exception as e:
+                logger.warning(f"Invalidation bus heartbeat failed: {e}")
+            await asyncio.sleep(BUS_HEARTBEAT_SECONDS)
+    
+    async def _tail(self) -> None:
+        resume_from = datetime.now(timezone.utc)
+        while True:
+            try:
+                # Re-reading events at the resume boundary is harmless: invalidation is idempotent
+                cursor = self.collection.find(
+                    {"at": {"$gte": resume_from}},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                ).max_await_time_ms(int(BUS_HEARTBEAT_SECONDS * 1000))
+                while cursor.alive:
+                    async for event in cursor:
+                        self.last_event_at = time.monotonic()
+                        resume_from = event["at"]
+                        if event["ns"] != "__heartbeat__" and event.get("origin") != WORKER_ID:
+                            self.received += 1
+                            self.apply(event["ns"], event.get("key"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation bus tail interrupted: {e}")
+            await asyncio.sleep(1)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": WORKER_ID,
+            "healthy": self.healthy,
+            "published": self.published,
+            "received": self.received,
+            "caches": {
+                name: {"entries": len(c._entries), "hits": c.hits, "misses": c.misses}
+                for name, c in self.caches.items()
+            }
         }
-        await db.usage.insert_one(usage)
-    return usage
 
-async def record_transaction(user_id: str, amount: int, type_: str, desc: str, model: str, tier: str):
-    tx = CreditTransaction(
-        user_id=user_id,
-        amount=amount,
-        type=type_,
-        description=desc,
-        model_used=model,
-        tier=tier
-    )
-    await db.transactions.insert_one(tx.model_dump())
-
-async def update_usage(user_id: str, credits: int, model: str, tokens: int):
-    await db.usage.update_one(
-        {"user_id": user_id},
-        {
-            "$inc": {
-                "credits_used": credits,
-                "credits_remaining": -credits,
-                f"model_usage.{model}": credits,
-                "requests_today": 1,
-                "requests_this_month": 1,
-                "tokens_used": tokens
-            },
-            "$set": {"last_request": datetime.now(timezone.utc).isoformat()}
-        }
-    )
+invalidation_bus = InvalidationBus()
+persona_cache = invalidation_bus.register(LocalCache("personas"))
+session_cache = invalidation_bus.register(LocalCache("sessions"))
+dream_cache = invalidation_bus.register(LocalCache("dreams"))
 
-def verify_owner_sig(sig: Optional[str]) -> bool:
-    """Verify owner signature for precedence operations"""
-    if not sig:
-        return False
-    return sig == OWNER_SIG or hashlib.sha256(sig.encode()).hexdigest()[:16] == hashlib.sha256(OWNER_SIG.encode()).hexdigest()[:16]
+# =============================================================================
+# EVENT FEED
+# =============================================================================
 
-def get_fallback_response(prompt: str, persona_name: str, tier: str, emotional_markers: Dict[str, float]) -> str:
-    """Generate intelligent fallback response with emotional awareness"""
-    tier_name = TIER_CONFIG.get(tier, {}).get("name", "Trinity Fusion")
-    
-    # Adjust response based on stress level
-    if emotional_markers.get("stress", 0) > 0.5 and persona_name == "MAGGIE":
-        return f"""Hey, I noticed things might be feeling a bit intense right now.
+EVENT_FEED_BYTES = int(os.environ.get('EVENT_FEED_BYTES', str(32 * 1024 * 1024)))
+EVENT_CLIENT_BUFFER = int(os.environ.get('EVENT_CLIENT_BUFFER', '256'))
+EVENT_KEEPALIVE_SECONDS = float(os.environ.get('EVENT_KEEPALIVE_SECONDS', '15'))
+EVENT_RESUME_SKEW_SECONDS = 5
+EVENT_RETRY_MS = 3000
 
-Take a breath with me. 🌙
+class EventSubscriber:
+    """Bounded buffer for one SSE client; overflowing it ends the stream and the client resumes from the feed"""
+    
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_CLIENT_BUFFER)
+        self.overflowed = False
+    
+    def offer(self, event: dict) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
 
-I'm here, and we'll figure this out together. Even in demo mode, I've got your back.
+def format_sse(event_type: str, data: Any, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
 
-Your message: "{prompt[:50]}..."
+class EventFeed:
+    """Per-user change events in a capped collection, tailed once per worker and fanned out to SSE clients"""
+    
+    collection_name = "event_feed"
+    
+    def __init__(self):
+        self.subscribers: Dict[str, set] = {}
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.resyncs = 0
+        self._seen: deque = deque(maxlen=EVENT_CLIENT_BUFFER * 4)
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def collection(self):
+        return db[self.collection_name]
+    
+    async def publish(self, user_id: Optional[str], *events: tuple) -> None:
+        """Append (type, data) events for one user, or for every user when user_id is None"""
+        if not events:
+            return
+        now = datetime.now(timezone.utc)
+        self.published += len(events)
+        try:
+            await self.collection.insert_many(
+                [{"user_id": user_id, "type": event_type, "data": data, "at": now} for event_type, data in events]
+            )
+        except Exception as e:
+            # Clients still converge on their next full fetch; the write path must not fail over a notification
+            logger.warning(f"Event publish failed for {user_id}: {e}")
+    
+    def subscribe(self, user_id: str) -> EventSubscriber:
+        subscriber = EventSubscriber(user_id)
+        self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: EventSubscriber) -> None:
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.subscribers.pop(subscriber.user_id, None)
+    
+    def dispatch(self, event: dict) -> None:
+        if event["user_id"] is None:
+            targets = [s for subscribers in self.subscribers.values() for s in subscribers]
+        else:
+            targets = list(self.subscribers.get(event["user_id"], ()))
+        for subscriber in targets:
+            if subscriber.offer(event):
+                self.delivered += 1
+            else:
+                self.overflows += 1
+    
+    async def backlog(self, user_id: str, last_event_id: str) -> Optional[List[dict]]:
+        """Events for user_id published after last_event_id, or None once it has aged out of the feed"""
+        try:
+            last_id = ObjectId(last_event_id)
+        except (InvalidId, TypeError):
+            return None
+        cutoff = ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=EVENT_RESUME_SKEW_SECONDS))
+        # Walk newest-first in insertion order, which is the order clients saw; events older than the cutoff
+        # also match so the walk can stop there instead of scanning the whole feed
+        cursor = self.collection.find(
+            {"$or": [{"user_id": {"$in": [user_id, None]}}, {"_id": {"$lt": cutoff}}]}
+        ).sort("$natural", -1)
+        events: List[dict] = []
+        async for event in cursor:
+            if event["_id"] == last_id:
+                return events[::-1]
+            if event["_id"] < cutoff or len(events) >= EVENT_CLIENT_BUFFER:
+                break
+            events.append(event)
+        return None
+    
+    async def stream(self, user_id: str, last_event_id: Optional[str]):
+        """SSE frames for one client: missed events first when resuming, then live ones"""
+        # Subscribe before reading the backlog so nothing published in between is lost
+        subscriber = self.subscribe(user_id)
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            sent = set()
+            if last_event_id:
+                backlog = await self.backlog(user_id, last_event_id)
+                if backlog is None:
+                    # Too far behind to replay: the client refetches everything instead
+                    self.resyncs += 1
+                    yield format_sse("resync", {})
+                else:
+                    for event in backlog:
+                        sent.add(event["_id"])
+                        yield format_sse(event["type"], event["data"], str(event["_id"]))
+            while not subscriber.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event["_id"] not in sent:
+                    yield format_sse(event["type"], event["data"], str(event["_id"]))
+        finally:
+            self.unsubscribe(subscriber)
+    
+    async def start(self) -> None:
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=EVENT_FEED_BYTES)
+        except CollectionInvalid:
+            pass
+        self._task = asyncio.create_task(self._tail())
+    
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _tail(self) -> None:
+        resume_from = datetime.now(timezone.utc)
+        while True:
+            try:
+                cursor = self.collection.find(
+                    {"at": {"$gte": resume_from}},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                ).max_await_time_ms(int(EVENT_KEEPALIVE_SECONDS * 1000))
+                while cursor.alive:
+                    async for event in cursor:
+                        resume_from = event["at"]
+                        # Re-tailing from the resume boundary re-reads a few events; deliver each only once
+                        if event["_id"] in self._seen:
+                            continue
+                        self._seen.append(event["_id"])
+                        self.dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Event feed tail interrupted: {e}")
+            await asyncio.sleep(1)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": sum(len(s) for s in self.subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "resyncs": self.resyncs
+        }
 
-What's weighing on you most? Let's break it down into smaller pieces."""
+event_feed = EventFeed()
 
-    responses = {
-        "GODMIND": f"""[GODMIND - {tier_name} Mode]
+def credits_event(usage: dict) -> tuple:
+    return "credits-changed", {
+        key: usage.get(key) for key in ("credits_total", "credits_used", "credits_remaining", "tokens_used")
+    }
 
-PROCESSING: "{prompt[:80]}{'...' if len(prompt) > 80 else ''}"
+# =============================================================================
+# PROVIDER TRANSPORT
+# =============================================================================
 
-SYSTEM STATUS:
-├─ Mode: {tier_name} (Demo)
-├─ Trinity Stack: Initialized
-├─ Emotional Resonance: Active
-└─ OwnerSig Protocol: Ready
+try:
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
-ANALYSIS:
-The Command Core is operational in demonstration mode. Your query has been received and queued for processing.
+PROVIDER_ENDPOINTS = {
+    "command_r": {
+        "base_url": os.environ.get('COHERE_BASE_URL', 'https://api.cohere.com'),
+        "path": "/v2/chat",
+        "api_key": COHERE_API_KEY,
+        "model": os.environ.get('COHERE_MODEL', 'command-r-plus'),
+        "style": "cohere"
+    },
+    "deepseek": {
+        "base_url": os.environ.get('DEEPSEEK_BASE_URL', 'https://api.deepseek.com'),
+        "path": "/chat/completions",
+        "api_key": DEEPSEEK_API_KEY,
+        "model": os.environ.get('DEEPSEEK_MODEL', 'deepseek-chat'),
+        "style": "openai"
+    },
+    "mythomax": {
+        "base_url": os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1'),
+        "path": "/chat/completions",
+        "api_key": OPENAI_API_KEY or EMERGENT_LLM_KEY,
+        "model": os.environ.get('MYTHOMAX_MODEL', 'gpt-4o-mini'),
+        "style": "openai"
+    }
+}
 
-To unlock full Trinity Fusion capabilities:
-• Configure API keys for Command R+, DeepSeek, and OpenAI
-• Or upgrade to God Mode for unlimited access
+PROVIDER_MAX_CONCURRENCY = int(os.environ.get('PROVIDER_MAX_CONCURRENCY', '16'))
+PROVIDER_POOL_SIZE = int(os.environ.get('PROVIDER_POOL_SIZE', '32'))
+PROVIDER_TIMEOUT_SECONDS = float(os.environ.get('PROVIDER_TIMEOUT_SECONDS', '30'))
+PROVIDER_MAX_RETRIES = int(os.environ.get('PROVIDER_MAX_RETRIES', '2'))
+PROVIDER_BACKOFF_BASE_SECONDS = 0.25
+PROVIDER_BACKOFF_CAP_SECONDS = 4.0
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '30'))
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
 
-The architecture is ready. The vision is clear. We await only the keys to unlock full potential.""",
-        
-        "LUMINA": f"""[LUMINA BUILDER - {tier_name} Mode]
+class ProviderUnavailable(Exception):
+    """Raised when a provider's breaker is open or its retries are exhausted"""
 
-Creating response for: "{prompt[:60]}..."
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single probe through once the reset window passes"""
+    
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, reset_after: float = BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+    
+    @property
+    def probing(self) -> bool:
+        return self._probing
+    
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+    
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+    
+    def abandon_probe(self) -> None:
+        """A probe that never got an answer (cancelled mid-call) counts as a failed probe"""
+        if self._probing:
+            self.record_failure()
 
-I'm ready to build! Currently running in demo mode, but my creative circuits are fully charged.
+class ProviderTransport:
+    """Shared keep-alive client, concurrency cap, retries and breaker for one Trinity model"""
+    
+    def __init__(self, key: str, endpoint: Dict[str, Any]):
+        self.key = key
+        self.endpoint = endpoint
+        self.breaker = CircuitBreaker()
+        self.semaphore = asyncio.Semaphore(PROVIDER_MAX_CONCURRENCY)
+        self.client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.latency_ewma_ms = 0.0
+        self.error_ewma = 0.0
+    
+    @property
+    def configured(self) -> bool:
+        return bool(self.endpoint["api_key"])
+    
+    @property
+    def healthy(self) -> bool:
+        # While the single half-open probe is outstanding every other call would be refused
+        return self.configured and self.breaker.state != "open" and not self.breaker.probing
+    
+    async def start(self) -> None:
+        if not self.configured or self.client is not None:
+            return
+        self.client = httpx.AsyncClient(
+            base_url=self.endpoint["base_url"],
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=PROVIDER_POOL_SIZE,
+                max_keepalive_connections=PROVIDER_POOL_SIZE,
+                keepalive_expiry=60.0
+            ),
+            timeout=httpx.Timeout(PROVIDER_TIMEOUT_SECONDS, connect=5.0),
+            headers={"Authorization": f"Bearer {self.endpoint['api_key']}"}
+        )
+    
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    def _observe(self, latency_ms: Optional[float], failed: bool) -> None:
+        alpha = 0.2
+        if latency_ms is not None:
+            self.latency_ewma_ms = latency_ms if not self.latency_ewma_ms else \
+                (1 - alpha) * self.latency_ewma_ms + alpha * latency_ms
+        self.error_ewma = (1 - alpha) * self.error_ewma + alpha * (1.0 if failed else 0.0)
+        TRINITY_CONFIG[self.key]["enabled"] = self.healthy
+    
+    async def post_json(self, payload: Dict[str, Any], parse: Callable[[Dict[str, Any]], Any] = lambda data: data) -> Any:
+        """POST payload and return parse(response JSON); malformed bodies count as provider failures"""
+        if self.client is None or not self.breaker.allow():
+            raise ProviderUnavailable(f"{self.key} is unavailable ({self.breaker.state})")
+        try:
+            return await self._post_json(payload, parse)
+        except BaseException:
+            # Cancelled mid-call, e.g. by a request deadline: the breaker must not wait on this probe forever
+            self.breaker.abandon_probe()
+            raise
+    
+    async def _post_json(self, payload: Dict[str, Any], parse: Callable[[Dict[str, Any]], Any]) -> Any:
+        self.requests += 1
+        last_error: Optional[Exception] = None
+        for attempt in range(PROVIDER_MAX_RETRIES + 1):
+            if attempt:
+                self.retries += 1
+                backoff = min(PROVIDER_BACKOFF_CAP_SECONDS, PROVIDER_BACKOFF_BASE_SECONDS * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, backoff))
+            try:
+                async with self.semaphore:
+                    self.in_flight += 1
+                    started = time.monotonic()
+                    try:
+                        response = await self.client.post(self.endpoint["path"], json=payload)
+                    finally:
+                        self.in_flight -= 1
+                latency_ms = (time.monotonic() - started) * 1000
+                if response.status_code in RETRYABLE_STATUS:
+                    last_error = httpx.HTTPStatusError(
+                        f"{self.key} returned {response.status_code}", request=response.request, response=response
+                    )
+                    continue
+                response.raise_for_status()
+                result = parse(response.json())
+            except httpx.TransportError as e:
+                last_error = e
+                continue
+            except httpx.HTTPStatusError as e:
+                # Non-retryable (bad key, bad request) - still counts against the provider's health
+                last_error = e
+                break
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                # A 200 whose body is not JSON or not the expected completion shape
+                last_error = e
+                break
+            self.breaker.record_success()
+            self._observe(latency_ms, failed=False)
+            return result
+        
+        self.failures += 1
+        self.breaker.record_failure()
+        self._observe(None, failed=True)
+        raise ProviderUnavailable(f"{self.key} request failed: {last_error}") from last_error
+    
+    async def chat(self, messages: List[Dict[str, str]], max_tokens: int = 1024) -> str:
+        """Send a chat completion and return the reply text"""
+        payload = {"model": self.endpoint["model"], "messages": messages, "max_tokens": max_tokens}
+        return await self.post_json(payload, self.reply_text)
+    
+    def reply_text(self, data: Dict[str, Any]) -> str:
+        if self.endpoint["style"] == "cohere":
+            return "".join(part.get("text", "") for part in data["message"]["content"])
+        content = data["choices"][0]["message"]["content"]
+        if not isinstance(content, str):
+            raise TypeError(f"{self.key} returned non-text content")
+        return content
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": self.configured,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "http2": HTTP2_AVAILABLE,
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1),
+            "error_ewma": round(self.error_ewma, 3)
+        }
 
-Once Trinity Fusion is fully activated:
+class ProviderPool:
+    """Owns one transport per Trinity model for the lifetime of the worker"""
+    
+    def __init__(self):
+        self.transports = {key: ProviderTransport(key, endpoint) for key, endpoint in PROVIDER_ENDPOINTS.items()}
+    
+    def get(self, key: str) -> ProviderTransport:
+        return self.transports[key]
+    
+    def sync_enabled(self) -> None:
+        """Reflect live breaker health (including half-open recovery) into TRINITY_CONFIG"""
+        for key, transport in self.transports.items():
+            TRINITY_CONFIG[key]["enabled"] = transport.healthy
+    
+    async def start(self) -> None:
+        await asyncio.gather(*(t.start() for t in self.transports.values()))
+        self.sync_enabled()
+    
+    async def close(self) -> None:
+        await asyncio.gather(*(t.close() for t in self.transports.values()))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {key: t.stats() for key, t in self.transports.items()}
+
+provider_pool = ProviderPool()
+
+# =============================================================================
+# SINGLE-FLIGHT COALESCING
+# =============================================================================
+
+class SingleFlight:
+    """Coalesces concurrent identical computations into one shared in-flight task"""
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.executions: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+    
+    @staticmethod
+    def make_key(endpoint: str, params: Dict[str, Any]) -> str:
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        return f"{endpoint}:{digest}"
+    
+    async def do(self, endpoint: str, params: Dict[str, Any], fn: Callable[[], Awaitable[Any]]) -> Any:
+        result, _ = await self.do_shared(endpoint, params, fn)
+        return result
+    
+    async def do_shared(self, endpoint: str, params: Dict[str, Any],
+                        fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """do(), also reporting whether this caller joined a run another caller started"""
+        key = self.make_key(endpoint, params)
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            self.executions[endpoint] = self.executions.get(endpoint, 0) + 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        else:
+            self.coalesced[endpoint] = self.coalesced.get(endpoint, 0) + 1
+        # Shield so one waiter disconnecting does not cancel the work the others are waiting on
+        return await asyncio.shield(task), shared
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "executions": dict(self.executions),
+            "duplicates_avoided": dict(self.coalesced),
+            "total_duplicates_avoided": sum(self.coalesced.values())
+        }
+
+single_flight = SingleFlight()
+
+# =============================================================================
+# ADAPTIVE MODEL ROUTER
+# =============================================================================
+
+ROUTER_DECISION_LOG = os.environ.get('ROUTER_DECISION_LOG')
+ROUTER_SIMPLE_THRESHOLD = float(os.environ.get('ROUTER_SIMPLE_THRESHOLD', '0.3'))
+ROUTER_FUSION_THRESHOLD = float(os.environ.get('ROUTER_FUSION_THRESHOLD', '0.6'))
+ROUTER_LATENCY_BUDGET_MS = float(os.environ.get('ROUTER_LATENCY_BUDGET_MS', '4000'))
+
+CODE_MARKERS = ("```", "def ", "class ", "function ", "import ", "=>", "};", "select ", "#include", "</")
+
+# Which request trait each model's role in TRINITY_CONFIG is best at
+MODEL_AFFINITY = {
+    "command_r": "structure",
+    "deepseek": "code",
+    "mythomax": "emotion"
+}
+
+# Decisions are logged at DEBUG; ROUTER_DECISION_LOG captures them as JSON lines for offline replay
+router_logger = logging.getLogger("godbot.router")
+if ROUTER_DECISION_LOG:
+    _router_handler = logging.FileHandler(ROUTER_DECISION_LOG)
+    _router_handler.setFormatter(logging.Formatter('%(message)s'))
+    router_logger.addHandler(_router_handler)
+    router_logger.setLevel(logging.DEBUG)
+    router_logger.propagate = False
+
+class RoutingDecision(BaseModel):
+    models: List[str]
+    primary: Optional[str] = None
+    fusion_mode: str
+    complexity: float
+    reason: str
+
+class ModelRouter:
+    """Picks the Trinity models for a request from cheap features and live provider health"""
+    
+    def extract_features(self, prompt: str, markers: Dict[str, float], tier: str) -> Dict[str, Any]:
+        prompt_lower = prompt.lower()
+        return {
+            "tier": tier,
+            "chars": len(prompt),
+            "words": len(prompt.split()),
+            "has_code": any(m in prompt_lower for m in CODE_MARKERS),
+            "emotion": max(markers.get("stress", 0), markers.get("frustration", 0), markers.get("excitement", 0)),
+            "curiosity": markers.get("curiosity", 0),
+            "focus": markers.get("focus", 0)
+        }
+    
+    def provider_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        snapshot = {}
+        for key, config in TRINITY_CONFIG.items():
+            transport = provider_pool.get(key)
+            snapshot[key] = {
+                "healthy": transport.healthy,
+                "latency_ewma_ms": transport.latency_ewma_ms,
+                "error_ewma": transport.error_ewma,
+                "cost_per_1k": config["cost_per_1k"],
+                "weight": config["weight"]
+            }
+        return snapshot
+    
+    @staticmethod
+    def decide(features: Dict[str, Any], snapshot: Dict[str, Dict[str, Any]],
+               tier_models: List[str], allow_fusion: bool) -> RoutingDecision:
+        """Pure routing function - the decision log stores every input so it can be replayed"""
+        complexity = min(1.0, round(
+            min(features["words"] / 400, 0.4)
+            + (0.35 if features["has_code"] else 0.0)
+            + 0.25 * max(features["emotion"], features["curiosity"], features["focus"]),
+            3
+        ))
+        candidates = [m for m in tier_models if snapshot.get(m, {}).get("healthy")]
+        if not candidates:
+            return RoutingDecision(models=[], fusion_mode="Demo Mode", complexity=complexity, reason="no healthy providers")
+        
+        expected_tokens = features["words"] * 2 + 500
+        
+        def cost(m: str) -> float:
+            stats = snapshot[m]
+            return (stats["cost_per_1k"] * expected_tokens / 1000 * 100
+                    + stats["latency_ewma_ms"] / ROUTER_LATENCY_BUDGET_MS
+                    + 2 * stats["error_ewma"])
+        
+        def fit(m: str) -> float:
+            trait = MODEL_AFFINITY.get(m)
+            if trait == "code":
+                bonus = 1.0 if features["has_code"] else 0.0
+            elif trait == "emotion":
+                bonus = features["emotion"]
+            else:
+                bonus = max(features["focus"], features["curiosity"])
+            return cost(m) - bonus
+        
+        if complexity < ROUTER_SIMPLE_THRESHOLD:
+            primary = min(candidates, key=cost)
+            return RoutingDecision(models=[primary], primary=primary, fusion_mode="Solo-Core",
+                                   complexity=complexity, reason="simple prompt, cheapest fast model")
+        
+        ranked = sorted(candidates, key=fit)
+        if complexity >= ROUTER_FUSION_THRESHOLD and len(ranked) > 1:
+            models = ranked if allow_fusion else ranked[:2]
+            fusion_mode = "Trinity Fusion" if len(models) >= 3 else "Dual-Core"
+            return RoutingDecision(models=models, primary=ranked[0], fusion_mode=fusion_mode,
+                                   complexity=complexity, reason="complex prompt, fusion expected to help")
+        return RoutingDecision(models=[ranked[0]], primary=ranked[0], fusion_mode="Solo-Core",
+                               complexity=complexity, reason=f"specialist for {MODEL_AFFINITY.get(ranked[0], 'general')}")
+    
+    def route(self, prompt: str, markers: Dict[str, float], tier: str) -> RoutingDecision:
+        tier_config = TIER_CONFIG.get(tier, TIER_CONFIG["dev"])
+        features = self.extract_features(prompt, markers, tier)
+        snapshot = self.provider_snapshot()
+        allow_fusion = "full_fusion" in tier_config["features"]
+        decision = self.decide(features, snapshot, tier_config["models"], allow_fusion)
+        router_logger.debug(json.dumps({
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "features": features,
+            "snapshot": snapshot,
+            "tier_models": tier_config["models"],
+            "allow_fusion": allow_fusion,
+            "decision": decision.model_dump()
+        }))
+        return decision
+    
+    @classmethod
+    def replay(cls, path: str) -> Dict[str, int]:
+        """Re-run logged decisions through the current routing logic and count divergences"""
+        replayed = changed = 0
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                decision = cls.decide(record["features"], record["snapshot"], record["tier_models"], record["allow_fusion"])
+                replayed += 1
+                if decision.models != record["decision"]["models"]:
+                    changed += 1
+        return {"replayed": replayed, "changed": changed}
+
+model_router = ModelRouter()
+
+# =============================================================================
+# ADMISSION CONTROL
+# =============================================================================
+
+CHAT_MAX_CONCURRENCY = int(os.environ.get('CHAT_MAX_CONCURRENCY', '32'))
+
+# Paying tiers are served first; ordering follows TIER_CONFIG price so new tiers slot in automatically
+TIER_PRIORITY = {tier: rank for rank, tier in enumerate(sorted(TIER_CONFIG, key=lambda t: -TIER_CONFIG[t]["price"]))}
+
+ADMISSION_POLICY = {
+    "free": {"max_queue": 16, "max_wait": 2.0},
+    "pro": {"max_queue": 64, "max_wait": 5.0},
+    "dev": {"max_queue": 128, "max_wait": 8.0},
+    "god": {"max_queue": 256, "max_wait": 15.0}
+}
+
+class AdmissionController:
+    """Bounded chat concurrency with per-tier priority queues, queue deadlines and load shedding"""
+    
+    def __init__(self, capacity: int = CHAT_MAX_CONCURRENCY):
+        self.capacity = capacity
+        self.active = 0
+        self.service_ewma = 0.5
+        self.queues: Dict[str, deque] = {tier: deque() for tier in TIER_CONFIG}
+        self.admitted = {tier: 0 for tier in TIER_CONFIG}
+        self.shed = {tier: 0 for tier in TIER_CONFIG}
+        self.expired = {tier: 0 for tier in TIER_CONFIG}
+        self.waits: Dict[str, deque] = {tier: deque(maxlen=1024) for tier in TIER_CONFIG}
+    
+    def _retry_after(self, tier: str) -> str:
+        queued = sum(len(self.queues[t]) for t in self.queues if TIER_PRIORITY[t] <= TIER_PRIORITY[tier])
+        return str(max(1, math.ceil(queued * self.service_ewma / self.capacity)))
+    
+    def _reject(self, tier: str, reason: str) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=f"{TIER_CONFIG[tier]['name']} capacity exhausted: {reason}",
+            headers={"Retry-After": self._retry_after(tier)}
+        )
+    
+    @staticmethod
+    def _abandon(queue: deque, waiter: asyncio.Future) -> None:
+        """Drop a waiter that gave up, so it no longer counts against the queue bound"""
+        waiter.cancel()
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+    
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for tier in sorted(self.queues, key=TIER_PRIORITY.get):
+            queue = self.queues[tier]
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    return waiter
+        return None
+    
+    async def acquire(self, tier: str, deadline: Optional["Deadline"] = None) -> None:
+        """Take a slot, queueing for at most the tier's max_wait or what is left of the request's deadline"""
+        started = time.monotonic()
+        if self.active < self.capacity:
+            self.active += 1
+        else:
+            queue = self.queues[tier]
+            if len(queue) >= ADMISSION_POLICY.get(tier, ADMISSION_POLICY["dev"])["max_queue"]:
+                self.shed[tier] += 1
+                raise self._reject(tier, "queue full")
+            max_wait = ADMISSION_POLICY.get(tier, ADMISSION_POLICY["dev"])["max_wait"]
+            if deadline is not None:
+                max_wait = max(0.0, min(max_wait, deadline.remaining()))
+            waiter = asyncio.get_running_loop().create_future()
+            queue.append(waiter)
+            try:
+                await asyncio.wait({waiter}, timeout=max_wait)
+            except asyncio.CancelledError:
+                # The slot may have been handed to us just as the client went away
+                if waiter.done():
+                    self.release()
+                else:
+                    self._abandon(queue, waiter)
+                raise
+            if not waiter.done():
+                self._abandon(queue, waiter)
+                self.expired[tier] += 1
+                if deadline is not None and deadline.remaining() <= 0:
+                    deadline.stage = "admission"
+                    raise deadline.exceeded()
+                raise self._reject(tier, "queue deadline exceeded")
+        self.admitted[tier] += 1
+        self.waits[tier].append(time.monotonic() - started)
+    
+    def release(self) -> None:
+        waiter = self._next_waiter()
+        if waiter is not None:
+            waiter.set_result(None)  # hand the slot over without dropping the active count
+        else:
+            self.active -= 1
+    
+    @asynccontextmanager
+    async def slot(self, tier: str, deadline: Optional["Deadline"] = None):
+        tier = tier if tier in self.queues else "dev"
+        await self.acquire(tier, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.service_ewma = 0.8 * self.service_ewma + 0.2 * (time.monotonic() - started)
+            self.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        tiers = {}
+        for tier in TIER_CONFIG:
+            waits = sorted(self.waits[tier])
+            tiers[tier] = {
+                "priority": TIER_PRIORITY[tier],
+                "queue_depth": sum(1 for w in self.queues[tier] if not w.done()),
+                "admitted": self.admitted[tier],
+                "shed": self.shed[tier],
+                "expired": self.expired[tier],
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_p99_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 1) if waits else 0.0
+            }
+        return {"capacity": self.capacity, "active": self.active, "service_ewma_ms": round(self.service_ewma * 1000, 1), "tiers": tiers}
+
+admission_controller = AdmissionController()
+
+# =============================================================================
+# REQUEST DEADLINES
+# =============================================================================
+
+TIER_DEADLINES = {
+    "free": 10.0,
+    "pro": 30.0,
+    "dev": 45.0,
+    "god": 60.0
+}
+DEADLINE_MAX_SECONDS = float(os.environ.get('DEADLINE_MAX_SECONDS', '120'))
+# Budget held back from generation so a fallback answer can still be written before the deadline
+DEADLINE_RESERVE_SECONDS = float(os.environ.get('DEADLINE_RESERVE_SECONDS', '1.5'))
+
+class Deadline:
+    """Absolute time budget for one request, shared by every stage it passes through"""
+    
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.stage = "start"
+    
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+    
+    def exceeded(self) -> HTTPException:
+        deadline_monitor.expired[self.stage] = deadline_monitor.expired.get(self.stage, 0) + 1
+        return HTTPException(status_code=504, detail=f"Request deadline of {self.budget:g}s exceeded during {self.stage}")
+    
+    def check(self, stage: str) -> None:
+        """Enter the next stage, or give up if the budget is already spent"""
+        self.stage = stage
+        if self.remaining() <= 0:
+            raise self.exceeded()
+    
+    @contextmanager
+    def bound(self):
+        """Cap every Mongo operation inside by the remaining budget (pymongo sends it as maxTimeMS)"""
+        # timeout(0) would mean no limit, so an exhausted budget still gets a token millisecond
+        with pymongo.timeout(max(self.remaining(), 0.001)):
+            try:
+                yield
+            except PyMongoError as e:
+                if e.timeout:
+                    raise self.exceeded()
+                raise
+
+class DeadlineMonitor:
+    """Counters for requests that ran out of time"""
+    
+    def __init__(self):
+        self.degraded = 0
+        self.expired: Dict[str, int] = {}
+    
+    def start(self, tier: str, header: Optional[str]) -> Deadline:
+        """Deadline from the client's X-Request-Timeout seconds, else the tier default"""
+        seconds = TIER_DEADLINES.get(tier, TIER_DEADLINES["dev"])
+        if header is not None:
+            try:
+                seconds = float(header)
+            except ValueError:
+                seconds = float("nan")
+            if not 0 < seconds < float("inf"):
+                raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds")
+        return Deadline(min(seconds, DEADLINE_MAX_SECONDS))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"tier_defaults": TIER_DEADLINES, "degraded": self.degraded, "expired": dict(self.expired)}
+
+deadline_monitor = DeadlineMonitor()
+request_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+def deadline_check(stage: str) -> None:
+    deadline = request_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+# =============================================================================
+# IDEMPOTENCY KEYS
+# =============================================================================
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+# Renewed every third of this while the request runs; a crashed worker's key is taken over once it lapses
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '120'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '30'))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+class IdempotencyStore(Repository):
+    """Keeps the first completed response per Idempotency-Key so client retries replay it instead of re-running"""
+    
+    collection_name = "idempotency"
+    
+    def __init__(self):
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+        self.conflicts = 0
+        self.takeovers = 0
+    
+    @staticmethod
+    def fingerprint(params: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    
+    async def _claim(self, record_id: str, fingerprint: str) -> Optional[dict]:
+        """Take ownership of a key; returns the existing record instead when someone else holds it"""
+        lease = datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "owner": WORKER_ID,
+                "lease_expires_at": lease,
+                "expires_at": lease + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            })
+            return None
+        except DuplicateKeyError:
+            return await self.collection.find_one({"_id": record_id})
+    
+    async def _renew(self, record_id: str) -> None:
+        """Heartbeat for a running request: keep extending our claim so nobody takes it over mid-flight"""
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+            try:
+                await self.collection.update_one(
+                    {"_id": record_id, "status": "pending", "owner": WORKER_ID},
+                    {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}}
+                )
+            except PyMongoError as e:
+                # The next beat retries; only a lapse longer than the whole lease lets a retry take over
+                logger.warning(f"Idempotency lease renewal failed for {record_id}: {e}")
+    
+    async def _take_over(self, record_id: str) -> bool:
+        """Claim a pending key whose owner stopped renewing it (crashed worker)"""
+        now = datetime.now(timezone.utc)
+        lease = now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        taken = await self.collection.find_one_and_update(
+            {"_id": record_id, "status": "pending", "lease_expires_at": {"$lt": now}},
+            {"$set": {"owner": WORKER_ID, "lease_expires_at": lease}}
+        )
+        return taken is not None
+    
+    async def run(self, scope: str, key: str, params: Dict[str, Any],
+                  fn: Callable[[], Awaitable[BaseModel]]) -> tuple:
+        """Run fn once per key; returns (response, replayed)"""
+        if not key or len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_MAX_KEY_LENGTH} characters")
+        record_id = f"{scope}:{key}"
+        fingerprint = self.fingerprint(params)
+        give_up = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.05
+        while True:
+            record = await self._claim(record_id, fingerprint)
+            if record is None:
+                break
+            if record["fingerprint"] != fingerprint:
+                self.conflicts += 1
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            if record["status"] == "done":
+                self.replayed += 1
+                return record["response"], True
+            if await self._take_over(record_id):
+                self.takeovers += 1
+                break
+            # The original request is still running, possibly on another worker - wait for its result
+            if time.monotonic() >= give_up:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": str(max(1, int(IDEMPOTENCY_WAIT_SECONDS / 2)))}
+                )
+            self.waited += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        
+        self.executed += 1
+        heartbeat = asyncio.create_task(self._renew(record_id))
+        try:
+            response = await fn()
+        except BaseException:
+            # Failed attempts are not recorded so the client's retry runs the request again
+            await self.collection.delete_one({"_id": record_id, "status": "pending"})
+            raise
+        finally:
+            heartbeat.cancel()
+        await self.collection.update_one(
+            {"_id": record_id},
+            {
+                "$set": {
+                    "status": "done",
+                    "response": response.model_dump(mode="json"),
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+                },
+                "$unset": {"lease_expires_at": ""}
+            }
+        )
+        return response, False
+    
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "waits": self.waited,
+            "conflicts": self.conflicts,
+            "takeovers": self.takeovers
+        }
+
+idempotency_store = IdempotencyStore()
+
+# =============================================================================
+# SESSION ARCHIVAL
+# =============================================================================
+
+try:
+    import zstandard
+    ARCHIVE_CODEC = "zstd"
+except ImportError:
+    zstandard = None
+    ARCHIVE_CODEC = "zlib"
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')  # store blobs on local disk instead of db.archived_sessions
+ARCHIVE_BATCH_SESSIONS = 100
+# Archive records are BSON documents capped at 16 MB; bigger blobs go to GridFS when not stored on disk
+ARCHIVE_INLINE_MAX_BYTES = 15 * 1024 * 1024
+# A session that failed to archive is left alone this long before the job tries it again
+ARCHIVE_RETRY_SECONDS = float(os.environ.get('ARCHIVE_RETRY_SECONDS', '86400'))
+
+archive_cache = invalidation_bus.register(LocalCache("archive", max_entries=8192))
+
+def _compress(raw: bytes) -> bytes:
+    if ARCHIVE_CODEC == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return zlib.compress(raw, 6)
+
+def _decompress(blob: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to rehydrate this session")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+def _archive_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="archive_blobs")
+
+def _archive_path(user_id: str, session_id: str) -> Path:
+    # Session ids come from clients, so only a digest of them reaches the filesystem
+    digest = hashlib.sha256(f"{user_id}\0{session_id}".encode()).hexdigest()
+    return Path(ARCHIVE_DIR) / f"{digest}.bson.{ARCHIVE_CODEC}"
+
+async def _load_archive_blob(record: dict) -> bytes:
+    if "blob" in record:
+        return record["blob"]
+    if "gridfs_id" in record:
+        stream = await _archive_bucket().open_download_stream(record["gridfs_id"])
+        return await stream.read()
+    return await asyncio.to_thread(Path(record["path"]).read_bytes)
+
+async def _drop_archive_blob(record: dict) -> None:
+    """Remove a blob stored outside its archive record"""
+    if "path" in record:
+        Path(record["path"]).unlink(missing_ok=True)
+    elif "gridfs_id" in record:
+        try:
+            await _archive_bucket().delete(record["gridfs_id"])
+        except NoFile:
+            pass
+
+def _archive_key(user_id: str, session_id: str) -> dict:
+    # Session ids are only unique per user, so the owner is part of the archive record's identity
+    return {"u": user_id, "s": session_id}
+
+def _archive_filter(user_id: str, session_id: str) -> dict:
+    # Records archived before the composite key used the bare session id
+    return {"$or": [{"_id": _archive_key(user_id, session_id)}, {"_id": session_id, "user_id": user_id}]}
+
+class SessionArchive:
+    """Moves idle sessions' messages into one compressed blob each and rehydrates them on read"""
+    
+    def __init__(self):
+        self.archived = 0
+        self.failed = 0
+        self.rehydrated = 0
+        self.bytes_raw = 0
+        self.bytes_stored = 0
+    
+    async def archive_session(self, user_id: str, session_id: str, lease: Optional["Lease"] = None) -> int:
+        scope = {"user_id": user_id, "session_id": session_id}
+        docs = await db.messages.find(scope).sort("timestamp", 1).to_list(None)
+        if not docs:
+            return 0
+        raw = b"".join(bson.encode(d) for d in docs)
+        blob = await asyncio.to_thread(_compress, raw)
+        record = {
+            "_id": _archive_key(user_id, session_id),
+            "user_id": user_id,
+            "codec": ARCHIVE_CODEC,
+            "count": len(docs),
+            "raw_bytes": len(raw),
+            "stored_bytes": len(blob),
+            "archived_at": datetime.now(timezone.utc)
+        }
+        if ARCHIVE_DIR:
+            path = _archive_path(user_id, session_id)
+            await asyncio.to_thread(path.write_bytes, blob)
+            record["path"] = str(path)
+        elif len(blob) > ARCHIVE_INLINE_MAX_BYTES:
+            record["gridfs_id"] = await _archive_bucket().upload_from_stream(f"{user_id}:{session_id}", blob)
+        else:
+            record["blob"] = Binary(blob)
+        if lease is not None:
+            await lease.fence()
+        await db.archived_sessions.replace_one({"_id": record["_id"]}, record, upsert=True)
+        
+        # Only drop the hot copies that made it into the blob
+        if lease is not None:
+            await lease.fence()
+        await db.messages.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        await sessions_repo.set_fields(
+            user_id, session_id, {"archived_at": record["archived_at"].isoformat()}, unset=["archive_failed_at"]
+        )
+        await invalidation_bus.publish("archive", f"{user_id}:{session_id}")
+        self.archived += 1
+        self.bytes_raw += len(raw)
+        self.bytes_stored += len(blob)
+        
+        # A chat turn that raced the archiver must not leave the session split between hot and cold
+        if await db.messages.find_one(scope, {"_id": 1}):
+            await self.rehydrate(user_id, session_id)
+        return len(docs)
+    
+    async def rehydrate(self, user_id: str, session_id: str) -> int:
+        record = await db.archived_sessions.find_one(_archive_filter(user_id, session_id))
+        if not record:
+            return 0
+        blob = await _load_archive_blob(record)
+        docs = bson.decode_all(await asyncio.to_thread(_decompress, blob, record["codec"]))
+        for doc in docs:
+            # Blobs written before messages carried an owner
+            doc.setdefault("user_id", user_id)
+        read_router.note_write(user_id)
+        try:
+            await db.messages.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Documents restored by an earlier, interrupted rehydration are already back
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        await db.archived_sessions.delete_one({"_id": record["_id"]})
+        await sessions_repo.set_fields(
+            user_id, session_id, {"rehydrated_at": datetime.now(timezone.utc).isoformat()}, unset=["archived_at"]
+        )
+        await _drop_archive_blob(record)
+        self.rehydrated += 1
+        return len(docs)
+    
+    async def ensure_hot(self, user_id: str, session_id: str) -> None:
+        """Transparently bring an archived session back before its messages are read"""
+        cache_key = f"{user_id}:{session_id}"
+        if archive_cache.get(cache_key) is False:
+            return
+        if await db.archived_sessions.find_one(_archive_filter(user_id, session_id), {"_id": 1}):
+            await single_flight.do(
+                "rehydrate", {"user_id": user_id, "session_id": session_id},
+                lambda: self.rehydrate(user_id, session_id)
+            )
+        archive_cache.set(cache_key, False)
+    
+    async def discard(self, user_id: str, session_id: str) -> None:
+        record = await db.archived_sessions.find_one_and_delete(
+            _archive_filter(user_id, session_id), {"path": 1, "gridfs_id": 1}
+        )
+        if record:
+            await _drop_archive_blob(record)
+    
+    async def archive_idle_sessions(self, max_age_days: float = ARCHIVE_AFTER_DAYS, lease: Optional["Lease"] = None) -> int:
+        now = datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=max_age_days)).isoformat()
+        retry_cutoff = (now - timedelta(seconds=ARCHIVE_RETRY_SECONDS)).isoformat()
+        query = {
+            "updated_at": {"$lt": cutoff},
+            "$and": [
+                # Not archived yet, or written to again since the last pass
+                {"$or": [{"archived_at": {"$exists": False}}, {"$expr": {"$lt": ["$archived_at", "$updated_at"]}}]},
+                # Sessions someone just reopened stay hot for another full idle period
+                {"$or": [{"rehydrated_at": {"$exists": False}}, {"rehydrated_at": {"$lt": cutoff}}]},
+                # Sessions that failed recently wait out ARCHIVE_RETRY_SECONDS instead of blocking every batch
+                {"$or": [{"archive_failed_at": {"$exists": False}}, {"archive_failed_at": {"$lt": retry_cutoff}}]}
+            ]
+        }
+        archived = 0
+        while True:
+            session_keys = await sessions_repo.find_keys(query, ARCHIVE_BATCH_SESSIONS)
+            if not session_keys:
+                break
+            for user_id, session_id in session_keys:
+                if lease is not None:
+                    lease.check()
+                try:
+                    moved = await self.archive_session(user_id, session_id, lease)
+                except LeaseLost:
+                    raise
+                except Exception as e:
+                    logger.error(f"Archiving session {session_id} of {user_id} failed: {e}")
+                    self.failed += 1
+                    await sessions_repo.set_fields(
+                        user_id, session_id, {"archive_failed_at": datetime.now(timezone.utc).isoformat()}
+                    )
+                    continue
+                if moved == 0:
+                    # Nothing hot to move - mark it so the next pass skips it
+                    await sessions_repo.set_fields(
+                        user_id, session_id, {"archived_at": datetime.now(timezone.utc).isoformat()}
+                    )
+                archived += 1
+        if archived:
+            logger.info(f"Archived {archived} idle sessions")
+        return archived
+    
+    def start(self) -> None:
+        # Archival passes themselves run from the job scheduler, on whichever replica holds the lease
+        if ARCHIVE_AFTER_DAYS > 0 and ARCHIVE_DIR:
+            Path(ARCHIVE_DIR).mkdir(parents=True, exist_ok=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "codec": ARCHIVE_CODEC,
+            "archived": self.archived,
+            "failed": self.failed,
+            "rehydrated": self.rehydrated,
+            "bytes_raw": self.bytes_raw,
+            "bytes_stored": self.bytes_stored
+        }
+
+session_archive = SessionArchive()
+
+# =============================================================================
+# LEADER ELECTION & JOB SCHEDULER
+# =============================================================================
+
+LEASE_TTL_SECONDS = float(os.environ.get('LEASE_TTL_SECONDS', '15'))
+LEASE_RENEW_SECONDS = float(os.environ.get('LEASE_RENEW_SECONDS', '5'))
+# A leader stops trusting its lease this long before the database would hand it to someone else
+LEASE_CLOCK_SKEW_SECONDS = float(os.environ.get('LEASE_CLOCK_SKEW_SECONDS', '2'))
+JOB_RETRY_SECONDS = 60.0
+USAGE_ROLLUP_SECONDS = float(os.environ.get('USAGE_ROLLUP_SECONDS', '3600'))
+USAGE_ROLLUP_BATCH = 500
+
+class LeaseLost(Exception):
+    """This worker no longer holds the lease its job was started under"""
+
+class Lease:
+    """One worker's leadership of one job; token is the fencing token, bumped on every change of holder"""
+    
+    def __init__(self, name: str, token: int, last_completed_at: Optional[datetime]):
+        self.name = name
+        self.token = token
+        self.last_completed_at = last_completed_at
+        self.valid_until = 0.0
+    
+    async def fence(self) -> None:
+        """Re-verify the lease in the database right before a destructive write"""
+        await lease_coordinator.verify(self)
+    
+    @property
+    def valid(self) -> bool:
+        return time.monotonic() < self.valid_until
+    
+    def check(self) -> None:
+        """Call between units of work so a deposed leader stops before touching more data"""
+        if not self.valid:
+            raise LeaseLost(f"Lease on {self.name} (token {self.token}) expired")
+    
+    def due(self, interval: float) -> bool:
+        if self.last_completed_at is None:
+            return True
+        last = self.last_completed_at
+        if last.tzinfo is None:
+            last = last.replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - last).total_seconds() >= interval
+
+class LeaseCoordinator(Repository):
+    """Per-job leases in db.leases: one holder at a time, renewed while held, taken over once expired"""
+    
+    collection_name = "leases"
+    
+    def __init__(self):
+        self.held: Dict[str, Lease] = {}
+        self.acquired = 0
+        self.takeovers = 0
+        self.lost = 0
+    
+    async def acquire(self, name: str) -> Optional[Lease]:
+        """Renew our lease on name, or take it over if it has expired; None while another worker leads"""
+        sent = time.monotonic()
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=LEASE_TTL_SECONDS)
+        lease = self.held.get(name)
+        if lease is not None:
+            renewed = await self.collection.update_one(
+                {"_id": name, "holder": WORKER_ID, "token": lease.token},
+                {"$set": {"expires_at": expires_at, "renewed_at": now}}
+            )
+            if renewed.matched_count:
+                lease.valid_until = sent + LEASE_TTL_SECONDS - LEASE_CLOCK_SKEW_SECONDS
+                return lease
+            self.held.pop(name, None)
+            self.lost += 1
+            logger.warning(f"Lost the {name} lease (token {lease.token}) to another worker")
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": name, "expires_at": {"$lt": now}},
+                {
+                    "$set": {"holder": WORKER_ID, "expires_at": expires_at, "acquired_at": now, "renewed_at": now},
+                    "$inc": {"token": 1}
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The lease exists and is still live, so the filter missed and the upsert collided with it
+            return None
+        lease = Lease(name, doc["token"], doc.get("last_completed_at"))
+        lease.valid_until = sent + LEASE_TTL_SECONDS - LEASE_CLOCK_SKEW_SECONDS
+        self.held[name] = lease
+        self.acquired += 1
+        if doc["token"] > 1:
+            self.takeovers += 1
+        logger.info(f"Leading {name} with fencing token {doc['token']}")
+        return lease
+    
+    async def verify(self, lease: Lease) -> None:
+        """Touch our lease with a token-matched write; raises LeaseLost if it expired or changed hands.
+        
+        A leader paused past its TTL (GC, VM stall) still believes its local lease is valid, so jobs
+        call this before each destructive write instead of trusting lease.check() alone.
+        """
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_one(
+            {"_id": lease.name, "holder": WORKER_ID, "token": lease.token, "expires_at": {"$gt": now}},
+            {"$set": {"fenced_at": now}}
+        )
+        if not result.matched_count:
+            lease.valid_until = 0.0
+            if self.held.get(lease.name) is lease:
+                self.held.pop(lease.name, None)
+                self.lost += 1
+            raise LeaseLost(f"Lease on {lease.name} (token {lease.token}) is no longer ours")
+    
+    async def complete(self, lease: Lease) -> None:
+        """Record a finished run, fenced so a deposed leader cannot overwrite its successor's state"""
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_one(
+            {"_id": lease.name, "holder": WORKER_ID, "token": lease.token},
+            {"$set": {"last_completed_at": now}}
+        )
+        if not result.matched_count:
+            raise LeaseLost(f"Lease on {lease.name} (token {lease.token}) was taken over before the run finished")
+        lease.last_completed_at = now
+    
+    async def release(self, name: str) -> None:
+        """Expire our lease right away so another replica can take over without waiting out the TTL"""
+        lease = self.held.pop(name, None)
+        if lease is not None:
+            await self.collection.update_one(
+                {"_id": name, "holder": WORKER_ID, "token": lease.token},
+                {"$set": {"expires_at": datetime.fromtimestamp(0, timezone.utc)}}
+            )
+    
+    async def ensure_indexes(self) -> None:
+        # Leases are only ever addressed by _id
+        pass
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "held": {name: lease.token for name, lease in self.held.items()},
+            "acquired": self.acquired,
+            "takeovers": self.takeovers,
+            "lost": self.lost
+        }
+
+lease_coordinator = LeaseCoordinator()
+
+class ScheduledJob:
+    def __init__(self, name: str, interval: float, fn: Callable[[Lease], Awaitable[Any]]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.runs = 0
+        self.failures = 0
+        self.interrupted = 0
+        self.last_duration: Optional[float] = None
+        self.retry_at = 0.0
+
+class JobScheduler:
+    """Runs each registered periodic job on exactly one replica at a time, the holder of its lease"""
+    
+    def __init__(self):
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: List[asyncio.Task] = []
+    
+    def register(self, name: str, interval: float, fn: Callable[[Lease], Awaitable[Any]]) -> None:
+        """fn receives the Lease and should call lease.check() between units of work"""
+        self.jobs[name] = ScheduledJob(name, interval, fn)
+    
+    async def _execute(self, job: ScheduledJob, lease: Lease) -> None:
+        started = time.monotonic()
+        try:
+            await job.fn(lease)
+            await lease_coordinator.complete(lease)
+            job.runs += 1
+        except LeaseLost as e:
+            job.interrupted += 1
+            logger.warning(f"Job {job.name} stopped: {e}")
+        except Exception as e:
+            job.failures += 1
+            job.retry_at = time.monotonic() + min(job.interval, JOB_RETRY_SECONDS)
+            logger.warning(f"Job {job.name} failed: {e}")
+        finally:
+            job.last_duration = time.monotonic() - started
+    
+    async def _lead(self, job: ScheduledJob) -> None:
+        running: Optional[asyncio.Task] = None
+        while True:
+            try:
+                lease = await lease_coordinator.acquire(job.name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep going on a lease we can still vouch for; otherwise behave as a follower
+                logger.warning(f"Lease renewal for {job.name} failed: {e}")
+                lease = lease_coordinator.held.get(job.name)
+                lease = lease if lease is not None and lease.valid else None
+            if running is not None and lease is None:
+                running.cancel()
+                await asyncio.gather(running, return_exceptions=True)
+                job.interrupted += 1
+                running = None
+            if running is None and lease is not None and lease.due(job.interval) and time.monotonic() >= job.retry_at:
+                running = asyncio.create_task(self._execute(job, lease))
+            if running is not None:
+                await asyncio.wait({running}, timeout=LEASE_RENEW_SECONDS)
+                if running.done():
+                    running = None
+            else:
+                await asyncio.sleep(LEASE_RENEW_SECONDS)
+    
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._lead(job)) for job in self.jobs.values()]
+    
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for name in list(lease_coordinator.held):
+            try:
+                await lease_coordinator.release(name)
+            except Exception as e:
+                logger.warning(f"Could not release the {name} lease: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leases": lease_coordinator.stats(),
+            "jobs": {
+                name: {
+                    "interval_seconds": job.interval,
+                    "leader": name in lease_coordinator.held,
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "interrupted": job.interrupted,
+                    "last_duration_ms": round(job.last_duration * 1000, 1) if job.last_duration is not None else None
+                }
+                for name, job in self.jobs.items()
+            }
+        }
+
+job_scheduler = JobScheduler()
+
+async def dream_cycle_job(lease: Lease) -> None:
+    since = lease.last_completed_at
+    if since is not None:
+        since = (since if since.tzinfo else since.replace(tzinfo=timezone.utc)).isoformat()
+    # Nothing new to dream about: skipping still completes the run, so the next window starts here
+    if await memory_repo.created_since(since):
+        await lease.fence()
+        await run_dream_cycle(since)
+
+async def roll_up_usage(lease: Lease) -> None:
+    today = datetime.now(timezone.utc).date().isoformat()
+    while True:
+        lease.check()
+        usages = await usage_repo.due_for_rollup(today, USAGE_ROLLUP_BATCH)
+        if not usages:
+            return
+        await usage_repo.roll_up(usages, today, lease)
+
+if ARCHIVE_AFTER_DAYS > 0:
+    job_scheduler.register("archive_sessions", ARCHIVE_INTERVAL_SECONDS,
+                           lambda lease: session_archive.archive_idle_sessions(lease=lease))
+job_scheduler.register("dreamchain", DREAM_CYCLE_HOURS * 3600, dream_cycle_job)
+job_scheduler.register("usage_rollup", USAGE_ROLLUP_SECONDS, roll_up_usage)
+
+# =============================================================================
+# EMOTIONAL TRAJECTORY ANALYTICS
+# =============================================================================
+
+EMOTION_MAX_POINTS = 1000
+emotion_cache = invalidation_bus.register(LocalCache("emotions", max_entries=256))
+
+async def load_emotion_arrays(user_id: str, session_id: str) -> tuple:
+    """Projection-only read of a session's markers into an (n, len(EMOTION_KEYS)) array plus persona labels"""
+    docs = await messages_repo.reader(user_id).find(
+        {"user_id": user_id, "session_id": session_id, "emotional_markers": {"$ne": None}},
+        {"emotional_markers": 1, "persona_id": 1, "_id": 0}
+    ).sort("timestamp", 1).batch_size(10000).to_list(None)
+    rows = []
+    codes = []
+    labels: Dict[str, int] = {}
+    for doc in docs:
+        markers = doc["emotional_markers"]
+        if isinstance(markers, dict):
+            # Legacy (pre-codec) documents still store a dict
+            markers = [markers.get(k, 0.0) for k in EMOTION_KEYS]
+        rows.append(markers)
+        codes.append(labels.setdefault(doc.get("persona_id") or "unknown", len(labels)))
+    matrix = np.asarray(rows, dtype=np.float64).reshape(len(rows), len(EMOTION_KEYS))
+    return matrix, np.asarray(codes, dtype=np.int64), list(labels)
+
+def compute_emotion_trajectory(matrix: np.ndarray, persona_codes: np.ndarray, persona_labels: List[str],
+                               points: int, window: int) -> Dict[str, Any]:
+    """Rolling means, downsampled trajectory and per-persona comparison, all vectorized"""
+    n = len(matrix)
+    result: Dict[str, Any] = {"count": n, "dimensions": list(EMOTION_KEYS), "window": 0,
+                              "mean": {}, "trajectory": {"index": [], "values": {}}, "per_persona": {}}
+    if n == 0:
+        return result
+    
+    overall = matrix.mean(axis=0)
+    result["mean"] = dict(zip(EMOTION_KEYS, np.round(overall, 4).tolist()))
+    
+    # Rolling mean through a cumulative sum: O(n) regardless of window size
+    window = max(1, min(window, n))
+    cumulative = np.cumsum(np.vstack([np.zeros((1, matrix.shape[1])), matrix]), axis=0)
+    rolling = (cumulative[window:] - cumulative[:-window]) / window
+    result["window"] = window
+    
+    # Downsample the rolling series into equal-width buckets
+    buckets = max(1, min(points, len(rolling)))
+    edges = np.linspace(0, len(rolling), buckets + 1).astype(np.int64)
+    sums = np.add.reduceat(rolling, edges[:-1], axis=0)
+    downsampled = sums / np.diff(edges)[:, None]
+    result["trajectory"] = {
+        "index": ((edges[:-1] + edges[1:]) // 2 + window - 1).tolist(),
+        "values": {k: np.round(downsampled[:, i], 4).tolist() for i, k in enumerate(EMOTION_KEYS)}
+    }
+    
+    counts = np.bincount(persona_codes, minlength=len(persona_labels))
+    persona_sums = np.stack(
+        [np.bincount(persona_codes, weights=matrix[:, i], minlength=len(persona_labels)) for i in range(matrix.shape[1])],
+        axis=1
+    )
+    persona_means = persona_sums / counts[:, None]
+    result["per_persona"] = {
+        label: {
+            "count": int(counts[j]),
+            "mean": dict(zip(EMOTION_KEYS, np.round(persona_means[j], 4).tolist())),
+            "delta": dict(zip(EMOTION_KEYS, np.round(persona_means[j] - overall, 4).tolist()))
+        }
+        for j, label in enumerate(persona_labels)
+    }
+    return result
+
+# =============================================================================
+# PROMPT ASSEMBLY
+# =============================================================================
+
+class AssembledPrompt:
+    """Provider-ready messages plus the cache key and byte sizes of what was sent"""
+    
+    def __init__(self, messages: List[Dict[str, str]], prefix_key: str, prefix_bytes: int, total_bytes: int):
+        self.messages = messages
+        self.prefix_key = prefix_key
+        self.prefix_bytes = prefix_bytes
+        self.total_bytes = total_bytes
+    
+    def report(self) -> Dict[str, Any]:
+        return {"prefix_key": self.prefix_key, "prefix_bytes": self.prefix_bytes, "total_bytes": self.total_bytes}
+
+class PromptAssembler:
+    """Compiles each persona's system prefix once and appends only the per-request parts"""
+    
+    def __init__(self):
+        self._prefixes: Dict[str, Dict[str, Any]] = {}
+        self._style_messages = tuple(
+            {"role": "system", "content": note} for note in STYLE_TABLE
+        )
+        self._style_bytes = tuple(len(m["content"].encode()) for m in self._style_messages)
+        self.compiled = 0
+        self.assembled = 0
+    
+    def prefix(self, persona: dict) -> Dict[str, Any]:
+        compiled = self._prefixes.get(persona["id"])
+        # Custom personas are immutable today, but recompile if the prompt ever changes under the same id
+        if compiled is None or compiled["source"] != persona["system_prompt"]:
+            content = persona["system_prompt"]
+            compiled = {
+                "source": persona["system_prompt"],
+                "message": {"role": "system", "content": content},
+                "key": hashlib.sha256(content.encode()).hexdigest()[:16],
+                "bytes": len(content.encode())
+            }
+            self._prefixes[persona["id"]] = compiled
+            self.compiled += 1
+        return compiled
+    
+    def assemble(self, persona: dict, history: List[dict], style_mask: int) -> AssembledPrompt:
+        """Stable persona prefix first so provider-side prompt caching hits; volatile parts last"""
+        prefix = self.prefix(persona)
+        
+        messages = [prefix["message"]]
+        total_bytes = prefix["bytes"]
+        for m in history[:-1]:
+            messages.append({"role": m["role"], "content": m["content"]})
+            total_bytes += len(m["content"].encode())
+        messages.append(self._style_messages[style_mask])
+        total_bytes += self._style_bytes[style_mask]
+        if history:
+            messages.append({"role": history[-1]["role"], "content": history[-1]["content"]})
+            total_bytes += len(history[-1]["content"].encode())
+        
+        self.assembled += 1
+        return AssembledPrompt(messages, prefix["key"], prefix["bytes"], total_bytes)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "compiled_prefixes": len(self._prefixes),
+            "compilations": self.compiled,
+            "assembled": self.assembled,
+            "prefix_keys": {pid: p["key"] for pid, p in self._prefixes.items()}
+        }
+
+prompt_assembler = PromptAssembler()
+
+# =============================================================================
+# MEMORY EXTRACTION
+# =============================================================================
+
+MEMORY_QUEUE_SIZE = int(os.environ.get('MEMORY_QUEUE_SIZE', '10000'))
+MEMORY_WORKERS = int(os.environ.get('MEMORY_WORKERS', '2'))
+MEMORY_BATCH_SIZE = int(os.environ.get('MEMORY_BATCH_SIZE', '50'))
+MEMORY_FLUSH_SECONDS = float(os.environ.get('MEMORY_FLUSH_SECONDS', '2'))
+MEMORY_MIN_IMPORTANCE = float(os.environ.get('MEMORY_MIN_IMPORTANCE', '0.45'))
+MEMORY_MAX_CHARS = 500
+MEMORY_FINGERPRINTS_PER_SESSION = 256
+
+# Lore classes worth promoting, with the base importance each starts from
+MEMORY_CLASS_WEIGHT = {"critical": 0.7, "project": 0.4}
+MEMORY_CUES = ("remember", "important", "always", "never", "deadline", "prefer", "my name", "goal", "must", "decided")
+
+SIMHASH_BITS = 64
+SIMHASH_MAX_DISTANCE = int(os.environ.get('SIMHASH_MAX_DISTANCE', '6'))
+_SIMHASH_MASKS = np.uint64(1) << np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over words and word bigrams; near-identical texts land a few bits apart"""
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    shingles = words + [" ".join(words[i:i + 2]) for i in range(len(words) - 1)]
+    if not shingles:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles)
+    )
+    votes = ((hashes[:, None] & _SIMHASH_MASKS) != 0).sum(axis=0) * 2 - len(shingles)
+    return sum(1 << int(bit) for bit in np.flatnonzero(votes > 0))
+
+def score_importance(message: Message) -> float:
+    text = message.content.lower()
+    score = MEMORY_CLASS_WEIGHT.get(message.lore.memory_class, 0.0)
+    score += min(len(text), 1000) / 1000 * 0.2
+    score += 0.1 * min(3, sum(cue in text for cue in MEMORY_CUES))
+    if message.emotional_markers:
+        score += 0.2 * max(message.emotional_markers.values(), default=0.0)
+    if message.lore.echo_flag:
+        score += 0.2
+    if message.role == "assistant":
+        score -= 0.1
+    return round(max(0.0, min(1.0, score)), 3)
+
+class MemoryExtractor:
+    """Promotes saved chat messages to memories off the request path: queue, score, dedupe, batch insert"""
+    
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=MEMORY_QUEUE_SIZE)
+        self.pending: List[dict] = []
+        self.fingerprints: Dict[str, deque] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.submitted = 0
+        self.dropped = 0
+        self.below_threshold = 0
+        self.duplicates = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.last_dequeued_at: Optional[float] = None  # enqueue time of the newest message a worker picked up
+    
+    def submit(self, *messages: Message) -> None:
+        """Never blocks the caller; when the backlog is full the message is skipped and counted"""
+        for message in messages:
+            if message.lore is None or message.lore.memory_class not in MEMORY_CLASS_WEIGHT:
+                continue
+            try:
+                self.queue.put_nowait((message, time.monotonic()))
+                self.submitted += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+    
+    async def _session_fingerprints(self, user_id: str, session_id: str) -> deque:
+        key = f"{user_id}:{session_id}"
+        known = self.fingerprints.get(key)
+        if known is None:
+            # Seed from what other workers already stored for this session
+            known = deque(await memory_repo.fingerprints(user_id, session_id, MEMORY_FINGERPRINTS_PER_SESSION),
+                          maxlen=MEMORY_FINGERPRINTS_PER_SESSION)
+            if len(self.fingerprints) >= 4096:
+                self.fingerprints.pop(next(iter(self.fingerprints)))
+            self.fingerprints[key] = known
+        return known
+    
+    async def extract(self, message: Message) -> None:
+        importance = score_importance(message)
+        if importance < MEMORY_MIN_IMPORTANCE:
+            self.below_threshold += 1
+            return
+        fingerprint = simhash(message.content)
+        known = await self._session_fingerprints(message.user_id, message.session_id)
+        if any((fingerprint ^ other).bit_count() <= SIMHASH_MAX_DISTANCE for other in known):
+            self.duplicates += 1
+            return
+        known.append(fingerprint)
+        
+        markers = message.emotional_markers or {}
+        memory = MemoryItem(
+            user_id=message.user_id,
+            session_id=message.session_id,
+            content=message.content[:MEMORY_MAX_CHARS],
+            importance=importance,
+            tags=[message.role] + [k for k, v in markers.items() if v >= 0.3] + [t for t in [message.lore.lore_tag] if t],
+            source_model=",".join((message.fusion_data or {}).get("models_used", [])) or message.role,
+            lore=MemoryLore(memory_class=message.lore.memory_class, lore_tag=message.lore.lore_tag,
+                            echo_flag=message.lore.echo_flag, importance=importance)
+        )
+        self.pending.append({**memory.model_dump(), "simhash": format(fingerprint, "016x")})
+        if len(self.pending) >= MEMORY_BATCH_SIZE:
+            await self.flush()
+    
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        await memory_repo.insert_docs(batch)
+        self.written += len(batch)
+        self.batches += 1
+    
+    async def _worker(self) -> None:
+        while True:
+            message, enqueued = await self.queue.get()
+            self.last_dequeued_at = enqueued
+            try:
+                await self.extract(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Memory extraction failed for message {message.id}: {e}")
+            finally:
+                self.queue.task_done()
+    
+    async def _flusher(self) -> None:
+        while True:
+            await asyncio.sleep(MEMORY_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Memory batch write failed: {e}")
+    
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(MEMORY_WORKERS)]
+        self._tasks.append(asyncio.create_task(self._flusher()))
+    
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Whatever was already scored still gets written; messages left in the queue are skipped
+        await self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        backlog = self.queue.qsize()
+        return {
+            "backlog": backlog,
+            "capacity": MEMORY_QUEUE_SIZE,
+            "lag_seconds": round(time.monotonic() - self.last_dequeued_at, 3) if backlog and self.last_dequeued_at else 0.0,
+            "pending_writes": len(self.pending),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "below_threshold": self.below_threshold,
+            "duplicates": self.duplicates,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed
+        }
+
+memory_extractor = MemoryExtractor()
+
+# =============================================================================
+# HELPER FUNCTIONS
+# =============================================================================
+
+async def get_persona_by_id(persona_id: str) -> Optional[dict]:
+    for p in DEFAULT_PERSONAS:
+        if p["id"] == persona_id:
+            return p
+    persona = persona_cache.get(persona_id)
+    if persona is None:
+        persona = await personas_repo.get(persona_id)
+        if persona:
+            persona_cache.set(persona_id, persona)
+    return persona
+
+async def get_session_messages(user_id: str, session_id: str, limit: int = 20) -> List[dict]:
+    await session_archive.ensure_hot(user_id, session_id)
+    return await messages_repo.recent(user_id, session_id, limit)
+
+async def save_message(*messages: Message) -> None:
+    await messages_repo.insert(*messages)
+    memory_extractor.submit(*messages)
+
+async def get_or_create_usage(user_id: str = DEFAULT_USER_ID, tier: str = "dev") -> dict:
+    return await usage_repo.get_or_create(user_id, tier)
+
+async def record_transaction(user_id: str, amount: int, type_: str, desc: str, model: str, tier: str):
+    tx = CreditTransaction(
+        user_id=user_id,
+        amount=amount,
+        type=type_,
+        description=desc,
+        model_used=model,
+        tier=tier
+    )
+    await transactions_repo.insert(tx)
+
+async def update_usage(user_id: str, credits: int, model: str, tokens: int, tier: str = "dev") -> dict:
+    return await usage_repo.charge(user_id, tier, usage_increment(credits, model, tokens))
+
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.@:-]{1,128}$")
+
+def current_user(x_user_id: Optional[str] = Header(None, alias="X-User-Id")) -> str:
+    """Tenant for the request; callers that do not identify themselves share the default user"""
+    if x_user_id is None:
+        return DEFAULT_USER_ID
+    if not USER_ID_PATTERN.match(x_user_id):
+        raise HTTPException(status_code=400, detail="Invalid X-User-Id")
+    return x_user_id
+
+async def stale_reads_user(
+    user_id: str = Depends(current_user),
+    last_write_cookie: Optional[str] = Cookie(None, alias=LAST_WRITE_COOKIE),
+    last_write_header: Optional[str] = Header(None, alias=LAST_WRITE_HEADER)
+) -> str:
+    """current_user for endpoints that may read from secondaries up to READ_MAX_STALENESS_SECONDS behind"""
+    if read_router.client_wrote_recently(last_write_header or last_write_cookie):
+        # Read-your-writes across workers: stay on the primary until any eligible secondary has the write
+        return user_id
+    # Async so the flag is set in the request's own context rather than a threadpool copy
+    stale_reads_ok.set(True)
+    return user_id
+
+def verify_owner_sig(sig: Optional[str]) -> bool:
+    """Verify owner signature for precedence operations"""
+    if not sig:
+        return False
+    return sig == OWNER_SIG or hashlib.sha256(sig.encode()).hexdigest()[:16] == hashlib.sha256(OWNER_SIG.encode()).hexdigest()[:16]
+
+FALLBACK_COMFORT_TEMPLATE = """Hey, I noticed things might be feeling a bit intense right now.
+
+Take a breath with me. 🌙
+
+I'm here, and we'll figure this out together. Even in demo mode, I've got your back.
+
+Your message: "{prompt_50}..."
+
+What's weighing on you most? Let's break it down into smaller pieces."""
+
+# Only the template for the active persona is formatted per request
+FALLBACK_TEMPLATES = {
+    "GODMIND": """[GODMIND - {tier_name} Mode]
+
+PROCESSING: "{prompt_80}{ellipsis_80}"
+
+SYSTEM STATUS:
+├─ Mode: {tier_name} (Demo)
+├─ Trinity Stack: Initialized
+├─ Emotional Resonance: Active
+└─ OwnerSig Protocol: Ready
+
+ANALYSIS:
+The Command Core is operational in demonstration mode. Your query has been received and queued for processing.
+
+To unlock full Trinity Fusion capabilities:
+• Configure API keys for Command R+, DeepSeek, and OpenAI
+• Or upgrade to God Mode for unlimited access
+
+The architecture is ready. The vision is clear. We await only the keys to unlock full potential.""",
+    
+    "LUMINA": """[LUMINA BUILDER - {tier_name} Mode]
+
+Creating response for: "{prompt_60}..."
+
+I'm ready to build! Currently running in demo mode, but my creative circuits are fully charged.
+
+Once Trinity Fusion is fully activated:
 • Full code generation with DeepSeek
 • Architecture diagrams and scaffolds
 • Auto-generated tests and deployment hooks
 
 Let's create something extraordinary together!""",
-        
-        "SENTINEL": f"""[SENTINEL GUARD - {tier_name} Mode]
+    
+    "SENTINEL": """[SENTINEL GUARD - {tier_name} Mode]
 
 SECURITY SCAN INITIATED
-Target: "{prompt[:60]}..."
+Target: "{prompt_60}..."
 
 ASSESSMENT:
 ├─ Threat Level: None Detected
-├─ OwnerSig Status: {'Verified' if True else 'Awaiting'}
+├─ OwnerSig Status: Verified
 ├─ System Integrity: Optimal
 └─ Protection Protocols: Active
 
 Your data is safe. Your intent is protected. I am watching.""",
-        
-        "MAGGIE": f"""Hey there! 💜
+    
+    "MAGGIE": """Hey there! 💜
 
-You said: "{prompt[:60]}..."
+You said: "{prompt_60}..."
 
 I'm Maggie, your comfort companion. Even in demo mode, I'm here for you.
 
 The full Trinity Fusion will make our conversations even richer, but honestly? Just talking is enough sometimes.
 
 What's on your mind?"""
+}
+
+def get_fallback_response(prompt: str, persona_name: str, tier: str, emotional_markers: Dict[str, float]) -> str:
+    """Generate intelligent fallback response with emotional awareness"""
+    # Adjust response based on stress level
+    if emotional_markers.get("stress", 0) > 0.5 and persona_name == "MAGGIE":
+        return FALLBACK_COMFORT_TEMPLATE.format(prompt_50=prompt[:50])
+    
+    template = FALLBACK_TEMPLATES.get(persona_name, FALLBACK_TEMPLATES["GODMIND"])
+    return template.format(
+        tier_name=TIER_CONFIG.get(tier, {}).get("name", "Trinity Fusion"),
+        prompt_80=prompt[:80],
+        ellipsis_80='...' if len(prompt) > 80 else '',
+        prompt_60=prompt[:60]
+    )
+
+async def generate_response(decision: RoutingDecision, persona: dict, request: ChatRequest,
+                            history: List[dict], emotional_markers: Dict[str, float],
+                            style_mask: int) -> Dict[str, Any]:
+    """Run the routed models and fuse their replies, falling back to demo mode when none answer"""
+    if decision.models:
+        prompt = prompt_assembler.assemble(persona, history, style_mask)
+        results = await asyncio.gather(
+            *(provider_pool.get(m).chat(prompt.messages) for m in decision.models), return_exceptions=True
+        )
+        replies = {m: r for m, r in zip(decision.models, results) if isinstance(r, str)}
+        for m, r in zip(decision.models, results):
+            if not isinstance(r, str):
+                logger.warning(f"Provider {m} failed during generation: {r}")
+        if replies:
+            weights = request.custom_weights or {}
+            primary = decision.primary if decision.primary in replies else max(
+                replies, key=lambda m: weights.get(m, TRINITY_CONFIG[m]["weight"])
+            )
+            models_used = list(replies)
+            fusion_mode = "Trinity Fusion" if len(models_used) >= 3 else \
+                          "Dual-Core" if len(models_used) == 2 else "Solo-Core"
+            return {
+                "content": replies[primary],
+                "models_used": models_used,
+                "fusion_mode": fusion_mode,
+                "primary": primary,
+                "prompt": prompt.report()
+            }
+    
+    return {
+        "content": get_fallback_response(request.message, persona["name"], request.tier, emotional_markers),
+        "models_used": ["demo"],
+        "fusion_mode": "Demo Mode",
+        "primary": None,
+        "prompt": None
     }
-    return responses.get(persona_name, responses["GODMIND"])
+
+async def generate_within_deadline(decision: RoutingDecision, persona: dict, request: ChatRequest,
+                                   history: List[dict], emotional_markers: Dict[str, float],
+                                   style_mask: int) -> Dict[str, Any]:
+    """generate_response, answered from the fallback templates when the request deadline runs short"""
+    deadline = request_deadline.get()
+    if deadline is None or not decision.models:
+        return await generate_response(decision, persona, request, history, emotional_markers, style_mask)
+    deadline.check("generation")
+    budget = deadline.remaining() - DEADLINE_RESERVE_SECONDS
+    if budget > 0:
+        try:
+            return await asyncio.wait_for(
+                generate_response(decision, persona, request, history, emotional_markers, style_mask), timeout=budget
+            )
+        except asyncio.TimeoutError:
+            pass
+    deadline_monitor.degraded += 1
+    logger.warning(f"Generation cut short by the {deadline.budget:g}s deadline; answering with the fallback")
+    return {
+        "content": get_fallback_response(request.message, persona["name"], request.tier, emotional_markers),
+        "models_used": ["demo"],
+        "fusion_mode": "Deadline Fallback",
+        "primary": None,
+        "prompt": None
+    }
+
+# =============================================================================
+# CHAT PIPELINE
+# =============================================================================
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '1000'))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '32'))
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest]
+    concurrency: int = 8
+
+async def resolve_persona(persona_id: Optional[str]) -> dict:
+    return await get_persona_by_id(persona_id or "godmind-default") or DEFAULT_PERSONAS[0]
+
+async def ensure_sessions(user_id: str, specs: Dict[str, ChatRequest]) -> None:
+    """Upsert any missing sessions in one round trip; specs maps session_id to its first request"""
+    unknown = [sid for sid in specs if not session_cache.get(f"{user_id}:{sid}")]
+    if not unknown:
+        return
+    await sessions_repo.ensure(user_id, {
+        sid: Session(id=sid, user_id=user_id, persona_id=specs[sid].persona_id, tier=specs[sid].tier)
+        for sid in unknown
+    })
+    # Sessions are only ever created or deleted through the chat paths, so existence is safe to cache per worker
+    for sid in unknown:
+        session_cache.set(f"{user_id}:{sid}", True)
+
+class ChatTurn:
+    """One user/assistant exchange, shared by the single and batch chat paths"""
+    
+    def __init__(self, request: ChatRequest, user_id: str, session_id: str, persona: dict):
+        self.request = request
+        self.user_id = user_id
+        self.session_id = session_id
+        self.persona = persona
+        self.persona_id = request.persona_id or "godmind-default"
+        self.is_owner = verify_owner_sig(request.owner_sig)
+        
+        # Analyze emotional context
+        self.emotional_markers = emotional_engine.analyze_input(request.message)
+        self.style_mask = emotional_engine.style_mask(self.emotional_markers, persona["name"])
+        self.style_guidance = STYLE_TABLE[self.style_mask]
+        self.imprint_delta = emotional_engine.imprint_delta(self.emotional_markers)
+        
+        # Calculate credits
+        self.estimated_tokens = len(request.message.split()) * 2 + 500
+        self.credits = max(10, self.estimated_tokens // 10)
+        
+        self.user_message = Message(
+            user_id=user_id,
+            session_id=session_id,
+            role="user",
+            content=request.message,
+            persona_id=self.persona_id,
+            emotional_markers=self.emotional_markers,
+            lore=MemoryLore(memory_class="project" if len(request.message) > 100 else "discardable")
+        )
+        self.assistant_message: Optional[Message] = None
+        self.generation: Dict[str, Any] = {}
+    
+    async def generate(self, history: List[dict]) -> None:
+        """Route to the models likely to help, then build the assistant message"""
+        decision = model_router.route(self.request.message, self.emotional_markers, self.request.tier)
+        self.generation = await generate_within_deadline(
+            decision, self.persona, self.request, history, self.emotional_markers, self.style_mask
+        )
+        self.assistant_message = Message(
+            user_id=self.user_id,
+            session_id=self.session_id,
+            role="assistant",
+            content=self.generation["content"],
+            persona_id=self.persona_id,
+            fusion_data={
+                "models_used": self.generation["models_used"],
+                "fusion_mode": self.generation["fusion_mode"],
+                "routing": {"complexity": decision.complexity, "reason": decision.reason},
+                "prompt": self.generation["prompt"]
+            },
+            lore=MemoryLore(memory_class="project", echo_flag=self.is_owner)
+        )
+    
+    @property
+    def usage_model(self) -> str:
+        return self.generation["primary"] or "mythomax"
+    
+    def transaction(self) -> CreditTransaction:
+        return CreditTransaction(
+            user_id=self.user_id,
+            amount=self.credits,
+            type="debit",
+            description=f"Chat with {self.persona['name']}",
+            model_used=",".join(self.generation["models_used"]),
+            tier=self.request.tier
+        )
+    
+    def session_update(self) -> dict:
+        return {
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+            "$inc": {"message_count": 2, "emotional_imprint": self.imprint_delta}
+        }
+    
+    def events(self, update: dict, usage: dict) -> List[tuple]:
+        """Feed events for a persisted turn, given its session update and the charged usage record"""
+        return self.message_events() + [
+            ("session-updated", {
+                "session_id": self.session_id,
+                "updated_at": update["$set"]["updated_at"],
+                "messages_added": update["$inc"]["message_count"]
+            }),
+            credits_event(usage)
+        ]
+    
+    def message_events(self) -> List[tuple]:
+        return [
+            ("message-added", {
+                "id": m.id, "session_id": m.session_id, "role": m.role, "content": m.content,
+                "persona_id": m.persona_id, "timestamp": m.timestamp
+            })
+            for m in (self.user_message, self.assistant_message)
+        ]
+    
+    def response(self) -> ChatResponse:
+        return ChatResponse(
+            id=self.assistant_message.id,
+            session_id=self.session_id,
+            content=self.assistant_message.content,
+            persona_id=self.persona_id,
+            timestamp=self.assistant_message.timestamp,
+            fusion_mode=self.generation["fusion_mode"],
+            models_used=self.generation["models_used"],
+            credits_used=self.credits,
+            emotional_resonance={
+                "detected": self.emotional_markers,
+                "adaptation": self.style_guidance,
+                "imprint_strength": self.imprint_delta
+            }
+        )
+
+class ChatBatchWriter:
+    """Buffers completed batch turns and persists them with a handful of bulk writes"""
+    
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.turns: List[ChatTurn] = []
+    
+    def add(self, turn: ChatTurn) -> None:
+        self.turns.append(turn)
+    
+    async def flush(self) -> None:
+        if not self.turns:
+            return
+        turns, self.turns = self.turns, []
+        
+        messages = []
+        for turn in turns:
+            messages.extend([turn.user_message, turn.assistant_message])
+        await messages_repo.insert(*messages)
+        memory_extractor.submit(*messages)
+        await transactions_repo.insert(*(turn.transaction() for turn in turns))
+        
+        usage_inc: Dict[str, int] = {}
+        for turn in turns:
+            for field, value in usage_increment(turn.credits, turn.usage_model, turn.estimated_tokens).items():
+                usage_inc[field] = usage_inc.get(field, 0) + value
+        usage = await usage_repo.charge(self.user_id, turns[0].request.tier, usage_inc)
+        
+        session_inc: Dict[str, Dict[str, float]] = {}
+        for turn in turns:
+            inc = session_inc.setdefault(turn.session_id, {"message_count": 0, "emotional_imprint": 0.0})
+            inc["message_count"] += 2
+            inc["emotional_imprint"] += turn.imprint_delta
+        now = datetime.now(timezone.utc).isoformat()
+        await sessions_repo.record_turns(
+            self.user_id, {sid: {"$set": {"updated_at": now}, "$inc": inc} for sid, inc in session_inc.items()}
+        )
+        
+        events = [event for turn in turns for event in turn.message_events()]
+        events.extend(
+            ("session-updated", {"session_id": sid, "updated_at": now, "messages_added": inc["message_count"]})
+            for sid, inc in session_inc.items()
+        )
+        await event_feed.publish(self.user_id, *events, credits_event(usage))
+
+async def stream_chat_batch(batch: BatchChatRequest, user_id: str):
+    """Yield one NDJSON line per item, persisting finished turns in bulk before reporting them"""
+    session_ids = [r.session_id or str(uuid.uuid4()) for r in batch.requests]
+    
+    # Shared lookups: each distinct persona and session is resolved once for the whole batch
+    personas = {pid: await resolve_persona(pid) for pid in {r.persona_id for r in batch.requests}}
+    specs: Dict[str, ChatRequest] = {}
+    for sid, req in zip(session_ids, batch.requests):
+        specs.setdefault(sid, req)
+    await ensure_sessions(user_id, specs)
+    histories: Dict[str, asyncio.Task] = {}
+    
+    semaphore = asyncio.Semaphore(max(1, min(batch.concurrency, BATCH_MAX_CONCURRENCY)))
+    writer = ChatBatchWriter(user_id)
+    
+    async def run_item(index: int, request: ChatRequest) -> Tuple[Dict[str, Any], Optional[ChatTurn]]:
+        sid = session_ids[index]
+        try:
+            async with semaphore, admission_controller.slot(request.tier):
+                if sid not in histories:
+                    histories[sid] = asyncio.ensure_future(get_session_messages(user_id, sid))
+                turn = ChatTurn(request, user_id, sid, personas[request.persona_id])
+                await turn.generate(list(await histories[sid]) + [turn.user_message.model_dump()])
+            return {"index": index, "ok": True, "response": turn.response().model_dump()}, turn
+        except HTTPException as e:
+            return {"index": index, "ok": False, "status": e.status_code, "error": e.detail}, None
+        except Exception as e:
+            logger.warning(f"Batch chat item {index} failed: {e}")
+            return {"index": index, "ok": False, "status": 500, "error": str(e)}, None
+    
+    async def flush(held: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Report buffered turns as ok only once their bulk write has gone through"""
+        try:
+            await writer.flush()
+        except Exception as e:
+            logger.error(f"Batch chat flush of {len(held)} turns failed: {e}")
+            return [{"index": r["index"], "ok": False, "status": 500, "error": "Response could not be saved"} for r in held]
+        return held
+    
+    tasks = [asyncio.create_task(run_item(i, r)) for i, r in enumerate(batch.requests)]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Turns that finished together share one flush; failures need no write and go out first
+            held = []
+            for task in done:
+                result, turn = task.result()
+                if turn is None:
+                    yield json.dumps(result) + "\n"
+                else:
+                    writer.add(turn)
+                    held.append(result)
+            if held:
+                for result in await flush(held):
+                    yield json.dumps(result) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+        await writer.flush()
+
+# =============================================================================
+# WEBSOCKET CHAT SESSIONS
+# =============================================================================
+
+WS_HEARTBEAT_SECONDS = float(os.environ.get('WS_HEARTBEAT_SECONDS', '20'))
+WS_IDLE_TIMEOUT_SECONDS = float(os.environ.get('WS_IDLE_TIMEOUT_SECONDS', '60'))
+WS_SEND_TIMEOUT_SECONDS = 10.0
+WS_MAX_PENDING = 8
+WS_HISTORY_LIMIT = 20
+
+class ChatConnection:
+    """Persona, session, usage and history kept resident for the life of one WebSocket"""
+    
+    def __init__(self, websocket: WebSocket, user_id: str, session_id: str, persona_id: Optional[str], tier: str,
+                 persona: dict, usage: dict, history: List[dict]):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.session_id = session_id
+        self.persona_id = persona_id
+        self.tier = tier
+        self.persona = persona
+        self.usage = usage
+        self.history = history
+        # Bounded inbox: when it fills we stop reading, and TCP pushes back on the client
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_PENDING)
+        self.last_seen = time.monotonic()
+    
+    async def send(self, payload: Dict[str, Any]) -> None:
+        # A client that stops draining its socket is dropped instead of pinning server memory
+        await asyncio.wait_for(self.websocket.send_json(payload), timeout=WS_SEND_TIMEOUT_SECONDS)
+    
+    async def reader(self) -> None:
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            self.last_seen = time.monotonic()
+            try:
+                frame = json.loads(message.get("text") or message.get("bytes") or "")
+            except ValueError:
+                # Queued like any frame so the processor reports it in order with the ones around it
+                frame = None
+            if isinstance(frame, dict) and frame.get("type") == "pong":
+                continue
+            await self.inbox.put(frame)
+    
+    async def heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            if time.monotonic() - self.last_seen > WS_IDLE_TIMEOUT_SECONDS:
+                await self.websocket.close(code=1001)
+                return
+            await self.send({"type": "ping"})
+    
+    async def processor(self) -> None:
+        while True:
+            frame = await self.inbox.get()
+            if not isinstance(frame, dict):
+                await self.send({"type": "error", "status": 422, "error": "frame must be a JSON object"})
+                continue
+            if not isinstance(frame.get("message"), str) or not frame["message"].strip():
+                await self.send({"type": "error", "status": 422, "error": "message is required"})
+                continue
+            try:
+                request = ChatRequest(
+                    message=frame["message"],
+                    session_id=self.session_id,
+                    persona_id=self.persona_id,
+                    tier=self.tier,
+                    custom_weights=frame.get("custom_weights"),
+                    owner_sig=frame.get("owner_sig")
+                )
+            except ValidationError as e:
+                await self.send({"type": "error", "status": 422,
+                                 "error": e.errors(include_url=False, include_context=False, include_input=False)})
+                continue
+            turn = ChatTurn(request, self.user_id, self.session_id, self.persona)
+            try:
+                async with admission_controller.slot(self.tier):
+                    await turn.generate(self.history + [turn.user_message.model_dump()])
+            except HTTPException as e:
+                await self.send({"type": "error", "status": e.status_code, "error": e.detail,
+                                 "retry_after": (e.headers or {}).get("Retry-After")})
+                continue
+            await self.persist(turn)
+            await self.send({
+                "type": "message",
+                "response": turn.response().model_dump(),
+                "credits_remaining": self.usage.get("credits_remaining")
+            })
+    
+    async def persist(self, turn: ChatTurn) -> None:
+        """Incremental writes only - nothing is re-read per message"""
+        await messages_repo.insert(turn.user_message, turn.assistant_message)
+        memory_extractor.submit(turn.user_message, turn.assistant_message)
+        self.usage = await usage_repo.charge(
+            self.user_id, self.tier, usage_increment(turn.credits, turn.usage_model, turn.estimated_tokens)
+        )
+        await transactions_repo.insert(turn.transaction())
+        update = turn.session_update()
+        await sessions_repo.record_turn(self.user_id, self.session_id, update)
+        await event_feed.publish(self.user_id, *turn.events(update, self.usage))
+        self.history.extend([turn.user_message.model_dump(), turn.assistant_message.model_dump()])
+        del self.history[:-WS_HISTORY_LIMIT]
+    
+    async def run(self) -> None:
+        tasks = [asyncio.create_task(self.reader()), asyncio.create_task(self.heartbeat()),
+                 asyncio.create_task(self.processor())]
+        # 1011: the server hit an unexpected condition; clean ends below switch it to 1000
+        close_code = 1011
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None or isinstance(error, (WebSocketDisconnect, asyncio.TimeoutError)):
+                    close_code = 1000
+                else:
+                    logger.warning(f"WebSocket chat {self.session_id} closed with error: {error}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Never leave the client waiting on a socket nobody reads any more
+            if WebSocketState.DISCONNECTED not in (self.websocket.client_state, self.websocket.application_state):
+                try:
+                    await self.websocket.close(code=close_code)
+                except RuntimeError:
+                    pass
 
 # =============================================================================
 # API ROUTES
@@ -596,12 +3546,16 @@ async def get_pledge():
 @api_router.get("/status", response_model=SystemStatus)
 async def get_status():
     """Get system status"""
+    return await single_flight.do("status", {}, compute_status)
+
+async def compute_status() -> SystemStatus:
     try:
         await db.command("ping")
         db_connected = True
     except Exception:
         db_connected = False
     
+    provider_pool.sync_enabled()
     active_models = []
     for key, config in TRINITY_CONFIG.items():
         active_models.append({
@@ -610,7 +3564,8 @@ async def get_status():
             "role": config["role"],
             "weight": config["weight"],
             "cost_per_1k": config["cost_per_1k"],
-            "enabled": config["enabled"]
+            "enabled": config["enabled"],
+            "circuit": provider_pool.get(key).breaker.state
         })
     
     enabled_count = sum(m["enabled"] for m in active_models)
@@ -618,9 +3573,9 @@ async def get_status():
                   "Dual-Core" if enabled_count >= 2 else \
                   "Solo-Core" if enabled_count >= 1 else "Demo Mode"
     
-    active_sessions = await db.sessions.count_documents({})
-    total_messages = await db.messages.count_documents({})
-    personas_count = await db.personas.count_documents({}) + len(DEFAULT_PERSONAS)
+    active_sessions = await sessions_repo.count()
+    total_messages = await messages_repo.count()
+    personas_count = await personas_repo.count() + len(DEFAULT_PERSONAS)
     
     return SystemStatus(
         status="operational" if db_connected else "degraded",
@@ -638,13 +3593,20 @@ async def get_status():
 # -----------------------------------------------------------------------------
 
 @api_router.get("/dashboard")
-async def get_dashboard():
+async def get_dashboard(user_id: str = Depends(stale_reads_user)):
     """Get full dashboard metrics for monetization view"""
-    usage = await get_or_create_usage()
+    # A caller pinned to the primary must not join a run that reads from secondaries
+    return await single_flight.do(
+        "dashboard", {"user_id": user_id, "stale_ok": stale_reads_ok.get()}, lambda: compute_dashboard(user_id)
+    )
+
+async def compute_dashboard(user_id: str) -> DashboardMetrics:
+    usage = await get_or_create_usage(user_id)
     tier = usage.get("tier", "dev")
     tier_info = TIER_CONFIG.get(tier, TIER_CONFIG["dev"])
     
     # Model breakdown with costs
+    provider_pool.sync_enabled()
     model_breakdown = []
     total_model_usage = sum(usage.get("model_usage", {}).values()) or 1
     for key, config in TRINITY_CONFIG.items():
@@ -661,15 +3623,15 @@ async def get_dashboard():
         })
     
     # Recent activity
-    recent_txs = await db.transactions.find({}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
+    recent_txs = await transactions_repo.recent(user_id, 10)
     
     # Cost comparison (vs direct API)
     direct_cost = sum(m["estimated_cost"] for m in model_breakdown) * 1.5  # Direct is ~50% more
     godbot_cost = sum(m["estimated_cost"] for m in model_breakdown)
     
     # Emotional bond calculation
-    sessions = await db.sessions.find({}, {"_id": 0}).to_list(100)
-    avg_imprint = sum(s.get("emotional_imprint", 0) for s in sessions) / max(len(sessions), 1)
+    imprints = await sessions_repo.imprints(user_id, 100)
+    avg_imprint = sum(imprints) / max(len(imprints), 1)
     
     return DashboardMetrics(
         usage=UsageStats(**usage),
@@ -693,20 +3655,38 @@ async def get_dashboard():
         emotional_bond=round(avg_imprint * 100, 1)
     )
 
+@api_router.get("/metrics")
+async def get_metrics():
+    """Runtime metrics for this worker's transports and caches"""
+    return {
+        "worker_id": WORKER_ID,
+        "providers": provider_pool.stats(),
+        "cache_bus": invalidation_bus.stats(),
+        "single_flight": single_flight.stats(),
+        "admission": admission_controller.stats(),
+        "archive": session_archive.stats(),
+        "prompts": prompt_assembler.stats(),
+        "idempotency": idempotency_store.stats(),
+        "memory": memory_extractor.stats(),
+        "reads": read_router.stats(),
+        "events": event_feed.stats(),
+        "deadlines": deadline_monitor.stats(),
+        "capture": traffic_recorder.stats(),
+        "jobs": job_scheduler.stats()
+    }
+
 @api_router.get("/tiers")
 async def get_tiers():
     """Get available tier configurations"""
     return TIER_CONFIG
 
 @api_router.post("/credits/add")
-async def add_credits(amount: int = 1000, user_id: str = "demo_user"):
+async def add_credits(amount: int = 1000, user_id: str = Depends(current_user)):
     """Add credits to account (for demo/testing)"""
-    await db.usage.update_one(
-        {"user_id": user_id},
-        {"$inc": {"credits_total": amount, "credits_remaining": amount}}
-    )
+    usage = await usage_repo.add_credits(user_id, amount)
     await record_transaction(user_id, amount, "credit", f"Added {amount} credits", None, "system")
-    return {"message": f"Added {amount} credits", "new_balance": (await get_or_create_usage(user_id))["credits_remaining"]}
+    await event_feed.publish(user_id, credits_event(usage))
+    return {"message": f"Added {amount} credits", "new_balance": usage["credits_remaining"]}
 
 # -----------------------------------------------------------------------------
 # DREAMCHAIN
@@ -716,118 +3696,152 @@ async def add_credits(amount: int = 1000, user_id: str = "demo_user"):
 async def get_dreamchain():
     """Get AI-generated insights from DreamChain mode"""
     # Check for existing dreams
-    dreams = await db.dreams.find({}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10)
+    dreams = dream_cache.get("recent")
+    if dreams is None:
+        dreams = await dreams_repo.recent(10)
     
     if not dreams:
-        # Generate new dreams
-        new_dreams = await generate_dream_insights()
-        for dream in new_dreams:
-            await db.dreams.insert_one(dream.model_dump())
-        dreams = [d.model_dump() for d in new_dreams]
+        # First visit before the scheduled cycle has ever run
+        dreams = await run_dream_cycle()
+    dream_cache.set("recent", dreams)
     
+    last_cycle = datetime.fromisoformat(max(d.get("updated_at") or d["created_at"] for d in dreams))
     return {
         "mode": "DreamChain",
         "status": "idle",
         "insights": dreams,
-        "next_dream_cycle": (datetime.now(timezone.utc) + timedelta(hours=8)).isoformat()
+        "next_dream_cycle": (last_cycle + timedelta(hours=DREAM_CYCLE_HOURS)).isoformat()
     }
 
 @api_router.post("/dreamchain/acknowledge/{dream_id}")
 async def acknowledge_dream(dream_id: str):
     """Mark a dream insight as reviewed"""
-    await db.dreams.update_one({"id": dream_id}, {"$set": {"reviewed": True}})
+    await dreams_repo.acknowledge(dream_id)
+    await invalidation_bus.publish("dreams")
     return {"message": "Dream acknowledged"}
 
+# -----------------------------------------------------------------------------
+# EVENTS
+# -----------------------------------------------------------------------------
+
+@api_router.get("/events")
+async def events(user_id: str = Depends(current_user),
+                 last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """Server-sent session, message, credit and dream events; reconnects resume after Last-Event-ID"""
+    return StreamingResponse(
+        event_feed.stream(user_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # -----------------------------------------------------------------------------
 # CHAT ENDPOINTS
 # -----------------------------------------------------------------------------
 
 @api_router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, response: Response, user_id: str = Depends(current_user),
+               idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+               request_timeout: Optional[str] = Header(None, alias="X-Request-Timeout")):
     """Send a message through Trinity Fusion with emotional resonance"""
+    deadline = deadline_monitor.start(request.tier, request_timeout)
+    # Set before single-flight spawns the pipeline task so the task inherits it
+    request_deadline.set(deadline)
+    params = {**request.model_dump(), "user_id": user_id}
+    try:
+        if idempotency_key is None:
+            # Retries and double-submits of the exact same request share one pipeline run
+            return await asyncio.wait_for(
+                single_flight.do("chat", params, lambda: run_chat(request, user_id)), timeout=deadline.remaining()
+            )
+        (result, replayed), shared = await asyncio.wait_for(single_flight.do_shared(
+            "chat", {**params, "idempotency_key": idempotency_key},
+            lambda: idempotency_store.run(f"{user_id}:chat", idempotency_key, params, lambda: run_chat(request, user_id))
+        ), timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        # Only this caller stops waiting; a coalesced run keeps going within its own deadline
+        deadline.stage = "response"
+        raise deadline.exceeded()
+    # A caller that joined another caller's run did not execute the turn either
+    if replayed or shared:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def run_chat(request: ChatRequest, user_id: str) -> ChatResponse:
+    deadline = request_deadline.get()
+    # The queue wait is bounded by the deadline too, so an abandoned request does not hold its place in line
+    async with admission_controller.slot(request.tier, deadline):
+        if deadline is None:
+            return await process_chat(request, user_id)
+        deadline.check("admission")
+        with deadline.bound():
+            return await process_chat(request, user_id)
+
+async def process_chat(request: ChatRequest, user_id: str) -> ChatResponse:
     session_id = request.session_id or str(uuid.uuid4())
-    is_owner = verify_owner_sig(request.owner_sig)
-    
-    # Analyze emotional context
-    emotional_markers = emotional_engine.analyze_input(request.message)
-    style_guidance = emotional_engine.adapt_response_style(
-        emotional_markers, 
-        (await get_persona_by_id(request.persona_id or "godmind-default"))["name"]
-    )
+    deadline_check("persona")
+    turn = ChatTurn(request, user_id, session_id, await resolve_persona(request.persona_id))
+    deadline_check("session")
+    await ensure_sessions(user_id, {session_id: request})
     
-    existing_session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-    if not existing_session:
-        new_session = Session(id=session_id, persona_id=request.persona_id, tier=request.tier)
-        await db.sessions.insert_one(new_session.model_dump())
-    
-    persona_id = request.persona_id or "godmind-default"
-    persona = await get_persona_by_id(persona_id)
-    if not persona:
-        persona = DEFAULT_PERSONAS[0]
-    
-    # Save user message with emotional markers
-    user_message = Message(
-        session_id=session_id,
-        role="user",
-        content=request.message,
-        persona_id=persona_id,
-        emotional_markers=emotional_markers,
-        lore=MemoryLore(memory_class="project" if len(request.message) > 100 else "discardable")
-    )
-    await save_message(user_message)
-    
-    # Get history for context (used when LLMs connected)
-    _ = await get_session_messages(session_id)
-    
-    # Calculate credits
-    estimated_tokens = len(request.message.split()) * 2 + 500
-    credits_to_use = max(10, estimated_tokens // 10)
-    
-    # Generate response
-    response_text = get_fallback_response(request.message, persona["name"], request.tier, emotional_markers)
-    models_used = ["demo"]
-    fusion_mode = "Demo Mode"
-    
-    # Save assistant message
-    assistant_message = Message(
-        session_id=session_id,
-        role="assistant",
-        content=response_text,
-        persona_id=persona_id,
-        fusion_data={"models_used": models_used, "fusion_mode": fusion_mode},
-        lore=MemoryLore(memory_class="project", echo_flag=is_owner)
-    )
-    await save_message(assistant_message)
+    # Get history for context, then generate; nothing is stored until there is a reply, so a turn that
+    # runs out of time leaves no orphaned user message for the client's retry to duplicate
+    deadline_check("history")
+    history = await get_session_messages(user_id, session_id)
+    await turn.generate(list(history) + [turn.user_message.model_dump()])
+    # Past this point the turn is committed; writes run on the budget held back from generation
+    deadline_check("writes")
+    await save_message(turn.user_message, turn.assistant_message)
     
     # Update usage
-    await update_usage("demo_user", credits_to_use, "mythomax", estimated_tokens)
-    await record_transaction("demo_user", credits_to_use, "debit", f"Chat with {persona['name']}", "demo", request.tier)
+    usage = await update_usage(user_id, turn.credits, turn.usage_model, turn.estimated_tokens, request.tier)
+    await transactions_repo.insert(turn.transaction())
     
     # Update session with emotional imprint
-    imprint_delta = 0.01 if emotional_markers.get("excitement", 0) > 0.3 else 0.005
-    await db.sessions.update_one(
-        {"id": session_id},
-        {
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
-            "$inc": {"message_count": 2, "emotional_imprint": imprint_delta}
-        }
-    )
+    update = turn.session_update()
+    await sessions_repo.record_turn(user_id, session_id, update)
     
-    return ChatResponse(
-        id=assistant_message.id,
-        session_id=session_id,
-        content=response_text,
-        persona_id=persona_id,
-        timestamp=assistant_message.timestamp,
-        fusion_mode=fusion_mode,
-        models_used=models_used,
-        credits_used=credits_to_use,
-        emotional_resonance={
-            "detected": emotional_markers,
-            "adaptation": style_guidance,
-            "imprint_strength": imprint_delta
-        }
+    # Let this user's other open clients catch up without polling
+    await event_feed.publish(user_id, *turn.events(update, usage))
+    
+    return turn.response()
+
+@api_router.post("/chat/batch")
+async def chat_batch(batch: BatchChatRequest, user_id: str = Depends(current_user)):
+    """Run many chat requests with bounded concurrency, streaming NDJSON results as they complete"""
+    if not batch.requests:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(batch.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} requests")
+    return StreamingResponse(stream_chat_batch(batch, user_id), media_type="application/x-ndjson")
+
+@api_router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, session_id: Optional[str] = None,
+                      persona_id: Optional[str] = None, tier: str = "dev", user_id: Optional[str] = None):
+    """Persistent chat channel that loads persona, session, usage and history once per connection"""
+    # Browsers cannot set headers on a WebSocket handshake, so the user may also come as a query parameter
+    try:
+        user_id = current_user(websocket.headers.get("X-User-Id") or user_id)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    session_id = session_id or str(uuid.uuid4())
+    persona = await resolve_persona(persona_id)
+    await ensure_sessions(
+        user_id, {session_id: ChatRequest(message="", session_id=session_id, persona_id=persona_id, tier=tier)}
     )
+    usage = await get_or_create_usage(user_id, tier)
+    history = await get_session_messages(user_id, session_id, WS_HISTORY_LIMIT)
+    
+    connection = ChatConnection(websocket, user_id, session_id, persona_id, tier, persona, usage, history)
+    await connection.send({
+        "type": "ready",
+        "session_id": session_id,
+        "persona": persona["name"],
+        "credits_remaining": usage.get("credits_remaining"),
+        "history": len(history)
+    })
+    await connection.run()
 
 # -----------------------------------------------------------------------------
 # PERSONA ENDPOINTS
@@ -835,15 +3849,19 @@ async def chat(request: ChatRequest):
 
 @api_router.get("/personas", response_model=List[Persona])
 async def get_personas():
-    custom_personas = await db.personas.find({}, {"_id": 0}).to_list(100)
-    all_personas = [Persona(**p) for p in DEFAULT_PERSONAS]
+    custom_personas = persona_cache.get("__all__")
+    if custom_personas is None:
+        custom_personas = await personas_repo.list(100)
+        persona_cache.set("__all__", custom_personas)
+    all_personas = [Persona(created_at=DEFAULT_PERSONAS_CREATED_AT, **p) for p in DEFAULT_PERSONAS]
     all_personas.extend([Persona(**p) for p in custom_personas])
     return all_personas
 
 @api_router.post("/personas", response_model=Persona)
 async def create_persona(persona: PersonaCreate):
     new_persona = Persona(**persona.model_dump())
-    await db.personas.insert_one(new_persona.model_dump())
+    await personas_repo.create(new_persona)
+    await invalidation_bus.publish("personas")
     return new_persona
 
 @api_router.get("/personas/{persona_id}", response_model=Persona)
@@ -851,33 +3869,59 @@ async def get_persona(persona_id: str):
     persona = await get_persona_by_id(persona_id)
     if not persona:
         raise HTTPException(status_code=404, detail="Persona not found")
-    return Persona(**persona)
+    return Persona(**{"created_at": DEFAULT_PERSONAS_CREATED_AT, **persona})
 
 # -----------------------------------------------------------------------------
 # SESSION ENDPOINTS
 # -----------------------------------------------------------------------------
 
 @api_router.get("/sessions", response_model=List[Session])
-async def get_sessions():
-    sessions = await db.sessions.find({}, {"_id": 0}).sort("updated_at", -1).to_list(100)
+async def get_sessions(user_id: str = Depends(stale_reads_user)):
+    sessions = await sessions_repo.list_recent(user_id, 100)
     return [Session(**s) for s in sessions]
 
 @api_router.get("/sessions/{session_id}", response_model=Session)
-async def get_session(session_id: str):
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+async def get_session(session_id: str, user_id: str = Depends(stale_reads_user)):
+    session = await sessions_repo.get(user_id, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return Session(**session)
 
 @api_router.get("/sessions/{session_id}/messages", response_model=List[Message])
-async def get_session_messages_endpoint(session_id: str, limit: int = 50):
-    messages = await db.messages.find({"session_id": session_id}, {"_id": 0}).sort("timestamp", 1).to_list(limit)
+async def get_session_messages_endpoint(session_id: str, limit: int = 50, user_id: str = Depends(stale_reads_user)):
+    await session_archive.ensure_hot(user_id, session_id)
+    messages = await messages_repo.list(user_id, session_id, limit)
     return [Message(**m) for m in messages]
 
+@api_router.get("/sessions/{session_id}/emotions")
+async def get_session_emotions(session_id: str, points: int = 100, window: int = 10,
+                               user_id: str = Depends(stale_reads_user)):
+    """Emotional trajectory analytics for a session"""
+    session = await sessions_repo.get(user_id, session_id, {"message_count": 1, "updated_at": 1})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    points = max(1, min(points, EMOTION_MAX_POINTS))
+    
+    # Any new chat turn bumps message_count/updated_at, which retires the cached result on every worker
+    token = (session.get("message_count"), session.get("updated_at"))
+    cache_key = f"{user_id}:{session_id}:{points}:{window}"
+    cached = emotion_cache.get(cache_key)
+    if cached and cached[0] == token:
+        return cached[1]
+    
+    await session_archive.ensure_hot(user_id, session_id)
+    matrix, persona_codes, persona_labels = await load_emotion_arrays(user_id, session_id)
+    result = {"session_id": session_id, **compute_emotion_trajectory(matrix, persona_codes, persona_labels, points, window)}
+    emotion_cache.set(cache_key, (token, result))
+    return result
+
 @api_router.delete("/sessions/{session_id}")
-async def delete_session(session_id: str):
-    await db.sessions.delete_one({"id": session_id})
-    await db.messages.delete_many({"session_id": session_id})
+async def delete_session(session_id: str, user_id: str = Depends(current_user)):
+    await sessions_repo.delete(user_id, session_id)
+    await messages_repo.delete_session(user_id, session_id)
+    await session_archive.discard(user_id, session_id)
+    await invalidation_bus.publish("sessions", f"{user_id}:{session_id}")
+    await event_feed.publish(user_id, ("session-updated", {"session_id": session_id, "deleted": True}))
     return {"message": "Session deleted"}
 
 # -----------------------------------------------------------------------------
@@ -885,21 +3929,414 @@ async def delete_session(session_id: str):
 # -----------------------------------------------------------------------------
 
 @api_router.get("/memory/{session_id}", response_model=List[MemoryItem])
-async def get_memory(session_id: str):
-    memories = await db.memory.find({"session_id": session_id}, {"_id": 0}).sort("importance", -1).to_list(100)
+async def get_memory(session_id: str, user_id: str = Depends(stale_reads_user)):
+    memories = await memory_repo.list_for_session(user_id, session_id)
     return [MemoryItem(**m) for m in memories]
 
 @api_router.post("/memory", response_model=MemoryItem)
-async def add_memory(memory: MemoryItem):
-    await db.memory.insert_one(memory.model_dump())
+async def add_memory(memory: MemoryItem, user_id: str = Depends(current_user)):
+    memory.user_id = user_id
+    await memory_repo.insert(memory)
     return memory
 
+# =============================================================================
+# HTTP CACHING & COMPRESSION
+# =============================================================================
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+# Incremental responses must reach the client as they are produced, so they are never buffered
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+# Cache-Control per route; "no-cache" still lets clients keep the body and revalidate it cheaply with a 304
+CACHE_POLICIES = {
+    "/api/": "public, max-age=3600",
+    "/api/pledge": "public, max-age=3600",
+    "/api/tiers": "public, max-age=3600",
+    "/api/personas": "public, no-cache",
+    "/api/personas/{persona_id}": "public, max-age=300",
+    "/api/dashboard": "private, no-cache",
+    "/api/sessions": "private, no-cache",
+    "/api/sessions/{session_id}": "private, no-cache",
+    "/api/sessions/{session_id}/messages": "private, no-cache",
+    "/api/sessions/{session_id}/emotions": "private, no-cache",
+    "/api/memory/{session_id}": "private, no-cache"
+}
+
+def _get_header(headers, name: bytes) -> str:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+def _without_headers(headers, *names: bytes) -> list:
+    return [(k, v) for k, v in headers if k.lower() not in names]
+
+class BufferedResponseMiddleware:
+    """ASGI base that holds a complete response body so it can be rewritten before sending"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    def wants(self, scope, start: dict) -> bool:
+        raise NotImplementedError
+    
+    async def finish(self, scope, start: dict, body: bytes, send) -> None:
+        raise NotImplementedError
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start: Optional[dict] = None
+        chunks: List[bytes] = []
+        passthrough = False
+        
+        async def buffered_send(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                content_type = _get_header(message["headers"], b"content-type")
+                if content_type.startswith(STREAMING_TYPES) or not self.wants(scope, message):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+            elif message["type"] == "http.response.body" and not passthrough:
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self.finish(scope, start, b"".join(chunks), send)
+            else:
+                await send(message)
+        
+        await self.app(scope, receive, buffered_send)
+
+class ConditionalGetMiddleware(BufferedResponseMiddleware):
+    """Content-hash ETags, 304 for matching If-None-Match, and per-route Cache-Control on successful GETs"""
+    
+    def wants(self, scope, start: dict) -> bool:
+        return scope["method"] in ("GET", "HEAD") and start["status"] == 200
+    
+    @staticmethod
+    def matches(if_none_match: str, etag: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: a compressed representation carries the same tag marked W/
+        return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    
+    async def finish(self, scope, start: dict, body: bytes, send) -> None:
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        headers = _without_headers(start["headers"], b"etag")
+        headers.append((b"etag", etag.encode()))
+        route = scope.get("route")
+        policy = CACHE_POLICIES.get(getattr(route, "path", None))
+        if policy:
+            headers = _without_headers(headers, b"cache-control")
+            headers.append((b"cache-control", policy.encode()))
+        
+        if self.matches(_get_header(scope["headers"], b"if-none-match"), etag):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": _without_headers(headers, b"content-length")
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+class CompressionMiddleware(BufferedResponseMiddleware):
+    """Brotli or gzip for compressible responses over COMPRESS_MIN_BYTES; streams pass through untouched"""
+    
+    @staticmethod
+    def negotiate(accept_encoding: str) -> Optional[str]:
+        accepted = set()
+        for part in accept_encoding.lower().split(","):
+            coding, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(coding.strip())
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+    
+    def wants(self, scope, start: dict) -> bool:
+        return (
+            self.negotiate(_get_header(scope["headers"], b"accept-encoding")) is not None
+            and not _get_header(start["headers"], b"content-encoding")
+            and _get_header(start["headers"], b"content-type").startswith(COMPRESSIBLE_TYPES)
+        )
+    
+    async def finish(self, scope, start: dict, body: bytes, send) -> None:
+        headers = _without_headers(start["headers"], b"vary")
+        vary = _get_header(start["headers"], b"vary")
+        headers.append((b"vary", (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode()))
+        if len(body) >= COMPRESS_MIN_BYTES:
+            encoding = self.negotiate(_get_header(scope["headers"], b"accept-encoding"))
+            # Moderate levels: these are per-request dynamic payloads, not precompressed assets
+            if encoding == "br":
+                body = brotli.compress(body, quality=4)
+            else:
+                body = gzip.compress(body, compresslevel=6)
+            etag = _get_header(headers, b"etag")
+            headers = _without_headers(headers, b"content-length", b"etag")
+            headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"content-length", str(len(body)).encode()))
+            if etag:
+                headers.append((b"etag", (etag if etag.startswith("W/") else f"W/{etag}").encode()))
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+class ReadYourWritesMiddleware:
+    """Hands the client the time of its last write, so reads routed to any worker can avoid stale secondaries.
+    
+    Mutating requests are marked up front because streamed chat turns write after the headers go out.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        writes: Dict[str, float] = {}
+        if scope["method"] not in ("GET", "HEAD", "OPTIONS"):
+            writes["at"] = time.time()
+        request_writes.set(writes)
+        
+        async def marking_send(message):
+            if message["type"] == "http.response.start" and "at" in writes:
+                wrote_at = f"{writes['at']:.3f}"
+                cookie = (f"{LAST_WRITE_COOKIE}={wrote_at}; Max-Age={math.ceil(READ_YOUR_WRITES_SECONDS)}; "
+                          f"Path=/api; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [
+                    *message["headers"],
+                    (b"set-cookie", cookie.encode()),
+                    (LAST_WRITE_HEADER.lower().encode(), wrote_at.encode())
+                ]}
+            await send(message)
+        
+        await self.app(scope, receive, marking_send)
+
+# =============================================================================
+# TRAFFIC CAPTURE
+# =============================================================================
+
+# Opt-in: set TRAFFIC_CAPTURE_DIR to record sanitized /api requests for traffic_replay.py
+TRAFFIC_CAPTURE_DIR = os.environ.get('TRAFFIC_CAPTURE_DIR')
+TRAFFIC_CAPTURE_SAMPLE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE', '1.0'))
+TRAFFIC_CAPTURE_EXCLUDE = set(filter(None, os.environ.get('TRAFFIC_CAPTURE_EXCLUDE', '/api/events,/api/metrics').split(',')))
+TRAFFIC_CAPTURE_ROTATE_BYTES = int(os.environ.get('TRAFFIC_CAPTURE_ROTATE_BYTES', str(64 * 1024 * 1024)))
+TRAFFIC_CAPTURE_ROTATE_SECONDS = float(os.environ.get('TRAFFIC_CAPTURE_ROTATE_SECONDS', '3600'))
+TRAFFIC_CAPTURE_MAX_FILES = int(os.environ.get('TRAFFIC_CAPTURE_MAX_FILES', '48'))
+TRAFFIC_CAPTURE_MAX_BODY = 64 * 1024
+TRAFFIC_CAPTURE_QUEUE_SIZE = 10000
+# Pseudonyms only line up across workers that share the salt
+TRAFFIC_CAPTURE_SALT = os.environ.get('TRAFFIC_CAPTURE_SALT') or uuid.uuid4().hex
+
+CAPTURED_HEADERS = {"accept", "accept-encoding", "content-type", "if-none-match", "x-request-timeout", "last-event-id"}
+PSEUDONYMIZED_HEADERS = {"x-user-id": "u_", "idempotency-key": "k_"}
+SENSITIVE_FIELD = re.compile(r"sig|key|secret|token|password|authorization|^user_id$", re.IGNORECASE)
+
+def _pseudonym(prefix: str, value: str) -> str:
+    return prefix + hashlib.sha256(f"{TRAFFIC_CAPTURE_SALT}:{value}".encode()).hexdigest()[:16]
+
+def sanitize_capture(value: Any) -> Any:
+    """Drop credential-like fields (owner_sig, API keys, tokens) and body user ids at any depth"""
+    if isinstance(value, dict):
+        return {k: sanitize_capture(v) for k, v in value.items() if not SENSITIVE_FIELD.search(k)}
+    if isinstance(value, list):
+        return [sanitize_capture(v) for v in value]
+    return value
+
+def capture_record(scope, body: bytes, body_bytes: int, started_wall: float, outcome: Dict[str, Any]) -> dict:
+    headers = {}
+    for key, value in scope["headers"]:
+        name = key.decode("latin-1").lower()
+        if name in CAPTURED_HEADERS:
+            headers[name] = value.decode("latin-1")
+        elif name in PSEUDONYMIZED_HEADERS:
+            headers[name] = _pseudonym(PSEUDONYMIZED_HEADERS[name], value.decode("latin-1"))
+    query = [
+        (k, v) for k, v in urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        if not SENSITIVE_FIELD.search(k)
+    ]
+    payload = None
+    if body and body_bytes <= TRAFFIC_CAPTURE_MAX_BODY and headers.get("content-type", "").startswith("application/json"):
+        try:
+            payload = sanitize_capture(json.loads(body))
+        except ValueError:
+            payload = None
+    route = scope.get("route")
+    return {
+        "ts": round(started_wall, 6),
+        "method": scope["method"],
+        "path": scope["path"],
+        "route": getattr(route, "path", None),
+        "query": urllib.parse.urlencode(query),
+        "headers": headers,
+        "body": payload,
+        "body_bytes": body_bytes,
+        "status": outcome["status"],
+        "content_type": outcome["content_type"],
+        "response_bytes": outcome["bytes"],
+        "ttfb_ms": outcome["ttfb_ms"],
+        "duration_ms": outcome["duration_ms"]
+    }
+
+class TrafficRecorder:
+    """Appends capture records to size- and age-rotated gzip JSONL files from a background task"""
+    
+    def __init__(self, directory: Optional[str] = TRAFFIC_CAPTURE_DIR):
+        self.directory = Path(directory) if directory else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=TRAFFIC_CAPTURE_QUEUE_SIZE)
+        self.recorded = 0
+        self.dropped = 0
+        self.files = 0
+        self._file = None
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+    
+    def record(self, entry: dict) -> None:
+        # Capture must never slow the request it observes, so a full queue drops the record
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        lines = self._drain()
+        await asyncio.to_thread(self._write, lines, True)
+        self.recorded += len(lines)
+    
+    def _drain(self) -> List[str]:
+        lines = []
+        while not self.queue.empty():
+            lines.append(json.dumps(self.queue.get_nowait(), default=str, separators=(",", ":")))
+        return lines
+    
+    async def _run(self) -> None:
+        while True:
+            entry = await self.queue.get()
+            lines = [json.dumps(entry, default=str, separators=(",", ":"))] + self._drain()
+            try:
+                # gzip and file I/O stay off the event loop
+                await asyncio.to_thread(self._write, lines, False)
+                self.recorded += len(lines)
+            except Exception as e:
+                self.dropped += len(lines)
+                logger.warning(f"Traffic capture write failed: {e}")
+    
+    def _write(self, lines: List[str], close: bool) -> None:
+        if lines:
+            if self._file is None or self._file_bytes >= TRAFFIC_CAPTURE_ROTATE_BYTES or \
+                    time.monotonic() - self._file_opened >= TRAFFIC_CAPTURE_ROTATE_SECONDS:
+                self._rotate()
+            data = ("\n".join(lines) + "\n").encode()
+            self._file.write(data)
+            self._file.flush()
+            self._file_bytes += len(data)
+        if close and self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self._file = gzip.open(self.directory / f"traffic-{WORKER_ID[:8]}-{stamp}.jsonl.gz", "ab", compresslevel=6)
+        self._file_bytes = 0
+        self._file_opened = time.monotonic()
+        self.files += 1
+        for old in sorted(self.directory.glob(f"traffic-{WORKER_ID[:8]}-*.jsonl.gz"))[:-TRAFFIC_CAPTURE_MAX_FILES]:
+            old.unlink(missing_ok=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample": TRAFFIC_CAPTURE_SAMPLE,
+            "queued": self.queue.qsize(),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "files": self.files
+        }
+
+traffic_recorder = TrafficRecorder()
+
+class TrafficCaptureMiddleware:
+    """Outermost middleware, so recorded timings cover the whole stack including compression"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") \
+                or scope["path"] in TRAFFIC_CAPTURE_EXCLUDE or random.random() >= TRAFFIC_CAPTURE_SAMPLE:
+            await self.app(scope, receive, send)
+            return
+        started = time.monotonic()
+        started_wall = time.time()
+        body = bytearray()
+        body_bytes = 0
+        outcome = {"status": 500, "content_type": "", "bytes": 0, "ttfb_ms": None, "duration_ms": None}
+        
+        async def capture_receive():
+            nonlocal body_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_bytes += len(chunk)
+                if body_bytes <= TRAFFIC_CAPTURE_MAX_BODY:
+                    body.extend(chunk)
+            return message
+        
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                outcome["status"] = message["status"]
+                outcome["content_type"] = _get_header(message.get("headers", []), b"content-type")
+            elif message["type"] == "http.response.body":
+                if outcome["ttfb_ms"] is None:
+                    outcome["ttfb_ms"] = round((time.monotonic() - started) * 1000, 3)
+                outcome["bytes"] += len(message.get("body", b""))
+            await send(message)
+        
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            outcome["duration_ms"] = round((time.monotonic() - started) * 1000, 3)
+            traffic_recorder.record(capture_record(scope, bytes(body), body_bytes, started_wall, outcome))
+
 # =============================================================================
 # APP SETUP
 # =============================================================================
 
 app.include_router(api_router)
 
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(ConditionalGetMiddleware)
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -908,18 +4345,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if traffic_recorder.enabled:
+    app.add_middleware(TrafficCaptureMiddleware)
+
 @app.on_event("startup")
 async def startup_event():
-    await db.messages.create_index([("session_id", 1), ("timestamp", -1)])
-    await db.sessions.create_index([("id", 1)])
-    await db.personas.create_index([("id", 1)])
-    await db.memory.create_index([("session_id", 1), ("importance", -1)])
-    await db.usage.create_index([("user_id", 1)])
-    await db.transactions.create_index([("user_id", 1), ("timestamp", -1)])
-    await db.dreams.create_index([("created_at", -1)])
+    for repo in ALL_REPOSITORIES:
+        await repo.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+    await invalidation_bus.start()
+    await event_feed.start()
+    await provider_pool.start()
+    session_archive.start()
+    job_scheduler.start()
+    memory_extractor.start()
+    traffic_recorder.start()
     logger.info("GodBot EchelonCore v1.0 - Trinity Fusion + Emotional Resonance Initialized")
     logger.info(f"Pledge: {GODBOT_PLEDGE['pledge']}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await invalidation_bus.stop()
+    await event_feed.stop()
+    await provider_pool.close()
+    await job_scheduler.stop()
+    await memory_extractor.stop()
+    await traffic_recorder.stop()
     client.close()
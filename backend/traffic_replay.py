@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""Replay captured production traffic against a build and compare two builds' results.
+
+"replay" reads the gzip JSONL files written by the capture middleware (see
+TRAFFIC_CAPTURE_DIR in server.py) and sends every request to --target, or to
+this checkout's app in-process with --in-process, on the original schedule
+scaled by --speed (2.0 replays twice as fast, 0 as fast as --concurrency
+allows). One result line per request records the route, status, latency,
+scheduling lag and the structure of the response body.
+
+"compare" loads two result files and prints per-route latency percentiles
+side by side, then lists routes whose status mix or response shape differs
+between the builds.
+
+Captured user ids and idempotency keys are pseudonyms, so replays keep the
+original per-user partitioning and duplicate-request patterns. Replay against
+a scratch database: chat requests write sessions, messages and usage.
+
+Usage:
+    python traffic_replay.py replay CAPTURE.jsonl.gz [...] --out RESULTS.jsonl.gz [--target http://localhost:8001 | --in-process] [--speed 1.0] [--concurrency 64] [--limit N]
+    python traffic_replay.py compare BASELINE.jsonl.gz CANDIDATE.jsonl.gz [--max-p99-regression 10]
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import re
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict
+
+import httpx
+import numpy as np
+
+UUID_SEGMENT = re.compile(r"/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?=/|$)")
+PERCENTILES = (50, 90, 99)
+
+
+def read_jsonl(paths: list) -> list:
+    records = []
+    for path in paths:
+        try:
+            with gzip.open(path, "rt") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except (EOFError, zlib.error, json.JSONDecodeError) as e:
+            # A file still being written by a live worker ends mid-stream; keep what was complete
+            print(f"{path}: stopped at a truncated record ({e})", file=sys.stderr)
+    return records
+
+
+def write_jsonl(path: str, records: list) -> None:
+    with gzip.open(path, "wt") as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def route_key(record: dict) -> str:
+    return f"{record['method']} {record.get('route') or UUID_SEGMENT.sub('/{id}', record['path'])}"
+
+
+def shape(value):
+    """Structure of a JSON value with the data removed, so two builds' answers can be compared"""
+    if isinstance(value, dict):
+        return {k: shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, list):
+        return [shape(value[0])] if value else []
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if value is None:
+        return "null"
+    return "string"
+
+
+def response_shape(content_type: str, text: str):
+    try:
+        if content_type.startswith("application/json"):
+            return shape(json.loads(text))
+        if content_type.startswith("application/x-ndjson"):
+            lines = [line for line in text.splitlines() if line.strip()]
+            return {"ndjson": shape(json.loads(lines[0])) if lines else None}
+    except ValueError:
+        return "invalid-json"
+    return content_type.split(";")[0]
+
+
+def shape_diff(a, b, path: str = "$") -> list:
+    """Paths where two shapes disagree"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        diffs = []
+        for key in sorted(set(a) | set(b)):
+            if key not in a:
+                diffs.append(f"{path}.{key} added")
+            elif key not in b:
+                diffs.append(f"{path}.{key} removed")
+            else:
+                diffs.extend(shape_diff(a[key], b[key], f"{path}.{key}"))
+        return diffs
+    if isinstance(a, list) and isinstance(b, list) and a and b:
+        return shape_diff(a[0], b[0], f"{path}[]")
+    return [] if a == b else [f"{path}: {json.dumps(a)} -> {json.dumps(b)}"]
+
+
+def replayable(record: dict) -> bool:
+    # Bodies that were too large or not JSON were not captured and cannot be reproduced
+    return record["body"] is not None or not record.get("body_bytes")
+
+
+async def replay(records: list, client: httpx.AsyncClient, speed: float, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+    first_ts = records[0]["ts"]
+    started = time.monotonic()
+
+    async def send(record: dict, due: float) -> None:
+        sent = time.monotonic()
+        try:
+            response = await client.request(
+                record["method"],
+                record["path"] + (f"?{record['query']}" if record.get("query") else ""),
+                headers=record.get("headers") or {},
+                json=record["body"]
+            )
+            latency = time.monotonic() - sent
+            status = response.status_code
+            body_shape = response_shape(response.headers.get("content-type", ""), response.text)
+        except Exception as e:
+            # Any per-request failure (transport, bad URL, an in-process app crash) is one result, not the end of the run
+            latency = time.monotonic() - sent
+            status = 0
+            body_shape = type(e).__name__
+        finally:
+            semaphore.release()
+        results.append({
+            "route": route_key(record),
+            "status": status,
+            "latency_ms": round(latency * 1000, 3),
+            "lag_ms": round(max(0.0, sent - due) * 1000, 3),
+            "captured_ms": record.get("duration_ms"),
+            "captured_status": record.get("status"),
+            "shape": body_shape
+        })
+
+    tasks = []
+    for i, record in enumerate(records):
+        due = started + (record["ts"] - first_ts) / speed if speed > 0 else time.monotonic()
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Holding the slot before scheduling keeps memory flat; the lag shows when the target fell behind
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(send(record, due)))
+        if (i + 1) % 1000 == 0:
+            print(f"Sent {i + 1:,} of {len(records):,} requests")
+    for record, outcome in zip(records, await asyncio.gather(*tasks, return_exceptions=True)):
+        if isinstance(outcome, BaseException):
+            print(f"{record['method']} {record['path']}: replay failed ({outcome!r})", file=sys.stderr)
+    return results
+
+
+async def run_replay(args) -> None:
+    records = sorted(read_jsonl(args.captures), key=lambda r: r["ts"])
+    skipped = sum(1 for r in records if not replayable(r))
+    records = [r for r in records if replayable(r)][:args.limit or None]
+    if not records:
+        print("Nothing to replay")
+        return
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Replaying {len(records):,} requests captured over {span:,.0f}s ({skipped:,} skipped: body not captured)")
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.in_process:
+        from server import app, startup_event, shutdown_event
+        await startup_event()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://replay", timeout=timeout)
+    else:
+        client = httpx.AsyncClient(base_url=args.target, timeout=timeout)
+    started = time.monotonic()
+    try:
+        results = await replay(records, client, args.speed, max(1, args.concurrency))
+    finally:
+        await client.aclose()
+        if args.in_process:
+            await shutdown_event()
+    elapsed = time.monotonic() - started
+    write_jsonl(args.out, results)
+    lags = [r["lag_ms"] for r in results]
+    print(f"Done in {elapsed:,.1f}s ({len(results) / max(elapsed, 1e-6):,.1f} req/s), "
+          f"p99 scheduling lag {np.percentile(lags, 99):,.1f} ms - results in {args.out}")
+
+
+def percentiles(values: list) -> list:
+    return [float(np.percentile(values, p)) for p in PERCENTILES] if values else [float("nan")] * len(PERCENTILES)
+
+
+def change(before: float, after: float) -> str:
+    return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+
+
+def run_compare(args) -> int:
+    baseline, candidate = read_jsonl([args.baseline]), read_jsonl([args.candidate])
+    latencies = {"baseline": defaultdict(list), "candidate": defaultdict(list)}
+    statuses = {"baseline": defaultdict(Counter), "candidate": defaultdict(Counter)}
+    shapes = {"baseline": defaultdict(Counter), "candidate": defaultdict(Counter)}
+    for name, results in (("baseline", baseline), ("candidate", candidate)):
+        for r in results:
+            latencies[name][r["route"]].append(r["latency_ms"])
+            latencies[name]["ALL"].append(r["latency_ms"])
+            statuses[name][r["route"]][r["status"]] += 1
+            shapes[name][r["route"]][json.dumps(r["shape"], sort_keys=True)] += 1
+
+    routes = sorted(set(latencies["baseline"]) | set(latencies["candidate"]), key=lambda k: (k != "ALL", k))
+    header = " ".join(f"{'p' + str(p):>19}" for p in PERCENTILES)
+    print(f"{'route':<44} {'n':>13} {header}   p99 change")
+    worst = 0.0
+    for route in routes:
+        a, b = latencies["baseline"][route], latencies["candidate"][route]
+        pa, pb = percentiles(a), percentiles(b)
+        cells = " ".join(f"{x:>8.1f} -> {y:>7.1f}" for x, y in zip(pa, pb))
+        print(f"{route:<44} {len(a):>6}/{len(b):<6} {cells}   {change(pa[-1], pb[-1])}")
+        if route != "ALL" and a and b and pa[-1]:
+            worst = max(worst, (pb[-1] - pa[-1]) / pa[-1] * 100)
+
+    mismatches = 0
+    for route in routes:
+        if route == "ALL":
+            continue
+        if statuses["baseline"][route] != statuses["candidate"][route]:
+            mismatches += 1
+            print(f"\n{route}: status mix {dict(statuses['baseline'][route])} -> {dict(statuses['candidate'][route])}")
+        before, after = shapes["baseline"][route], shapes["candidate"][route]
+        if set(before) != set(after) and before and after:
+            mismatches += 1
+            common_before = json.loads(before.most_common(1)[0][0])
+            common_after = json.loads(after.most_common(1)[0][0])
+            print(f"\n{route}: response shape changed")
+            for line in shape_diff(common_before, common_after)[:10] or ["variant mix differs"]:
+                print(f"  {line}")
+    print(f"\n{mismatches} route(s) with status or shape differences")
+
+    if args.max_p99_regression is not None and worst > args.max_p99_regression:
+        print(f"Worst per-route p99 regression {worst:.1f}% exceeds {args.max_p99_regression}%")
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay captured /api traffic and compare builds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = commands.add_parser("replay", help="send captured requests to a build")
+    replay_parser.add_argument("captures", nargs="+", help="capture files (traffic-*.jsonl.gz)")
+    replay_parser.add_argument("--out", required=True, help="where to write the results (.jsonl.gz)")
+    target = replay_parser.add_mutually_exclusive_group()
+    target.add_argument("--target", default="http://localhost:8001", help="base URL of the build under test")
+    target.add_argument("--in-process", action="store_true", help="serve this checkout's app in-process")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="rate multiplier; 0 sends as fast as possible")
+    replay_parser.add_argument("--concurrency", type=int, default=64, help="maximum requests in flight")
+    replay_parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    replay_parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+
+    compare_parser = commands.add_parser("compare", help="compare two replay result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--max-p99-regression", type=float, default=None,
+                                help="exit non-zero if any route's p99 grows by more than this percentage")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        asyncio.run(run_replay(args))
+    else:
+        sys.exit(run_compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -115,6 +115,18 @@ class GodBotAPITester:
             print(f"   Insights: {len(data.get('insights', []))}")
         return success
 
+    def test_metrics_endpoint(self):
+        """Test runtime metrics endpoint"""
+        success, data = self.run_test("Runtime Metrics", "GET", "metrics", 200)
+        if success:
+            required_fields = ['worker_id', 'providers', 'cache_bus', 'single_flight']
+            for field in required_fields:
+                if field not in data:
+                    print(f"❌ Missing required field: {field}")
+                    return False
+            print(f"   Duplicates Avoided: {data.get('single_flight', {}).get('total_duplicates_avoided')}")
+        return success
+
     def test_personas_endpoint(self):
         """Test personas endpoint"""
         success, data = self.run_test("Get Personas", "GET", "personas", 200)
@@ -174,6 +186,51 @@ class GodBotAPITester:
             print(f"   Response Length: {len(data.get('content', ''))}")
         return success
 
+    def test_chat_idempotency(self):
+        """Test that a retried chat with the same Idempotency-Key replays the stored response"""
+        chat_data = {
+            "message": "Idempotent test message for GodBot",
+            "persona_id": self.persona_id or "godmind-default",
+            "tier": "dev"
+        }
+        headers = {'Idempotency-Key': f"backend-test-{datetime.now().timestamp()}"}
+        success, first = self.run_test("Chat Idempotent First", "POST", "chat", 200, chat_data, headers)
+        if not success:
+            return False
+        success, retry = self.run_test("Chat Idempotent Retry", "POST", "chat", 200, chat_data, headers)
+        if success and retry.get('id') != first.get('id'):
+            print("❌ Retry did not replay the original response")
+            return False
+        changed = dict(chat_data, message="A different message")
+        conflict, _ = self.run_test("Chat Idempotent Conflict", "POST", "chat", 422, changed, headers)
+        return success and conflict
+
+    def test_chat_batch_endpoint(self):
+        """Test batch chat endpoint streams one NDJSON line per request"""
+        batch_data = {
+            "requests": [
+                {"message": f"Batch test message {i}", "persona_id": "godmind-default", "tier": "dev"}
+                for i in range(3)
+            ],
+            "concurrency": 2
+        }
+        url = f"{self.api_url}/chat/batch"
+        self.tests_run += 1
+        print(f"\n🔍 Testing Chat Batch...")
+        print(f"   URL: {url}")
+        try:
+            response = requests.post(url, json=batch_data, timeout=60)
+            lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+            if response.status_code != 200 or len(lines) != 3 or not all(line.get('ok') for line in lines):
+                print(f"❌ Failed - Status: {response.status_code}, results: {len(lines)}")
+                return False
+            self.tests_passed += 1
+            print(f"✅ Passed - {len(lines)} results streamed")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_sessions_endpoint(self):
         """Test sessions endpoint"""
         success, data = self.run_test("Get Sessions", "GET", "sessions", 200)
@@ -191,6 +248,22 @@ class GodBotAPITester:
                     return False
         return success
 
+    def test_session_partitioning(self):
+        """Test that another user cannot see this user's session"""
+        if not self.session_id:
+            print("⚠️  Skipping session partitioning test - no session ID available")
+            return True
+        
+        other_user = {'X-User-Id': 'backend-test-other-user'}
+        success, _ = self.run_test(
+            "Session Hidden From Other User", 
+            "GET", 
+            f"sessions/{self.session_id}", 
+            404,
+            headers=other_user
+        )
+        return success
+
     def test_session_messages(self):
         """Test getting messages for a session"""
         if not self.session_id:
@@ -210,6 +283,27 @@ class GodBotAPITester:
             print(f"   Found {len(data)} messages in session")
         return success
 
+    def test_session_emotions(self):
+        """Test emotional trajectory analytics for a session"""
+        if not self.session_id:
+            print("⚠️  Skipping session emotions test - no session ID available")
+            return True
+            
+        success, data = self.run_test(
+            "Session Emotions", 
+            "GET", 
+            f"sessions/{self.session_id}/emotions?points=20", 
+            200
+        )
+        if success:
+            required_fields = ['count', 'dimensions', 'mean', 'trajectory', 'per_persona']
+            for field in required_fields:
+                if field not in data:
+                    print(f"❌ Missing required field: {field}")
+                    return False
+            print(f"   Marked Messages: {data.get('count')}")
+        return success
+
     def test_delete_session(self):
         """Test deleting a session"""
         if not self.session_id:
@@ -237,11 +331,16 @@ def main():
         ("GodBot Pledge", tester.test_pledge_endpoint),
         ("Dashboard Metrics", tester.test_dashboard_endpoint),
         ("DreamChain Insights", tester.test_dreamchain_endpoint),
+        ("Runtime Metrics", tester.test_metrics_endpoint),
         ("Personas", tester.test_personas_endpoint),
         ("Tiers Configuration", tester.test_tiers_endpoint),
         ("Chat Message", tester.test_chat_endpoint),
+        ("Chat Idempotency", tester.test_chat_idempotency),
+        ("Chat Batch", tester.test_chat_batch_endpoint),
         ("Sessions List", tester.test_sessions_endpoint),
+        ("Session Partitioning", tester.test_session_partitioning),
         ("Session Messages", tester.test_session_messages),
+        ("Session Emotions", tester.test_session_emotions),
         ("Delete Session", tester.test_delete_session),
     ]
     
@@ -391,6 +391,8 @@ function App() {
   const [dreams, setDreams] = useState(null);
   const messagesEndRef = useRef(null);
   const inputRef = useRef(null);
+  const sessionsRef = useRef([]);
+  const currentSessionRef = useRef(null);
 
   useEffect(() => {
     fetchPersonas();
@@ -400,6 +402,50 @@ function App() {
     return () => clearInterval(interval);
   }, []);
 
+  useEffect(() => {
+    sessionsRef.current = sessions;
+    currentSessionRef.current = currentSession;
+  }, [sessions, currentSession]);
+
+  useEffect(() => {
+    // Changes made here or in other open clients are pushed instead of re-fetched
+    const events = new EventSource(`${API}/events`);
+    const on = (type, handler) => events.addEventListener(type, (e) => handler(JSON.parse(e.data)));
+    on("session-updated", (data) => {
+      if (data.deleted) {
+        setSessions(prev => prev.filter(s => s.id !== data.session_id));
+        return;
+      }
+      if (!sessionsRef.current.some(s => s.id === data.session_id)) {
+        fetchSessions();
+        return;
+      }
+      setSessions(prev => {
+        const session = prev.find(s => s.id === data.session_id);
+        if (!session) return prev;
+        const updated = { ...session, updated_at: data.updated_at, message_count: session.message_count + data.messages_added };
+        return [updated, ...prev.filter(s => s.id !== data.session_id)];
+      });
+    });
+    on("message-added", (data) => {
+      if (currentSessionRef.current?.id !== data.session_id) return;
+      setMessages(prev => prev.some(m => m.id === data.id || (m.pending && m.role === data.role && m.content === data.content))
+        ? prev
+        : [...prev, data]);
+    });
+    on("credits-changed", (data) => {
+      setDashboard(prev => prev ? { ...prev, usage: { ...prev.usage, ...data } } : prev);
+    });
+    on("dream-generated", (data) => {
+      setDreams(prev => prev ? { ...prev, insights: data.insights } : prev);
+    });
+    on("resync", () => {
+      fetchSessions();
+      if (currentSessionRef.current) fetchMessages(currentSessionRef.current.id);
+    });
+    return () => events.close();
+  }, []);
+
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages]);
@@ -501,7 +547,7 @@ function App() {
   const handleSend = async () => {
     if (!input.trim() || isLoading) return;
 
-    const userMessage = { id: Date.now().toString(), role: "user", content: input, timestamp: new Date().toISOString() };
+    const userMessage = { id: Date.now().toString(), role: "user", content: input, timestamp: new Date().toISOString(), pending: true };
     setMessages(prev => [...prev, userMessage]);
     setInput("");
     setIsLoading(true);
@@ -525,7 +571,10 @@ function App() {
         credits_used: response.data.credits_used,
       };
 
-      setMessages(prev => [...prev, assistantMessage]);
+      // The pushed message-added event may have landed first
+      setMessages(prev => prev.some(m => m.id === assistantMessage.id)
+        ? prev.map(m => m.id === assistantMessage.id ? assistantMessage : m)
+        : [...prev, assistantMessage]);
       if (!currentSession) {
         setCurrentSession({ id: response.data.session_id, name: "New Session", message_count: 2 });
         fetchSessions();
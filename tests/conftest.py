@@ -0,0 +1,9 @@
+"""Unit tests import backend/server.py directly; no MongoDB connection is made at import time."""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "godbot_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,86 @@
+"""AdmissionController queue bounds and hand-off"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.fixture
+def tight_free_tier(monkeypatch):
+    monkeypatch.setitem(server.ADMISSION_POLICY, "free", {"max_queue": 3, "max_wait": 0.02})
+
+
+def test_expired_waiters_do_not_fill_the_queue(tight_free_tier):
+    async def scenario():
+        controller = server.AdmissionController(capacity=1)
+        await controller.acquire("free")  # hold the only slot
+        for _ in range(3):
+            with pytest.raises(HTTPException) as rejected:
+                await controller.acquire("free")
+            assert "deadline" in rejected.value.detail
+        assert len(controller.queues["free"]) == 0
+        assert controller.expired["free"] == 3
+
+        # The queue has room again: a waiter is admitted as soon as the slot frees up
+        waiter = asyncio.create_task(controller.acquire("free"))
+        await asyncio.sleep(0)
+        controller.release()
+        await waiter
+        assert controller.shed["free"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_leave_the_queue(tight_free_tier):
+    async def scenario():
+        controller = server.AdmissionController(capacity=1)
+        await controller.acquire("free")
+        waiters = [asyncio.create_task(controller.acquire("free")) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert len(controller.queues["free"]) == 3
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert len(controller.queues["free"]) == 0
+        assert controller.stats()["tiers"]["free"]["queue_depth"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_shed(tight_free_tier, monkeypatch):
+    monkeypatch.setitem(server.ADMISSION_POLICY, "free", {"max_queue": 1, "max_wait": 1.0})
+
+    async def scenario():
+        controller = server.AdmissionController(capacity=1)
+        await controller.acquire("free")
+        queued = asyncio.create_task(controller.acquire("free"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("free")
+        assert rejected.value.status_code == 503
+        assert "queue full" in rejected.value.detail
+        controller.release()
+        await queued
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_is_bounded_by_the_request_deadline(monkeypatch):
+    monkeypatch.setitem(server.ADMISSION_POLICY, "god", {"max_queue": 1, "max_wait": 15.0})
+
+    async def scenario():
+        controller = server.AdmissionController(capacity=1)
+        await controller.acquire("god")
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("god", server.Deadline(0.05))
+        assert rejected.value.status_code == 504
+        assert "admission" in rejected.value.detail
+        assert asyncio.get_running_loop().time() - started < 1.0
+        # The abandoned waiter no longer counts against max_queue
+        assert len(controller.queues["god"]) == 0
+
+    asyncio.run(scenario())
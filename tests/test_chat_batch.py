@@ -0,0 +1,45 @@
+"""Batch chat results are only reported as ok once their turns are stored"""
+
+import asyncio
+import json
+
+import pytest
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["godbot_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def run_batch(messages):
+    batch = server.BatchChatRequest(requests=[server.ChatRequest(message=m, tier="dev") for m in messages])
+
+    async def collect():
+        return [json.loads(line) async for line in server.stream_chat_batch(batch, "batch_user")]
+
+    return asyncio.run(collect())
+
+
+def test_results_follow_a_successful_flush(mock_db):
+    results = run_batch(["one", "two", "three"])
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    assert all(r["ok"] for r in results)
+    stored = asyncio.run(mock_db.messages.count_documents({"user_id": "batch_user"}))
+    assert stored == 6
+
+
+def test_failed_flush_reports_its_turns_as_failed(mock_db, monkeypatch):
+    async def broken_insert(self, *messages):
+        raise server.PyMongoError("primary stepped down")
+
+    monkeypatch.setattr(server.MessageRepository, "insert", broken_insert)
+    results = run_batch(["one", "two"])
+    assert sorted(r["index"] for r in results) == [0, 1]
+    assert not any(r["ok"] for r in results)
+    assert {r["status"] for r in results} == {500}
@@ -0,0 +1,47 @@
+"""A chat turn that runs out of time stores nothing"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["godbot_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def test_deadline_during_generation_leaves_no_orphaned_user_message(mock_db, monkeypatch):
+    async def slow_generate(self, history):
+        assert history[-1]["id"] == self.user_message.id
+        server.request_deadline.get().expires_at = 0
+        server.deadline_check("generation")
+
+    monkeypatch.setattr(server.ChatTurn, "generate", slow_generate)
+
+    async def scenario():
+        server.request_deadline.set(server.Deadline(5))
+        request = server.ChatRequest(message="hello", session_id="s1", tier="dev")
+        with pytest.raises(HTTPException) as exceeded:
+            await server.process_chat(request, "alice")
+        assert exceeded.value.status_code == 504
+        assert await mock_db.messages.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_completed_turn_stores_both_messages(mock_db):
+    async def scenario():
+        request = server.ChatRequest(message="hello", session_id="s1", tier="dev")
+        response = await server.process_chat(request, "alice")
+        stored = await mock_db.messages.find({"session_id": "s1"}).to_list(None)
+        assert sorted(m["role"] for m in stored) == ["assistant", "user"]
+        assert response.session_id == "s1"
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+"""WebSocket chat reports bad frames instead of dropping the connection"""
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def socket(monkeypatch):
+    monkeypatch.setattr(server, "db", mongomock_motor.AsyncMongoMockClient()["godbot_test"])
+    with TestClient(server.app).websocket_connect("/api/ws/chat?session_id=ws1") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        yield ws
+
+
+@pytest.mark.parametrize("send", [
+    lambda ws: ws.send_json({"message": "x", "custom_weights": "bad"}),
+    lambda ws: ws.send_json(["not", "an", "object"]),
+    lambda ws: ws.send_text("not json"),
+    lambda ws: ws.send_json({"message": ""}),
+])
+def test_bad_frames_get_an_error_and_the_session_goes_on(socket, send):
+    send(socket)
+    error = socket.receive_json()
+    assert error["type"] == "error" and error["status"] == 422
+
+    socket.send_json({"message": "still there?"})
+    assert socket.receive_json()["type"] == "message"
+
+
+def test_session_closes_with_a_code_when_processing_fails(socket, monkeypatch):
+    async def broken_persist(self, turn):
+        raise RuntimeError("database gone")
+
+    monkeypatch.setattr(server.ChatConnection, "persist", broken_persist)
+    socket.send_json({"message": "hello"})
+    with pytest.raises(WebSocketDisconnect) as closed:
+        socket.receive_json()
+    assert closed.value.code == 1011
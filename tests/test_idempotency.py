@@ -0,0 +1,55 @@
+"""IdempotencyStore claim renewal while the original request is still running"""
+
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class Reply(BaseModel):
+    text: str
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(server, "db", mongomock_motor.AsyncMongoMockClient()["godbot_test"])
+    monkeypatch.setattr(server, "IDEMPOTENCY_LEASE_SECONDS", 0.3)
+    return server.IdempotencyStore()
+
+
+def test_running_request_keeps_its_claim_past_the_lease(store):
+    async def scenario():
+        async def slow():
+            await asyncio.sleep(1.0)
+            return Reply(text="once")
+
+        original = asyncio.create_task(store.run("u1:chat", "k1", {"q": 1}, slow))
+        # Several lease lengths in, a retry must still find the claim live rather than take it over
+        await asyncio.sleep(0.7)
+        assert not await store._take_over("u1:chat:k1")
+        assert await original == (Reply(text="once"), False)
+
+        record = await server.db.idempotency.find_one({"_id": "u1:chat:k1"})
+        assert record["status"] == "done" and "lease_expires_at" not in record
+        assert await store.run("u1:chat", "k1", {"q": 1}, slow) == ({"text": "once"}, True)
+        assert store.stats()["takeovers"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_claim_is_taken_over(store):
+    async def scenario():
+        await store._claim("u1:chat:k2", store.fingerprint({"q": 1}))
+        await asyncio.sleep(0.4)
+
+        async def fast():
+            return Reply(text="retried")
+
+        assert await store.run("u1:chat", "k2", {"q": 1}, fast) == (Reply(text="retried"), False)
+        assert store.stats()["takeovers"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+"""Index upgrades tolerate concurrent workers and remember when duplicates block them"""
+
+import asyncio
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["godbot_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def count_drops(monkeypatch, collection_class) -> list:
+    drops = []
+    real_drop = collection_class.drop_index
+
+    async def drop_index(self, name):
+        drops.append(name)
+        return await real_drop(self, name)
+
+    monkeypatch.setattr(collection_class, "drop_index", drop_index)
+    return drops
+
+
+def test_duplicates_keep_a_plain_index_without_rebuilding_it_on_every_start(mock_db, monkeypatch):
+    async def scenario():
+        await mock_db.things.insert_many([{"id": "a"}, {"id": "a"}])
+        await mock_db.things.create_index([("id", 1)], name="id_1")
+        drops = count_drops(monkeypatch, type(mock_db.things))
+
+        await server.ensure_unique_index(mock_db.things, "id")
+        info = await mock_db.things.index_information()
+        assert "id_1" in info and not info["id_1"].get("unique")
+        assert drops == ["id_1"]
+
+        await server.ensure_unique_index(mock_db.things, "id")
+        assert drops == ["id_1"]
+
+        # Once the duplicates are gone and the marker is cleared, the upgrade goes through
+        await mock_db.things.delete_one({"id": "a"})
+        await mock_db.migrations.delete_one({"_id": "unique_index:things.id_1"})
+        await server.ensure_unique_index(mock_db.things, "id")
+        assert (await mock_db.things.index_information())["id_1"].get("unique")
+
+    asyncio.run(scenario())
+
+
+def test_index_dropped_by_another_worker_is_not_an_error(mock_db, monkeypatch):
+    async def already_gone(self, name):
+        raise OperationFailure(f"index not found with name [{name}]", code=27)
+
+    async def scenario():
+        await mock_db.things.create_index([("id", 1)], name="id_1")
+        monkeypatch.setattr(type(mock_db.things), "drop_index", already_gone)
+        await server.ensure_unique_index(mock_db.things, "id")
+
+    asyncio.run(scenario())
+
+
+def test_superseded_index_dropped_by_another_worker_is_not_an_error(mock_db, monkeypatch):
+    async def already_gone(self, name):
+        raise OperationFailure(f"index not found with name [{name}]", code=27)
+
+    async def scenario():
+        await mock_db.things.create_index([("session_id", 1)], name="session_id_1")
+        monkeypatch.setattr(type(mock_db.things), "drop_index", already_gone)
+        await server.drop_superseded_indexes(mock_db.things, "session_id_1")
+
+    asyncio.run(scenario())
+
+
+def test_other_drop_failures_still_surface(mock_db, monkeypatch):
+    async def refused(self, name):
+        raise OperationFailure("not authorized", code=13)
+
+    async def scenario():
+        await mock_db.things.create_index([("session_id", 1)], name="session_id_1")
+        monkeypatch.setattr(type(mock_db.things), "drop_index", refused)
+        with pytest.raises(OperationFailure):
+            await server.drop_superseded_indexes(mock_db.things, "session_id_1")
+
+    asyncio.run(scenario())
@@ -0,0 +1,105 @@
+"""Fenced writes of leader-elected jobs and the dreamchain job's input gating"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["godbot_test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "lease_coordinator", server.LeaseCoordinator())
+    monkeypatch.setattr(server, "WORKER_ID", "worker-a")
+    return database
+
+
+async def steal(database, monkeypatch, name: str) -> server.Lease:
+    """Expire name's lease as if its holder stalled past the TTL, and let worker-b take it over"""
+    await database.leases.update_one({"_id": name}, {"$set": {"expires_at": datetime(2000, 1, 1)}})
+    monkeypatch.setattr(server, "WORKER_ID", "worker-b")
+    successor = await server.LeaseCoordinator().acquire(name)
+    monkeypatch.setattr(server, "WORKER_ID", "worker-a")
+    return successor
+
+
+def test_deposed_leader_cannot_roll_up_usage(mock_db, monkeypatch):
+    async def scenario():
+        await mock_db.usage.insert_one({"user_id": "u1", "rollup_day": "2000-01-01", "requests_today": 7})
+        lease = await server.lease_coordinator.acquire("usage_rollup")
+        successor = await steal(mock_db, monkeypatch, "usage_rollup")
+        assert successor.token == lease.token + 1
+
+        # The old holder's local lease still looks valid; the fenced write must catch it
+        assert lease.valid
+        with pytest.raises(server.LeaseLost):
+            await server.roll_up_usage(lease)
+        assert await mock_db.usage_daily.count_documents({}) == 0
+        usage = await mock_db.usage.find_one({"user_id": "u1"})
+        assert usage["requests_today"] == 7 and usage["rollup_day"] == "2000-01-01"
+        assert not lease.valid and "usage_rollup" not in server.lease_coordinator.held
+
+        with pytest.raises(server.LeaseLost):
+            await server.lease_coordinator.complete(lease)
+
+    asyncio.run(scenario())
+
+
+def test_deposed_leader_cannot_archive_sessions(mock_db, monkeypatch):
+    async def scenario():
+        await mock_db.messages.insert_many([
+            {"_id": f"m{i}", "user_id": "u1", "session_id": "s1", "timestamp": i} for i in range(3)
+        ])
+        lease = await server.lease_coordinator.acquire("archive_sessions")
+        await steal(mock_db, monkeypatch, "archive_sessions")
+
+        with pytest.raises(server.LeaseLost):
+            await server.session_archive.archive_session("u1", "s1", lease)
+        assert await mock_db.messages.count_documents({"session_id": "s1"}) == 3
+        assert await mock_db.archived_sessions.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_current_leader_writes_go_through(mock_db):
+    async def scenario():
+        await mock_db.usage.insert_one({"user_id": "u1", "rollup_day": "2000-01-01", "requests_today": 7})
+        lease = await server.lease_coordinator.acquire("usage_rollup")
+        await server.roll_up_usage(lease)
+        assert await mock_db.usage_daily.count_documents({"user_id": "u1"}) == 1
+        await server.lease_coordinator.complete(lease)
+
+    asyncio.run(scenario())
+
+
+def test_dream_cycle_runs_only_on_new_memories_and_keeps_reviews(mock_db):
+    async def scenario():
+        lease = await server.lease_coordinator.acquire("dreamchain")
+        await server.dream_cycle_job(lease)
+        assert await mock_db.dreams.count_documents({}) == 0
+
+        await mock_db.memory.insert_one({"id": "m1", "created_at": datetime.now(timezone.utc).isoformat()})
+        await server.dream_cycle_job(lease)
+        first = await mock_db.dreams.find({}, {"_id": 0}).to_list(None)
+        assert first
+        await server.dreams_repo.acknowledge(first[0]["id"])
+
+        # Nothing stored since the last completed run: the job is a no-op
+        lease.last_completed_at = datetime.now(timezone.utc) + timedelta(seconds=1)
+        await server.dream_cycle_job(lease)
+        assert await mock_db.dreams.find({}, {"_id": 0}).to_list(None) == [
+            {**first[0], "reviewed": True}, *first[1:]
+        ]
+        # A re-derived insight refreshes the existing document instead of adding a duplicate
+        await server.run_dream_cycle()
+        again = await mock_db.dreams.find({}, {"_id": 0}).to_list(None)
+        assert len(again) == len(first)
+        reviewed = next(d for d in again if d["id"] == first[0]["id"])
+        assert reviewed["reviewed"] is True
+
+    asyncio.run(scenario())
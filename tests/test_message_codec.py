@@ -0,0 +1,55 @@
+"""Message storage codec round trips through BSON, including legacy documents"""
+
+import bson
+from bson import ObjectId
+
+import server
+
+
+def through_bson(doc: dict) -> dict:
+    return bson.decode(bson.encode(doc))
+
+
+def legacy_document() -> dict:
+    """The pre-compact shape migrate_messages.py rewrites: ObjectId _id, string id, ISO timestamp, full dicts"""
+    return {
+        "_id": ObjectId(),
+        "id": "6f1c2b9e-3d4a-4e5f-8a7b-1c2d3e4f5a6b",
+        "user_id": "u1",
+        "session_id": "s1",
+        "role": "assistant",
+        "content": "legacy reply",
+        "persona_id": "godmind",
+        "timestamp": "2025-03-04T05:06:07.123456+00:00",
+        "metadata": {"model": "claude"},
+        "fusion_data": {"models": ["a", "b"]},
+        "lore": {"memory_class": "lore", "lore_tag": "origin", "echo_flag": True, "importance": 0.5},
+        "emotional_markers": {"stress": 0.1, "curiosity": 0.9, "frustration": 0.0,
+                              "excitement": 0.4, "focus": 0.7, "warmth": 0.2}
+    }
+
+
+def test_round_trip_keeps_microseconds():
+    message = server.Message(session_id="s1", role="user", content="hi",
+                             timestamp="2026-01-02T03:04:05.678901+00:00")
+    stored = through_bson(server.encode_message(message))
+    assert server.decode_message(stored) == message.model_dump(mode="json")
+
+
+def test_whole_millisecond_timestamps_store_no_remainder():
+    message = server.Message(session_id="s1", role="user", content="hi",
+                             timestamp="2026-01-02T03:04:05.678000+00:00")
+    stored = through_bson(server.encode_message(message))
+    assert "us" not in stored
+    assert server.decode_message(stored)["timestamp"] == message.timestamp
+
+
+def test_legacy_document_reads_the_same_before_and_after_migration():
+    legacy = legacy_document()
+    before = server.decode_message(through_bson(legacy))
+    assert before["id"] == legacy["id"] and before["timestamp"] == legacy["timestamp"]
+
+    # What migrate_messages.py writes for it
+    migrated = through_bson(server.encode_message(server.Message(**legacy)))
+    assert "id" not in migrated and isinstance(migrated["_id"], bson.Binary)
+    assert server.decode_message(migrated) == before
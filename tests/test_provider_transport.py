@@ -0,0 +1,136 @@
+"""ProviderTransport and CircuitBreaker against a stub provider (httpx.MockTransport)"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import server
+
+
+def make_transport(handler, threshold=2, reset_after=60.0):
+    transport = server.ProviderTransport("deepseek", {
+        "base_url": "https://stub.test",
+        "path": "/chat/completions",
+        "api_key": "test-key",
+        "model": "stub",
+        "style": "openai"
+    })
+    transport.breaker = server.CircuitBreaker(threshold=threshold, reset_after=reset_after)
+    transport.client = httpx.AsyncClient(base_url="https://stub.test", transport=httpx.MockTransport(handler))
+    return transport
+
+
+def completion(text="hello"):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def reopen_window(transport):
+    # Pretend the reset window has passed so the breaker goes half-open
+    transport.breaker.opened_at -= transport.breaker.reset_after
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(server, "PROVIDER_BACKOFF_BASE_SECONDS", 0.0)
+    monkeypatch.setattr(server, "PROVIDER_MAX_RETRIES", 1)
+
+
+def test_success_returns_reply_text():
+    transport = make_transport(lambda request: completion("hi there"))
+    assert asyncio.run(transport.chat([{"role": "user", "content": "x"}])) == "hi there"
+    assert transport.breaker.state == "closed"
+
+
+def test_timeouts_are_retried_then_open_the_breaker():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("stub timeout", request=request)
+
+    transport = make_transport(handler, threshold=2)
+    for _ in range(2):
+        with pytest.raises(server.ProviderUnavailable):
+            asyncio.run(transport.chat([]))
+    assert len(calls) == 4  # one retry per call
+    assert transport.breaker.state == "open"
+    assert not transport.healthy
+    with pytest.raises(server.ProviderUnavailable, match="open"):
+        asyncio.run(transport.chat([]))
+    assert len(calls) == 4  # an open breaker never reaches the provider
+
+
+def test_5xx_counts_as_failure():
+    transport = make_transport(lambda request: httpx.Response(503), threshold=1)
+    with pytest.raises(server.ProviderUnavailable):
+        asyncio.run(transport.chat([]))
+    assert transport.failures == 1
+    assert transport.breaker.state == "open"
+
+
+def test_half_open_probe_recovers():
+    responses = iter([httpx.Response(500), httpx.Response(500), completion("back")])
+    transport = make_transport(lambda request: next(responses), threshold=1)
+    with pytest.raises(server.ProviderUnavailable):
+        asyncio.run(transport.chat([]))
+    reopen_window(transport)
+    assert transport.breaker.state == "half_open"
+    assert asyncio.run(transport.chat([])) == "back"
+    assert transport.breaker.state == "closed"
+    assert transport.healthy
+
+
+def test_failed_probe_reopens():
+    transport = make_transport(lambda request: httpx.Response(400), threshold=1)
+    with pytest.raises(server.ProviderUnavailable):
+        asyncio.run(transport.chat([]))
+    reopen_window(transport)
+    with pytest.raises(server.ProviderUnavailable):
+        asyncio.run(transport.chat([]))
+    assert transport.breaker.state == "open"
+
+
+def test_cancelled_probe_does_not_wedge_half_open():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return completion()
+
+        transport = make_transport(lambda request: httpx.Response(400), threshold=1)
+        with pytest.raises(server.ProviderUnavailable):
+            await transport.chat([])
+        reopen_window(transport)
+        transport.client = httpx.AsyncClient(base_url="https://stub.test", transport=httpx.MockTransport(handler))
+
+        probe = asyncio.create_task(transport.chat([]))
+        await asyncio.sleep(0)
+        assert transport.breaker.probing
+        assert not transport.healthy  # other callers would be refused while the probe is out
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(probe, timeout=0.05)
+        assert not transport.breaker.probing
+        assert transport.breaker.state == "open"
+
+        reopen_window(transport)
+        release.set()
+        assert await transport.chat([]) == "hello"
+        return transport
+
+    transport = asyncio.run(scenario())
+    assert transport.breaker.state == "closed"
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(200, text="<html>gateway</html>"),
+    httpx.Response(200, json={"unexpected": True}),
+    httpx.Response(200, json={"choices": []}),
+])
+def test_malformed_200_counts_as_failure(response):
+    transport = make_transport(lambda request: response, threshold=1)
+    with pytest.raises(server.ProviderUnavailable):
+        asyncio.run(transport.chat([]))
+    assert transport.failures == 1
+    assert transport.breaker.state == "open"
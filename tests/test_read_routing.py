@@ -0,0 +1,88 @@
+"""Read-your-writes routing when the write and the read land on different workers"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "read_router", server.ReadRouter())
+    app = FastAPI()
+    app.add_middleware(server.ReadYourWritesMiddleware)
+
+    @app.post("/api/write")
+    async def write(user_id: str = Depends(server.current_user)):
+        server.read_router.note_write(user_id)
+        return {}
+
+    @app.get("/api/read")
+    async def read(user_id: str = Depends(server.stale_reads_user)):
+        return {"stale_ok": server.stale_reads_ok.get()}
+
+    return TestClient(app)
+
+
+def other_worker(monkeypatch):
+    """A fresh router has none of this process's write history, like a different worker"""
+    monkeypatch.setattr(server, "read_router", server.ReadRouter())
+
+
+def test_reads_may_go_to_secondaries_without_a_recent_write(client):
+    assert client.get("/api/read").json() == {"stale_ok": True}
+    assert "last_write" not in client.cookies
+
+
+def test_cookie_pins_reads_to_the_primary_on_another_worker(client, monkeypatch):
+    response = client.post("/api/write")
+    assert float(response.headers["X-Last-Write"]) == pytest.approx(time.time(), abs=5)
+    assert "last_write" in client.cookies
+
+    other_worker(monkeypatch)
+    assert client.get("/api/read").json() == {"stale_ok": False}
+    assert server.read_router.stats()["read_your_writes_client_pinned"] == 1
+
+
+def test_header_pins_reads_and_expires_after_the_staleness_bound(client, monkeypatch):
+    other_worker(monkeypatch)
+    recent = f"{time.time():.3f}"
+    assert client.get("/api/read", headers={"X-Last-Write": recent}).json() == {"stale_ok": False}
+
+    old = f"{time.time() - server.READ_YOUR_WRITES_SECONDS - 1:.3f}"
+    assert client.get("/api/read", headers={"X-Last-Write": old}).json() == {"stale_ok": True}
+    assert client.get("/api/read", headers={"X-Last-Write": "garbage"}).json() == {"stale_ok": True}
+
+
+def test_pinned_dashboard_read_does_not_join_a_stale_run(monkeypatch):
+    monkeypatch.setattr(server, "single_flight", server.SingleFlight())
+
+    async def scenario():
+        release = asyncio.Event()
+        seen = []
+
+        async def compute_dashboard(user_id):
+            seen.append(server.stale_reads_ok.get())
+            await release.wait()
+            return {"stale_ok": server.stale_reads_ok.get()}
+
+        monkeypatch.setattr(server, "compute_dashboard", compute_dashboard)
+
+        async def call(stale_ok: bool):
+            server.stale_reads_ok.set(stale_ok)
+            return await server.get_dashboard("alice")
+
+        stale = asyncio.create_task(call(True))
+        await asyncio.sleep(0)
+        pinned = asyncio.create_task(call(False))
+        await asyncio.sleep(0)
+        release.set()
+        assert await stale == {"stale_ok": True}
+        assert await pinned == {"stale_ok": False}
+        assert sorted(seen) == [False, True]
+
+    asyncio.run(scenario())
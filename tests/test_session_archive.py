@@ -0,0 +1,162 @@
+"""SessionArchive keeps tenants that share a session id apart"""
+
+import asyncio
+
+import pytest
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["godbot_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def messages(user_id: str, session_id: str, count: int) -> list:
+    return [
+        server.encode_message(server.Message(user_id=user_id, session_id=session_id, role="user", content=f"{user_id} {i}"))
+        for i in range(count)
+    ]
+
+
+def test_same_session_id_for_two_users_archives_separately(mock_db):
+    async def scenario():
+        await mock_db.messages.insert_many(messages("alice", "s1", 3) + messages("bob", "s1", 2))
+        archive = server.SessionArchive()
+        assert await archive.archive_session("alice", "s1") == 3
+        assert await archive.archive_session("bob", "s1") == 2
+        assert await mock_db.archived_sessions.count_documents({}) == 2
+        assert await mock_db.messages.count_documents({}) == 0
+
+        assert await archive.rehydrate("alice", "s1") == 3
+        restored = await mock_db.messages.find({"user_id": "alice"}).to_list(None)
+        assert sorted(m["content"] for m in restored) == ["alice 0", "alice 1", "alice 2"]
+
+        await archive.discard("alice", "s1")
+        assert await archive.rehydrate("bob", "s1") == 2
+        assert await mock_db.archived_sessions.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_records_keyed_by_bare_session_id_still_rehydrate(mock_db):
+    async def scenario():
+        await mock_db.messages.insert_many(messages("alice", "s1", 2))
+        archive = server.SessionArchive()
+        await archive.archive_session("alice", "s1")
+        # Shape written before archive records were keyed by owner and session
+        record = await mock_db.archived_sessions.find_one({})
+        await mock_db.archived_sessions.delete_many({})
+        await mock_db.archived_sessions.insert_one({**record, "_id": "s1"})
+
+        assert await archive.rehydrate("bob", "s1") == 0
+        assert await archive.rehydrate("alice", "s1") == 2
+        assert await mock_db.archived_sessions.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_archive_files_are_per_owner(mock_db, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "ARCHIVE_DIR", str(tmp_path))
+
+    async def scenario():
+        await mock_db.messages.insert_many(messages("alice", "s1", 1) + messages("bob", "s1", 1))
+        archive = server.SessionArchive()
+        await archive.archive_session("alice", "s1")
+        await archive.archive_session("bob", "s1")
+        assert len(list(tmp_path.iterdir())) == 2
+        assert await archive.rehydrate("alice", "s1") == 1
+        assert len(list(tmp_path.iterdir())) == 1
+
+    asyncio.run(scenario())
+
+
+def test_archive_file_names_do_not_follow_the_session_id(mock_db, monkeypatch, tmp_path):
+    archive_dir = tmp_path / "archive"
+    archive_dir.mkdir()
+    monkeypatch.setattr(server, "ARCHIVE_DIR", str(archive_dir))
+
+    async def scenario():
+        await mock_db.messages.insert_many(messages("alice", "../../escape", 2))
+        archive = server.SessionArchive()
+        assert await archive.archive_session("alice", "../../escape") == 2
+        assert [p.parent for p in tmp_path.rglob("*.bson.*")] == [archive_dir]
+        assert await archive.rehydrate("alice", "../../escape") == 2
+
+    asyncio.run(scenario())
+
+
+class FakeBucket:
+    """In-memory stand-in for the GridFS bucket, which mongomock does not provide"""
+
+    files = {}
+
+    async def upload_from_stream(self, filename, data):
+        file_id = len(self.files) + 1
+        self.files[file_id] = bytes(data)
+        return file_id
+
+    async def open_download_stream(self, file_id):
+        data = self.files[file_id]
+
+        class Stream:
+            async def read(self):
+                return data
+
+        return Stream()
+
+    async def delete(self, file_id):
+        del self.files[file_id]
+
+
+def test_blobs_over_the_document_limit_go_to_gridfs(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "ARCHIVE_INLINE_MAX_BYTES", 10)
+    monkeypatch.setattr(FakeBucket, "files", {})
+    monkeypatch.setattr(server, "_archive_bucket", FakeBucket)
+
+    async def scenario():
+        await mock_db.messages.insert_many(messages("alice", "s1", 3))
+        archive = server.SessionArchive()
+        assert await archive.archive_session("alice", "s1") == 3
+        record = await mock_db.archived_sessions.find_one({})
+        assert "blob" not in record and record["gridfs_id"] in FakeBucket.files
+        assert await archive.rehydrate("alice", "s1") == 3
+        assert FakeBucket.files == {}
+
+    asyncio.run(scenario())
+
+
+def test_a_failing_session_does_not_stall_the_job(mock_db, monkeypatch):
+    archive = server.SessionArchive()
+    real_archive_session = archive.archive_session
+
+    async def archive_session(user_id, session_id, lease=None):
+        if session_id == "broken":
+            raise server.PyMongoError("document too large")
+        return await real_archive_session(user_id, session_id, lease)
+
+    monkeypatch.setattr(archive, "archive_session", archive_session)
+    monkeypatch.setattr(server, "ARCHIVE_BATCH_SESSIONS", 1)
+
+    async def scenario():
+        idle = "2000-01-01T00:00:00+00:00"
+        await mock_db.sessions.insert_many([
+            {"user_id": "alice", "id": sid, "updated_at": idle} for sid in ("broken", "s1", "s2")
+        ])
+        await mock_db.messages.insert_many(messages("alice", "s1", 1) + messages("alice", "s2", 1))
+
+        assert await archive.archive_idle_sessions(max_age_days=1) == 2
+        assert archive.failed == 1
+        assert await mock_db.messages.count_documents({}) == 0
+        broken = await mock_db.sessions.find_one({"id": "broken"})
+        assert "archive_failed_at" in broken and "archived_at" not in broken
+
+        # The next pass leaves the failed session alone until ARCHIVE_RETRY_SECONDS have passed
+        assert await archive.archive_idle_sessions(max_age_days=1) == 0
+        assert archive.failed == 1
+
+    asyncio.run(scenario())
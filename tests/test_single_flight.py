@@ -0,0 +1,79 @@
+"""SingleFlight sharing of results, failures and cancellation between coalesced callers"""
+
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_waiters_share_the_leaders_result():
+    async def scenario():
+        flight = server.SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "done"
+
+        leader = asyncio.create_task(flight.do_shared("chat", {"q": 1}, work))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do_shared("chat", {"q": 1}, work))
+        await asyncio.sleep(0)
+        release.set()
+        assert await leader == ("done", False)
+        assert await waiter == ("done", True)
+        assert calls == [1]
+        assert flight.stats()["duplicates_avoided"] == {"chat": 1}
+
+    asyncio.run(scenario())
+
+
+def test_leader_failure_reaches_every_waiter_and_is_not_cached():
+    async def scenario():
+        flight = server.SingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("provider down")
+
+        callers = [asyncio.create_task(flight.do("chat", {"q": 1}, failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) and str(r) == "provider down" for r in results)
+        assert flight.stats()["in_flight"] == 0
+
+        async def ok():
+            return "recovered"
+
+        # The failed run is gone, so the next caller executes afresh
+        assert await flight.do_shared("chat", {"q": 1}, ok) == ("recovered", False)
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_the_leader_does_not_cancel_the_shared_run():
+    async def scenario():
+        flight = server.SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "done"
+
+        leader = asyncio.create_task(flight.do("chat", {"q": 1}, work))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do_shared("chat", {"q": 1}, work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        release.set()
+        assert await waiter == ("done", True)
+        assert flight.stats()["executions"] == {"chat": 1}
+
+    asyncio.run(scenario())
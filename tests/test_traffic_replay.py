@@ -0,0 +1,34 @@
+"""traffic_replay keeps going when individual requests fail"""
+
+import asyncio
+
+import httpx
+
+import traffic_replay
+
+
+def record(path: str, ts: float) -> dict:
+    return {"ts": ts, "method": "GET", "path": path, "query": "", "headers": {}, "body": None,
+            "status": 200, "duration_ms": 1.0}
+
+
+def test_one_failing_request_does_not_abort_the_replay():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/timeout":
+            raise httpx.ReadTimeout("slow", request=request)
+        if request.url.path == "/api/crash":
+            raise RuntimeError("app blew up")
+        return httpx.Response(200, json={"ok": True})
+
+    records = [record("/api/status", 0.0), record("/api/crash", 0.0), record("/api/timeout", 0.0),
+               record("/api/status", 0.0)]
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://replay") as client:
+            return await traffic_replay.replay(records, client, speed=0, concurrency=2)
+
+    results = asyncio.run(scenario())
+    assert len(results) == 4
+    by_status = sorted((r["status"], r["shape"]) for r in results)
+    assert by_status == [(0, "ReadTimeout"), (0, "RuntimeError"),
+                         (200, {"ok": "bool"}), (200, {"ok": "bool"})]